@@ -0,0 +1,185 @@
+# bench/corpus.py
+"""
+Deterministic synthetic corpus and question workload.
+
+Documents are made of sections of entity-rich sentences ("Acme Labs is
+based in Lund. Acme Labs acquired Norwood Group in 1998."), rendered as
+txt, md (with headings) or pdf (a minimal single-font writer, one page per
+~50 lines, readable by pdfminer). Questions are generated from the same
+facts, so retrieval has something real to find.
+"""
+import json
+import os
+import random
+from typing import Dict, Iterator, List, Tuple
+
+_FIRST = ("Acme", "Borealis", "Cobalt", "Delta", "Evergreen", "Falcon", "Granite", "Helix", "Ion", "Juniper",
+          "Keystone", "Lumen", "Meridian", "Northwind", "Orion", "Pioneer", "Quartz", "Redwood", "Summit", "Titan")
+_SECOND = ("Labs", "Group", "Systems", "Holdings", "Energy", "Robotics", "Foods", "Analytics", "Motors", "Bank")
+_CITIES = ("Berlin", "Lund", "Porto", "Osaka", "Denver", "Lyon", "Tartu", "Austin", "Perth", "Quito")
+_PEOPLE = ("Ada Moreau", "Ben Okafor", "Chen Wei", "Dana Novak", "Eli Haddad", "Farah Iqbal", "Gus Lindqvist",
+           "Hana Sato", "Ivan Petrov", "Jo Mensah")
+_PRODUCTS = ("Atlas", "Beacon", "Comet", "Drift", "Ember", "Flux", "Glyph", "Harbor", "Indigo", "Jet")
+_FILLER = (
+    "The report notes steady growth across all regions during the period.",
+    "Analysts expect further consolidation in the sector over the coming years.",
+    "Operating margins improved as input costs declined.",
+    "The board reviewed the strategy at its annual meeting.",
+    "Several partnerships were announced with regional suppliers.",
+)
+
+# (size name, approximate characters)
+SIZES = (("small", 4_000), ("medium", 40_000), ("large", 400_000))
+FORMATS = ("txt", "md", "pdf")
+
+
+def _company(rng: random.Random) -> str:
+    return f"{rng.choice(_FIRST)} {rng.choice(_SECOND)}"
+
+
+def _fact(rng: random.Random) -> Tuple[str, str, str, str]:
+    """(sentence, subject, relation, object)"""
+    c = _company(rng)
+    kind = rng.randrange(5)
+    if kind == 0:
+        o = rng.choice(_CITIES)
+        return f"{c} is based in {o}.", c, "based in", o
+    if kind == 1:
+        o = rng.choice(_PEOPLE)
+        return f"{c} was founded by {o} in {rng.randrange(1950, 2020)}.", c, "founded by", o
+    if kind == 2:
+        o = _company(rng)
+        return f"{c} acquired {o} for {rng.randrange(2, 900)} million dollars.", c, "acquired", o
+    if kind == 3:
+        o = rng.choice(_PRODUCTS)
+        return f"{c} makes the {o} product line.", c, "makes", o
+    o = rng.choice(_PEOPLE)
+    return f"{o} is the chief executive of {c}.", o, "chief executive of", c
+
+
+def _sections(rng: random.Random, chars: int, facts: List[Tuple[str, str, str]]) -> Iterator[Tuple[str, List[str]]]:
+    size = 0
+    n = 0
+    while size < chars:
+        n += 1
+        paras: List[str] = []
+        for _ in range(rng.randrange(2, 5)):
+            sents: List[str] = []
+            for _ in range(rng.randrange(3, 7)):
+                if rng.random() < 0.6:
+                    s, subj, rel, obj = _fact(rng)
+                    facts.append((subj, rel, obj))
+                else:
+                    s = rng.choice(_FILLER)
+                sents.append(s)
+            paras.append(" ".join(sents))
+            size += len(paras[-1])
+        yield f"Section {n} {rng.choice(_FIRST)} Review", paras
+
+
+def render_pdf(lines: List[str], lines_per_page: int = 50) -> bytes:
+    """Minimal PDF 1.4: Helvetica 10pt, one text object per page."""
+    def esc(s: str) -> str:
+        s = s.encode("latin-1", "replace").decode("latin-1")
+        return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objs: List[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        ops = ["BT", "/F1 10 Tf", "12 TL", "50 760 Td"] + [f"({esc(ln)}) Tj T*" for ln in page] + ["ET"]
+        stream = "\n".join(ops).encode("latin-1")
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content = len(objs)
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {content} 0 R "
+                    f"/Resources << /Font << /F1 3 0 R >> >> >>".encode("latin-1"))
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode("latin-1")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    return bytes(out)
+
+
+def _wrap(text: str, width: int = 95) -> List[str]:
+    lines, cur = [], ""
+    for w in text.split():
+        if cur and len(cur) + 1 + len(w) > width:
+            lines.append(cur)
+            cur = w
+        else:
+            cur = f"{cur} {w}" if cur else w
+    if cur:
+        lines.append(cur)
+    return lines
+
+
+def render(fmt: str, sections: List[Tuple[str, List[str]]]) -> bytes:
+    if fmt == "md":
+        return "\n\n".join(f"## {h}\n\n" + "\n\n".join(ps) for h, ps in sections).encode("utf-8")
+    if fmt == "pdf":
+        lines: List[str] = []
+        for h, ps in sections:
+            lines += [h, ""]
+            for p in ps:
+                lines += _wrap(p) + [""]
+        return render_pdf(lines)
+    return "\n\n".join(f"{h}\n\n" + "\n\n".join(ps) for h, ps in sections).encode("utf-8")
+
+
+def generate(out_dir: str, docs_per_cell: int = 1, sizes=SIZES, formats=FORMATS,
+             seed: int = 7) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+    """Write docs_per_cell documents per (size, format) into out_dir; returns (paths, facts)."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths: List[str] = []
+    facts: List[Tuple[str, str, str]] = []
+    for size, chars in sizes:
+        for fmt in formats:
+            for i in range(docs_per_cell):
+                sections = list(_sections(rng, chars, facts))
+                path = os.path.join(out_dir, f"{size}_{i}.{fmt}")
+                with open(path, "wb") as f:
+                    f.write(render(fmt, sections))
+                paths.append(path)
+    return paths, facts
+
+
+_TEMPLATES: Dict[str, str] = {
+    "based in": "Where is {s} based?",
+    "founded by": "Who founded {s}?",
+    "acquired": "Which company did {s} acquire?",
+    "makes": "What product line does {s} make?",
+    "chief executive of": "Which company is {s} the chief executive of?",
+}
+
+
+def questions(facts: List[Tuple[str, str, str]], n: int, seed: int = 11) -> List[str]:
+    rng = random.Random(seed)
+    pool = [_TEMPLATES[rel].format(s=s) for s, rel, _ in facts if rel in _TEMPLATES]
+    return [rng.choice(pool) for _ in range(n)] if pool else []
+
+
+def load_questions(path: str) -> List[str]:
+    """JSON lines with a "question" field (or plain text, one question per line)."""
+    out: List[str] = []
+    with open(path, encoding="utf-8") as f:
+        for ln in f:
+            ln = ln.strip()
+            if not ln:
+                continue
+            try:
+                obj = json.loads(ln)
+            except ValueError:
+                obj = ln
+            q = obj.get("question") if isinstance(obj, dict) else obj
+            if isinstance(q, str) and q.strip():
+                out.append(q.strip())
+    return out
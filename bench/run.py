@@ -0,0 +1,258 @@
+# bench/run.py
+"""
+End-to-end ingest + query benchmark against kg_common with local stand-ins.
+
+    python bench/run.py                              # synthetic corpus, 200 questions
+    python bench/run.py --corpus ./samples --questions q.jsonl
+    python bench/run.py --model /models/tiny.gguf    # real llama.cpp instead of the stub LLM
+    python bench/run.py --json out.json --baseline last.json --tolerance 0.2
+
+Backends: Qdrant in memory, an rdflib SPARQL endpoint, a stub chat server
+(or --model), fakeredis (or --redis-url; keys are written there). The
+embedding engine is whatever EMBED_BACKEND says (--embed hash for smoke runs).
+Reports ingest chunks/s and triples/s with per-phase timings, ask latency
+p50/p95/p99, time to first token and peak RSS. With --baseline, exits 1 if
+a throughput drops or a latency grows by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "services", "common"))
+
+import corpus  # noqa: E402
+import standins  # noqa: E402
+
+# (metric, True if higher is better) checked against --baseline
+TRACKED = (
+    ("ingest.chunks_per_s", True),
+    ("ingest.triples_per_s", True),
+    ("ask.p50_ms", False),
+    ("ask.p95_ms", False),
+    ("ask.ttft_p50_ms", False),
+    ("peak_rss_mb", False),
+)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(p) - 1]
+
+
+def configure(args) -> Dict[str, object]:
+    """Start the stand-ins and point kg_common's settings at them (before importing it)."""
+    up: Dict[str, object] = {}
+    sparql = standins.SparqlStandIn().start()
+    up["sparql"] = sparql
+    os.environ["FUSEKI_URL"] = sparql.url
+    os.environ["FUSEKI_DATASET"] = "kg"
+
+    if args.model:
+        os.environ["LLM_SERVER_URL"] = ""
+        os.environ["MODEL_PATH"] = args.model
+        os.environ.setdefault("TOKENIZER_PATH", args.model)
+    else:
+        llm = standins.LLMStandIn(args.llm_prefill_tps, args.llm_decode_tps).start()
+        up["llm"] = llm
+        os.environ["LLM_SERVER_URL"] = llm.url
+        os.environ.setdefault("LLM_SLOTS", "4")
+
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+        os.environ["EMBED_CACHE_REDIS_URL"] = args.redis_url
+    elif standins.fake_redis() is None:
+        sys.exit("fakeredis is not installed: pip install fakeredis, or pass --redis-url")
+
+    if args.embed:
+        os.environ["EMBED_BACKEND"] = args.embed
+    os.environ["EMBED_CACHE"] = "redis" if args.embed_cache else "off"
+    os.environ["ANSWER_CACHE_MAX"] = "1024" if args.answer_cache else "0"
+    os.environ["ENTITY_INDEX"] = "1"
+    os.environ.setdefault("QDRANT_COLLECTION", "bench")
+    return up
+
+
+def run_ingest(paths: List[str]) -> Dict[str, object]:
+    from kg_common.ingest import process_file
+
+    phases: Dict[str, float] = {}
+    docs = []
+    t0 = time.perf_counter()
+    for i, path in enumerate(paths):
+        t = time.perf_counter()
+        res = process_file(path, f"bench_{i}", filename=os.path.basename(path))
+        docs.append({
+            "file": os.path.basename(path),
+            "bytes": os.path.getsize(path),
+            "chunks": res["chunks"],
+            "triples": res["triples"],
+            "seconds": round(time.perf_counter() - t, 4),
+        })
+        for k, v in res["timings"].items():
+            phases[k] = phases.get(k, 0.0) + v
+    wall = time.perf_counter() - t0
+    chunks = sum(d["chunks"] for d in docs)
+    triples = sum(d["triples"] for d in docs)
+    return {
+        "documents": len(docs),
+        "bytes": sum(d["bytes"] for d in docs),
+        "chunks": chunks,
+        "triples": triples,
+        "seconds": round(wall, 3),
+        "chunks_per_s": round(chunks / wall, 2) if wall else 0.0,
+        "triples_per_s": round(triples / wall, 2) if wall else 0.0,
+        "phases_s": {k: round(v, 3) for k, v in sorted(phases.items())},
+        "per_doc": docs,
+    }
+
+
+def _ask_one(question: str, top_k: int):
+    from kg_common.query import answer_stream
+
+    t0 = time.perf_counter()
+    ttft = None
+    n_ctx = 0
+    for ev in answer_stream(question, top_k=top_k):
+        if ev["event"] == "contexts":
+            n_ctx = len(ev["contexts"])
+        elif ev["event"] == "token" and ttft is None:
+            ttft = time.perf_counter() - t0
+    total = time.perf_counter() - t0
+    return total, ttft if ttft is not None else total, n_ctx
+
+
+def run_queries(qs: List[str], top_k: int, concurrency: int, warmup: int) -> Dict[str, object]:
+    for q in qs[:warmup]:
+        _ask_one(q, top_k)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        results = list(pool.map(lambda q: _ask_one(q, top_k), qs))
+    wall = time.perf_counter() - t0
+    lat = [r[0] * 1000 for r in results]
+    ttft = [r[1] * 1000 for r in results]
+    return {
+        "questions": len(qs),
+        "concurrency": concurrency,
+        "seconds": round(wall, 3),
+        "qps": round(len(qs) / wall, 2) if wall else 0.0,
+        "p50_ms": round(pct(lat, 50), 2),
+        "p95_ms": round(pct(lat, 95), 2),
+        "p99_ms": round(pct(lat, 99), 2),
+        "ttft_p50_ms": round(pct(ttft, 50), 2),
+        "ttft_p95_ms": round(pct(ttft, 95), 2),
+        "contexts_mean": round(statistics.fmean(r[2] for r in results), 2) if results else 0.0,
+    }
+
+
+def _get(report: Dict, dotted: str):
+    for part in dotted.split("."):
+        report = report.get(part, {}) if isinstance(report, dict) else {}
+    return report if isinstance(report, (int, float)) else None
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions beyond `tolerance` (a fraction) versus a previous --json report."""
+    out = []
+    for key, higher_better in TRACKED:
+        new, old = _get(report, key), _get(baseline, key)
+        if not new or not old:
+            continue
+        change = (new - old) / old
+        if (higher_better and change < -tolerance) or (not higher_better and change > tolerance):
+            out.append(f"{key}: {old} -> {new} ({change:+.0%})")
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", help="directory of .txt/.md/.pdf files (default: generated)")
+    ap.add_argument("--docs-per-size", type=int, default=1, help="generated documents per size and format")
+    ap.add_argument("--questions", help="JSON lines with a 'question' field (default: generated)")
+    ap.add_argument("--n-questions", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=8)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--warmup", type=int, default=5)
+    ap.add_argument("--model", help="GGUF to run in-process instead of the stub LLM server")
+    ap.add_argument("--llm-prefill-tps", type=float, default=0.0, help="stub LLM prompt tokens/s (0 = instant)")
+    ap.add_argument("--llm-decode-tps", type=float, default=0.0, help="stub LLM output tokens/s (0 = instant)")
+    ap.add_argument("--embed", help="EMBED_BACKEND override (e.g. hash)")
+    ap.add_argument("--embed-cache", action="store_true", help="keep the embedding cache on")
+    ap.add_argument("--answer-cache", action="store_true", help="keep the answer cache on")
+    ap.add_argument("--redis-url", help="real Redis instead of fakeredis")
+    ap.add_argument("--json", help="write the report here")
+    ap.add_argument("--baseline", help="previous --json report to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args(argv)
+
+    up = configure(args)
+    standins.memory_qdrant()
+
+    with tempfile.TemporaryDirectory(prefix="kg-bench-") as tmp:
+        if args.corpus:
+            paths = sorted(
+                os.path.join(args.corpus, f) for f in os.listdir(args.corpus)
+                if f.lower().endswith((".txt", ".md", ".pdf"))
+            )
+            facts = []
+        else:
+            paths, facts = corpus.generate(tmp, docs_per_cell=args.docs_per_size)
+        if not paths:
+            sys.exit("no documents to ingest")
+
+        report: Dict[str, object] = {"ingest": run_ingest(paths)}
+        report["rss_after_ingest_mb"] = round(peak_rss_mb(), 1)
+
+    from kg_common import entity_index
+    entity_index.refresh(force=True)
+
+    if args.questions:
+        qs = corpus.load_questions(args.questions)[: args.n_questions]
+    else:
+        qs = corpus.questions(facts, args.n_questions)
+    if qs:
+        report["ask"] = run_queries(qs, args.top_k, args.concurrency, args.warmup)
+    report["kg_triples_stored"] = up["sparql"].triples()
+    report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+
+    ing = report["ingest"]
+    print(f"ingest  {ing['documents']} docs, {ing['bytes'] / 1e6:.1f} MB in {ing['seconds']} s: "
+          f"{ing['chunks_per_s']} chunks/s, {ing['triples_per_s']} triples/s")
+    print("        phases (s): " + ", ".join(f"{k}={v}" for k, v in ing["phases_s"].items()))
+    if "ask" in report:
+        a = report["ask"]
+        print(f"ask     {a['questions']} questions x{a['concurrency']}: p50 {a['p50_ms']} ms, p95 {a['p95_ms']} ms, "
+              f"p99 {a['p99_ms']} ms, ttft p50 {a['ttft_p50_ms']} ms, {a['qps']} q/s")
+    print(f"memory  peak RSS {report['peak_rss_mb']} MB (after ingest {report['rss_after_ingest_mb']} MB)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# bench/standins.py
+"""
+Local stand-ins for the backing services, so the real kg_common code paths
+(HTTP clients included) run without docker:
+
+- SparqlStandIn: Fuseki-compatible /{dataset}/query, /update and /data
+  (Graph Store Protocol) over an in-process rdflib Dataset
+- LLMStandIn: llama.cpp-server-compatible /v1/chat/completions that answers
+  triple-extraction prompts with "(s) | (p) | (o)" lines built from the text
+  and questions with words from the context; prefill/decode speed can be
+  simulated with --llm-prefill-tps / --llm-decode-tps
+- memory_qdrant(): QdrantClient(":memory:") installed as kg_common's shared client
+- fake_redis(): every redis.Redis.from_url() returns one shared fakeredis server
+
+Servers bind 127.0.0.1 on a free port and run on daemon threads.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+_CAP = re.compile(r"\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*")
+_WORD = re.compile(r"[A-Za-z][\w-]+")
+
+
+class _Server:
+    handler = BaseHTTPRequestHandler
+
+    def __init__(self):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        self._httpd.daemon_threads = True
+        self._httpd.standin = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):  # keep the benchmark output clean
+        pass
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def _body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _send(self, status: int, body: bytes = b"", ctype: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+
+# -------------------- SPARQL (rdflib) --------------------
+class _SparqlHandler(_Handler):
+    def _route(self):
+        url = urlparse(self.path)
+        return url.path.rstrip("/").rsplit("/", 1)[-1], parse_qs(url.query, keep_blank_values=True)
+
+    def _graph(self, params):
+        from rdflib import URIRef
+        ds = self.standin.dataset
+        if "graph" in params:
+            return ds.graph(URIRef(params["graph"][0]))
+        return ds.default_context
+
+    def do_POST(self):
+        op, params = self._route()
+        body = self._body()
+        st = self.standin
+        try:
+            if op == "query":
+                form = parse_qs(body.decode("utf-8"))
+                with st.lock:
+                    res = st.dataset.query(form["query"][0])
+                    out = res.serialize(format="json")
+                return self._send(200, out, "application/sparql-results+json")
+            if op == "update":
+                form = parse_qs(body.decode("utf-8"))
+                with st.lock:
+                    st.dataset.update(form["update"][0])
+                return self._send(204)
+            if op == "data":
+                with st.lock:
+                    self._graph(params).parse(data=body.decode("utf-8"), format="nt")
+                return self._send(204)
+        except Exception as e:
+            return self._send(400, repr(e).encode("utf-8"), "text/plain")
+        self._send(404)
+
+    def do_PUT(self):
+        op, params = self._route()
+        body = self._body()
+        if op != "data":
+            return self._send(404)
+        st = self.standin
+        with st.lock:
+            g = self._graph(params)
+            g.remove((None, None, None))
+            g.parse(data=body.decode("utf-8"), format="nt")
+        self._send(204)
+
+    def do_DELETE(self):
+        from rdflib import URIRef
+        op, params = self._route()
+        if op != "data" or "graph" not in params:
+            return self._send(404)
+        st = self.standin
+        with st.lock:
+            name = URIRef(params["graph"][0])
+            if not len(st.dataset.graph(name)):
+                return self._send(404)
+            st.dataset.remove_graph(name)
+        self._send(204)
+
+
+class SparqlStandIn(_Server):
+    handler = _SparqlHandler
+
+    def __init__(self):
+        from rdflib import Dataset
+        super().__init__()
+        self.dataset = Dataset()
+        self.lock = threading.Lock()
+
+    def triples(self) -> int:
+        with self.lock:
+            return sum(len(g) for g in self.dataset.graphs())
+
+
+# -------------------- LLM --------------------
+def _fake_triples(text: str, limit: int = 8) -> List[str]:
+    """Pairs of consecutive capitalized phrases per sentence, as extraction lines."""
+    out: List[str] = []
+    for sent in re.split(r"(?<=[.!?])\s+", text):
+        names = _CAP.findall(sent)
+        for a, b in zip(names, names[1:]):
+            verb = next((w for w in _WORD.findall(sent.split(b, 1)[0].split(a, 1)[-1]) if w.islower()), "related_to")
+            out.append(f"({a}) | ({verb}) | ({b})")
+            if len(out) >= limit:
+                return out
+    return out
+
+
+class _LLMHandler(_Handler):
+    def do_POST(self):
+        if not self.path.startswith("/v1/chat/completions"):
+            return self._send(404)
+        req = json.loads(self._body() or b"{}")
+        msgs = req.get("messages") or []
+        system = next((m["content"] for m in msgs if m.get("role") == "system"), "")
+        user = next((m["content"] for m in reversed(msgs) if m.get("role") == "user"), "")
+        st = self.standin
+        pieces = st.reply(system, user, int(req.get("max_tokens") or 64))
+
+        # prefill is paid before the first token, decode per token
+        st.sleep_tokens((len(system) + len(user)) // 4, st.prefill_tps)
+        if not req.get("stream"):
+            st.sleep_tokens(len(pieces), st.decode_tps)
+            body = {"choices": [{"message": {"role": "assistant", "content": "".join(pieces)}}]}
+            return self._send(200, json.dumps(body).encode("utf-8"))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for p in pieces:
+            st.sleep_tokens(1, st.decode_tps)
+            self.wfile.write(f"data: {json.dumps({'choices': [{'delta': {'content': p}}]})}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class LLMStandIn(_Server):
+    handler = _LLMHandler
+
+    def __init__(self, prefill_tps: float = 0.0, decode_tps: float = 0.0):
+        super().__init__()
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+
+    @staticmethod
+    def sleep_tokens(n: int, tps: float):
+        if tps > 0 and n > 0:
+            time.sleep(n / tps)
+
+    def reply(self, system: str, user: str, max_tokens: int) -> List[str]:
+        """Token-sized pieces of the canned reply."""
+        if "triples" in system:
+            text = "\n".join(_fake_triples(user))
+        else:
+            ctx = user.split("CONTEXT:", 1)[-1].split("QUESTION:", 1)[0]
+            text = " ".join(_WORD.findall(ctx)[:max_tokens]) or "I don't know based on the provided documents."
+        pieces = re.findall(r"\S+\s*|\n", text)
+        return pieces[:max_tokens]
+
+
+# -------------------- Qdrant / Redis --------------------
+def memory_qdrant():
+    """Make kg_common.clients.qdrant() return one in-memory client for this process."""
+    import os
+    from qdrant_client import QdrantClient
+    from kg_common import clients
+
+    with clients._lock:
+        clients._pid = os.getpid()
+        clients._qdrant = clients._TimedQdrant(QdrantClient(":memory:"))
+    return clients._qdrant
+
+
+def fake_redis() -> Optional[object]:
+    """
+    Route redis.Redis.from_url() to one shared fakeredis server. Must run
+    before kg_common is imported (ingest connects at import time).
+    Returns None when fakeredis is not installed.
+    """
+    try:
+        import fakeredis
+    except ImportError:
+        return None
+    import redis
+
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeRedis(server=server, decode_responses=kwargs.get("decode_responses", False))
+
+    redis.Redis.from_url = staticmethod(from_url)
+    return server
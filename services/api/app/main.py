@@ -1,16 +1,20 @@
 # services/api/app/main.py
 import os
+import glob
+import asyncio
+import json
+import math
+import time
 import uuid
+import hashlib
 import logging
-from typing import Optional
+from datetime import datetime, timezone
+from typing import List, Optional
 
-import redis
-import requests
-from requests.auth import HTTPBasicAuth
-
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends, Request, Response
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends, Request, Response, BackgroundTasks
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.concurrency import run_in_threadpool
 
 from celery import Celery
 from pydantic import BaseModel
@@ -19,7 +23,21 @@ from pydantic import BaseModel
 from . import __init__ as _  # noqa: F401
 
 # QA / RAG function
-from kg_common.query import answer as answer_fn
+from kg_common.query import answer_async as answer_fn
+from kg_common.query import answer_stream as answer_stream_fn
+from kg_common.answer_cache import bump_corpus_version_async
+from kg_common.scheduler import SchedulerBusy, DeadlineExceeded, deadline_in
+from kg_common import entity_index
+from kg_common.documents import (
+    DOC_NAME_KEY, adelete_document, aresolve_identity, doc_key, name_field, valid_doc_id, valid_tenant,
+)
+from kg_common.vector import SearchFilter
+from kg_common.config import LOG_LEVEL, WORKER_HEARTBEAT_S, BULK_DIR_ROOT, BULK_MAX_MB
+from kg_common.bulk import ALLOWED as BULK_ALLOWED, BulkLoader, is_archive, load as bulk_load, new_batch
+from kg_common.bulk import status as bulk_status
+from kg_common.queues import Q_INGEST, WORKERS_KEY, configure as configure_queues, upload_priority
+from kg_common import tracing, warmup
+from kg_common.aio import asparql_select, asparql_update, async_redis, aclose as aio_close
 
 # metrics
 from time import perf_counter
@@ -31,9 +49,7 @@ from prometheus_client import Counter, Histogram
 API_TOKEN   = os.getenv("API_AUTH_TOKEN", "super-secret-token")
 UPLOAD_DIR  = os.getenv("UPLOAD_DIR", "/ingest")
 MAX_MB      = int(os.getenv("UPLOAD_MAX_MB", "50"))
-
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
-_r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+ASK_DEADLINE_S = float(os.getenv("ASK_DEADLINE_S", os.getenv("LLM_DEADLINE_S", "60")))
 
 # Celery broker/backend (Redis)
 BROKER_URL  = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
@@ -43,21 +59,17 @@ BACKEND_URL = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
 BROKER_URL  += "?socket_connect_timeout=3&socket_timeout=3&health_check_interval=5"
 BACKEND_URL += "?socket_connect_timeout=3&socket_timeout=3&health_check_interval=5"
 
-# Fuseki config
-FUSEKI_BASE    = os.getenv("FUSEKI_URL", "http://fuseki:3030")  # base host:port
-FUSEKI_DATASET = os.getenv("FUSEKI_DATASET", "kg")
-FUSEKI_USER    = os.getenv("FUSEKI_USER", "admin")
-FUSEKI_PASS    = os.getenv("FUSEKI_PASSWORD", os.getenv("ADMIN_PASSWORD", "admin"))
-
 # -------------------- Celery --------------------
 celery = Celery("kg_worker", broker=BROKER_URL, backend=BACKEND_URL)
 celery.conf.broker_connection_retry_on_startup = True
 celery.conf.broker_connection_max_retries = 3
 celery.conf.broker_transport_options = {"max_retries": 3, "interval_start": 0, "interval_step": 1, "interval_max": 3}
 celery.conf.result_expires = 3600
+configure_queues(celery)
 
 
 # -------------------- Metrics --------------------
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 log = logging.getLogger("api")
 REQ_COUNT = Counter("api_requests_total", "Total API requests", ["path", "method", "status"])
 REQ_LAT   = Histogram("api_request_duration_seconds", "API latency", ["path", "method"])
@@ -70,20 +82,44 @@ app = FastAPI(title="KG Chatbot API", version="0.1.0")
 class AccessLogMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         start = perf_counter()
+        code = 500
         try:
-            response = await call_next(request)
+            with tracing.span(f"{request.method} {request.url.path}", **{"http.method": request.method}):
+                response = await call_next(request)
             code = response.status_code
-        except Exception:
-            code = 500
-            raise
         finally:
-            dur = (perf_counter() - start) * 1000.0
-            print(f'[api] {request.method} {request.url.path} -> {code} ({dur:.1f} ms)')
+            dur = perf_counter() - start
+            # route template, not the raw path, keeps label cardinality bounded
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            REQ_COUNT.labels(route, request.method, str(code)).inc()
+            REQ_LAT.labels(route, request.method).observe(dur)
+            log.info("%s %s -> %s (%.1f ms)", request.method, request.url.path, code, dur * 1000.0)
         return response
 
 app.add_middleware(AccessLogMiddleware)
 
 
+_startup = {"entity_index": False, "task": None}
+
+@app.on_event("startup")
+async def _start():
+    tracing.setup("kg-api")
+    # models and the entity index load in the background: /api/health answers at
+    # once, /api/ready when they are warm (route traffic on that)
+    _startup["task"] = asyncio.create_task(_warm_up())
+
+async def _warm_up():
+    # initial load off-loop, then a daemon thread follows ingestion
+    await run_in_threadpool(entity_index.start_refresher)
+    _startup["entity_index"] = True
+    await run_in_threadpool(warmup.warm)
+
+
+@app.on_event("shutdown")
+async def _close_clients():
+    await aio_close()
+
+
 def check_auth(authorization: Optional[str] = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing Authorization header")
@@ -96,62 +132,171 @@ def check_auth(authorization: Optional[str] = Header(None)):
 
 
 # -------------------- SPARQL helpers --------------------
-def _sparql_query(q: str, timeout=20):
-    url = f"{FUSEKI_BASE}/{FUSEKI_DATASET}/query"
-    r = requests.get(url, params={"query": q}, timeout=timeout)
-    r.raise_for_status()
-    ctype = r.headers.get("content-type", "")
-    return r.json() if ctype.startswith("application/sparql-results+json") else r.text
-
-def _sparql_update(u: str, timeout=30):
-    url = f"{FUSEKI_BASE}/{FUSEKI_DATASET}/update"
-    auth = HTTPBasicAuth(FUSEKI_USER, FUSEKI_PASS) if FUSEKI_USER or FUSEKI_PASS else None
-    r = requests.post(url, data={"update": u}, auth=auth, timeout=timeout)
-    r.raise_for_status()
-    return True
+# async pooled clients + latency histograms live in kg_common.aio
+async def _sparql_query(q: str, timeout=20):
+    return await asparql_select(q, timeout=timeout)
+
+async def _sparql_update(u: str, timeout=30):
+    return await asparql_update(u, timeout=timeout)
+
+
+def _overloaded(e) -> HTTPException:
+    """Scheduler backpressure -> 429 (queue full) / 503 (deadline) with Retry-After."""
+    status = 429 if isinstance(e, SchedulerBusy) else 503
+    return HTTPException(status, str(e), headers={"Retry-After": str(int(math.ceil(e.retry_after)))})
+
+
+def _clean_tags(tags) -> List[str]:
+    out = sorted({t.strip() for t in tags if t and t.strip()})
+    if any(len(t) > 64 for t in out):
+        raise HTTPException(400, "tags are limited to 64 characters")
+    return out
+
+
+_alive = {"until": 0.0, "ok": False}
+
+async def _workers_alive() -> bool:
+    """Any worker heartbeat in the last 3 beats; a positive answer is reused for one beat."""
+    now = perf_counter()
+    if _alive["ok"] and now < _alive["until"]:
+        return True
+    n = await async_redis().zcount(WORKERS_KEY, time.time() - 3 * WORKER_HEARTBEAT_S, "+inf")
+    _alive.update(ok=n > 0, until=now + WORKER_HEARTBEAT_S)
+    return n > 0
+
+async def _require_workers():
+    """Quick worker sanity check (heartbeats in Redis, cached; no broadcast round-trip)."""
+    try:
+        alive = await _workers_alive()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Queue unavailable: {e}")
+    if not alive:
+        raise HTTPException(status_code=503, detail="Queue unavailable: no live workers")
 
 
 # -------------------- Models --------------------
+def _epoch(dt: Optional[datetime]) -> Optional[int]:
+    # a date without an offset is UTC (uploaded_at is), not the server's local time
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
 class AskBody(BaseModel):
     question: str
     top_k: int = int(os.getenv("TOP_K", "8"))
+    # optional scope: only chunks matching every given field are retrieved
+    doc_ids: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    tenant: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+
+    def filters(self) -> Optional[SearchFilter]:
+        if any(not valid_doc_id(d) for d in self.doc_ids or ()):
+            raise HTTPException(400, "doc_ids must match [A-Za-z0-9_-]{1,64}")
+        if self.tenant is not None and not valid_tenant(self.tenant):
+            raise HTTPException(400, "tenant must match [A-Za-z0-9_-]{1,64}")
+        flt = SearchFilter.of(
+            doc_ids=self.doc_ids,
+            tags=_clean_tags(self.tags or ()),
+            tenant=self.tenant,
+            date_from=_epoch(self.date_from),
+            date_to=_epoch(self.date_to),
+        )
+        return flt or None
 
 class ChatBody(BaseModel):
     message: str
     top_k: int = int(os.getenv("TOP_K", "8"))
 
+class BulkDirBody(BaseModel):
+    path: str                       # relative to BULK_DIR_ROOT
+    tags: Optional[List[str]] = None
+    tenant: Optional[str] = None
+    recursive: bool = True
+    replace: bool = False           # same name as an earlier document -> re-ingest it
+
 
 # -------------------- Routes --------------------
 @app.post("/api/ask")
-def ask(body: AskBody, authorization: Optional[str] = Header(None)):
+async def ask(body: AskBody, authorization: Optional[str] = Header(None)):
     q = (body.question or "").strip()
     if not q:
         raise HTTPException(400, "question is empty")
+    filters = body.filters()
     t0 = perf_counter()
     try:
-        out = answer_fn(q, top_k=body.top_k)
+        out = await answer_fn(q, top_k=body.top_k, deadline=deadline_in(ASK_DEADLINE_S), filters=filters)
+    except (SchedulerBusy, DeadlineExceeded) as e:
+        raise _overloaded(e)
     except Exception as e:
         log.exception("ask failed")
         raise HTTPException(500, f"ask failed: {e!r}")
     dt = (perf_counter() - t0) * 1000
-    print(f"[api] ASK '{q[:80]}' -> {dt:.1f} ms, ctx={len(out.get('contexts', []))}")
+    log.info("ASK %r -> %.1f ms, ctx=%d", q[:80], dt, len(out.get("contexts", [])))
     return out
 
 
+@app.post("/api/ask/stream")
+def ask_stream(body: AskBody, authorization: Optional[str] = Header(None)):
+    """
+    Server-Sent Events: one `contexts` event, then `token` events as they are
+    decoded, then `done` (or `error`).
+    """
+    q = (body.question or "").strip()
+    if not q:
+        raise HTTPException(400, "question is empty")
+
+    stream = answer_stream_fn(q, top_k=body.top_k, deadline=deadline_in(ASK_DEADLINE_S), filters=body.filters())
+    t0 = perf_counter()
+    # pull the contexts event now so admission errors still become a 429/503
+    try:
+        first = next(stream)
+    except (SchedulerBusy, DeadlineExceeded) as e:
+        raise _overloaded(e)
+    except Exception as e:
+        log.exception("ask stream failed")
+        raise HTTPException(500, f"ask failed: {e!r}")
+
+    def sse(ev) -> str:
+        return f"event: {ev['event']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+
+    def events():
+        yield sse(first)
+        try:
+            for ev in stream:
+                yield sse(ev)
+        except Exception as e:
+            log.exception("ask stream failed")
+            yield sse({"event": "error", "detail": repr(e)})
+        dt = (perf_counter() - t0) * 1000
+        log.info("ASK-STREAM %r -> %.1f ms", q[:80], dt)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/api/chat")
-def chat(body: ChatBody, authorization: Optional[str] = Header(None)):
+async def chat(body: ChatBody, authorization: Optional[str] = Header(None)):
     """Compatibility endpoint: forwards to the same logic as /api/ask."""
     q = (body.message or "").strip()
     if not q:
         raise HTTPException(400, "message is empty")
     t0 = perf_counter()
     try:
-        out = answer_fn(q, top_k=body.top_k)
+        out = await answer_fn(q, top_k=body.top_k, deadline=deadline_in(ASK_DEADLINE_S))
+    except (SchedulerBusy, DeadlineExceeded) as e:
+        raise _overloaded(e)
     except Exception as e:
         log.exception("ask failed")
         raise HTTPException(500, f"ask failed: {e!r}")
     dt = (perf_counter() - t0) * 1000
-    print(f"[api] CHAT '{q[:80]}' -> {dt:.1f} ms, ctx={len(out.get('contexts', []))}")
+    log.info("CHAT %r -> %.1f ms, ctx=%d", q[:80], dt, len(out.get("contexts", [])))
     return out
 
 
@@ -160,6 +305,14 @@ def health():
     return {"ok": True}
 
 
+@app.get("/api/ready")
+def ready():
+    """Readiness: 200 once the models are loaded and warm, 503 before (liveness is /api/health)."""
+    st = warmup.status()
+    st["entity_index"] = _startup["entity_index"]
+    return JSONResponse(st, status_code=200 if st["ready"] else 503)
+
+
 @app.get("/api/metrics_prom")
 def metrics_prom():
     data = generate_latest()
@@ -174,20 +327,34 @@ def metrics_text():
 
 
 @app.post("/api/upload")
-async def upload(file: UploadFile = File(...), _ok: bool = Depends(check_auth)):
+async def upload(file: UploadFile = File(...), doc_id: Optional[str] = None, tags: Optional[str] = None,
+                 tenant: Optional[str] = None, replace: bool = False, _ok: bool = Depends(check_auth)):
+    """
+    Identical content (sha256) with the same tags is not re-ingested.
+    An explicit `doc_id`, or `replace=1` for the doc_id of the last upload
+    with the same file name, re-ingests that document incrementally; other
+    uploads are new documents with a doc_id derived from their content hash
+    (a shared name like report.pdf does not replace an unrelated document).
+    `tags` (comma-separated) and `tenant` scope the document for /api/ask
+    filters; content and name identity are per tenant.
+    """
     allowed = (".txt", ".md", ".pdf")
     if not file.filename.lower().endswith(allowed):
         raise HTTPException(400, f"Only {allowed} supported")
+    if doc_id is not None and not valid_doc_id(doc_id):
+        raise HTTPException(400, "doc_id must match [A-Za-z0-9_-]{1,64}")
+    if tenant is not None and not valid_tenant(tenant):
+        raise HTTPException(400, "tenant must match [A-Za-z0-9_-]{1,64}")
+    tag_list = _clean_tags((tags or "").split(","))
 
     os.makedirs(UPLOAD_DIR, exist_ok=True)
+    name = os.path.basename(file.filename)
+    tmp_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
 
-    doc_id = uuid.uuid4().hex
-    safe_name = f"{doc_id}__{os.path.basename(file.filename)}"
-    dest_path = os.path.join(UPLOAD_DIR, safe_name)
-
-    # Stream to disk with size guard
+    # Stream to disk with size guard, hashing as we go
     size = 0
-    with open(dest_path, "wb") as out:
+    sha = hashlib.sha256()
+    with open(tmp_path, "wb") as out:
         while True:
             chunk = await file.read(1024 * 1024)  # 1MB
             if not chunk:
@@ -196,45 +363,179 @@ async def upload(file: UploadFile = File(...), _ok: bool = Depends(check_auth)):
             if size > MAX_MB * 1024 * 1024:
                 out.close()
                 try:
-                    os.remove(dest_path)
+                    os.remove(tmp_path)
                 except Exception:
                     pass
                 raise HTTPException(413, f"File exceeds {MAX_MB}MB limit")
+            sha.update(chunk)
             out.write(chunk)
-
-    # Quick broker/worker sanity check
+    content_hash = sha.hexdigest()
+
+    r = async_redis()
+    outcome, doc_id = await aresolve_identity(r, content_hash, name, tag_list, tenant, doc_id=doc_id, replace=replace)
+    if outcome == "unchanged":
+        os.remove(tmp_path)
+        return {"task_id": None, "doc_id": doc_id, "status": "unchanged"}
+    # before the move: a reused doc_id's source file must survive a 503
     try:
-        _ = celery.control.ping(timeout=1.0)
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Queue unavailable: {e}")
-
-    # Enqueue background processing; worker signature is (filename, doc_id)
+        await _require_workers()
+    except HTTPException:
+        os.remove(tmp_path)
+        raise
+    dest_path = os.path.join(UPLOAD_DIR, f"{doc_id}__{name}")
+    os.replace(tmp_path, dest_path)
+
+    # Enqueue background processing; worker signature is (path, doc_id, content_hash, tags, tenant, trace)
     try:
-        task = celery.send_task("tasks.process_path", args=[dest_path, doc_id])
-        return {"task_id": task.id, "doc_id": doc_id}
+        task = await run_in_threadpool(
+            celery.send_task, "tasks.process_path", args=[dest_path, doc_id],
+            kwargs={"content_hash": content_hash, "tags": tag_list, "tenant": tenant, "trace": tracing.inject()},
+            queue=Q_INGEST, priority=upload_priority(size),
+        )
     except Exception as e:
+        os.remove(dest_path)
         raise HTTPException(status_code=503, detail=f"Queue send failed: {e}")
+    await r.hset(DOC_NAME_KEY, name_field(name, tenant), doc_id)
+    return {"task_id": task.id, "doc_id": doc_id, "status": "queued"}
+
+
+def _run_bulk(batch_id: str, sources: List[str], tags: List[str], tenant: Optional[str],
+              names: Optional[dict] = None, recursive: bool = True, cleanup: bool = False, replace: bool = False):
+    """Stage and enqueue a batch (background task, off the event loop)."""
+    loader = BulkLoader(celery, batch_id, UPLOAD_DIR, MAX_MB * 1024 * 1024, tags, tenant, replace=replace)
+    try:
+        bulk_load(loader, sources, recursive=recursive, names=names)
+    except Exception:
+        log.exception("bulk batch %s stopped", batch_id)
+    finally:
+        for path in sources if cleanup else ():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+@app.post("/api/bulk")
+async def bulk_upload(background: BackgroundTasks, files: List[UploadFile] = File(...),
+                      tags: Optional[str] = None, tenant: Optional[str] = None, replace: bool = False,
+                      _ok: bool = Depends(check_auth)):
+    """
+    Many documents in one request: any mix of .txt/.md/.pdf files and zip/tar
+    archives of them. Files are received first, then staged, deduplicated
+    and queued in the background; poll /api/bulk/{batch_id} for progress.
+    """
+    if tenant is not None and not valid_tenant(tenant):
+        raise HTTPException(400, "tenant must match [A-Za-z0-9_-]{1,64}")
+    tag_list = _clean_tags((tags or "").split(","))
+    for f in files:
+        name = os.path.basename(f.filename or "")
+        if not (is_archive(name) or name.lower().endswith(BULK_ALLOWED)):
+            raise HTTPException(400, f"{name or 'file'}: only {BULK_ALLOWED} or zip/tar archives supported")
+    await _require_workers()
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    staged: dict = {}  # temp path -> original name
+    size = 0
+    try:
+        for f in files:
+            tmp_path = os.path.join(UPLOAD_DIR, f".bulk-{uuid.uuid4().hex}.part")
+            staged[tmp_path] = os.path.basename(f.filename)
+            with open(tmp_path, "wb") as out:
+                while True:
+                    chunk = await f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > BULK_MAX_MB * 1024 * 1024:
+                        raise HTTPException(413, f"Bulk upload exceeds {BULK_MAX_MB}MB limit")
+                    out.write(chunk)
+    except BaseException:
+        for path in staged:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        raise
+
+    batch_id = await run_in_threadpool(new_batch, "upload:" + ",".join(staged.values())[:200], tag_list, tenant)
+    background.add_task(_run_bulk, batch_id, list(staged), tag_list, tenant, names=staged, cleanup=True,
+                        replace=replace)
+    return {"batch_id": batch_id, "files": len(staged), "status": "staging"}
+
+
+@app.post("/api/bulk/dir")
+async def bulk_dir(body: BulkDirBody, background: BackgroundTasks, _ok: bool = Depends(check_auth)):
+    """Ingest a directory on the server (below BULK_DIR_ROOT); unchanged files are skipped without copying."""
+    if not BULK_DIR_ROOT:
+        raise HTTPException(404, "directory ingest is disabled (set BULK_DIR_ROOT)")
+    if body.tenant is not None and not valid_tenant(body.tenant):
+        raise HTTPException(400, "tenant must match [A-Za-z0-9_-]{1,64}")
+    tag_list = _clean_tags(body.tags or ())
+    root = os.path.realpath(BULK_DIR_ROOT)
+    path = os.path.realpath(os.path.join(root, body.path.lstrip("/")))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(400, "path must be inside BULK_DIR_ROOT")
+    if not os.path.exists(path):
+        raise HTTPException(404, "path not found")
+    await _require_workers()
+
+    batch_id = await run_in_threadpool(new_batch, f"dir:{os.path.relpath(path, root)}", tag_list, body.tenant)
+    background.add_task(_run_bulk, batch_id, [path], tag_list, body.tenant, recursive=body.recursive,
+                        replace=body.replace)
+    return {"batch_id": batch_id, "status": "staging"}
+
+
+@app.get("/api/bulk/{batch_id}")
+async def bulk_progress(batch_id: str):
+    """Batch counters and aggregated document status."""
+    if not valid_doc_id(batch_id):
+        raise HTTPException(400, "invalid batch_id")
+    out = await run_in_threadpool(bulk_status, batch_id)
+    if out is None:
+        raise HTTPException(404, "Unknown batch_id")
+    return out
 
 
 @app.get("/api/doc/{doc_id}")
-def doc_status(doc_id: str):
+async def doc_status(doc_id: str):
     """Return ingestion status from Redis."""
-    data = _r.hgetall(f"doc:{doc_id}")
+    data = await async_redis().hgetall(doc_key(doc_id))
     if not data:
         raise HTTPException(404, "Unknown doc_id")
     return data
 
 
+@app.delete("/api/doc/{doc_id}")
+async def doc_delete(doc_id: str, _ok: bool = Depends(check_auth)):
+    """Remove a document's vectors (doc_id filter), named graph and ingest state."""
+    if not valid_doc_id(doc_id):
+        raise HTTPException(400, "invalid doc_id")
+    if not await async_redis().exists(doc_key(doc_id)):
+        raise HTTPException(404, "Unknown doc_id")
+    try:
+        removed = await adelete_document(doc_id)
+    except Exception as e:
+        log.exception("delete failed")
+        raise HTTPException(502, f"delete failed: {e!r}")
+    for path in glob.glob(os.path.join(glob.escape(UPLOAD_DIR), f"{glob.escape(doc_id)}__*")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    await bump_corpus_version_async()
+    return {"ok": True, "doc_id": doc_id, **removed}
+
+
 @app.get("/api/graph")
-def graph_overview(limit: int = 50):
+async def graph_overview(limit: int = 50):
     """Lightweight peek at the KG (first N triples)."""
     try:
         limit = max(1, min(int(limit), 1000))
     except Exception:
         limit = 50
-    q = f"SELECT ?s ?p ?o WHERE {{ ?s ?p ?o }} LIMIT {limit}"
+    q = f"SELECT ?s ?p ?o WHERE {{ {{ ?s ?p ?o }} UNION {{ GRAPH ?g {{ ?s ?p ?o }} }} }} LIMIT {limit}"
     try:
-        data = _sparql_query(q)
+        data = await _sparql_query(q)
         out = []
         if isinstance(data, dict) and "results" in data:
             for b in data["results"].get("bindings", []):
@@ -249,15 +550,15 @@ def graph_overview(limit: int = 50):
 
 
 @app.get("/api/graph/triples")
-def graph_triples(limit: int = 100):
+async def graph_triples(limit: int = 100):
     """Explicit triples endpoint used by the UI Graph tab."""
     try:
         limit = max(1, min(int(limit), 1000))
     except Exception:
         limit = 100
-    q = f"SELECT ?s ?p ?o WHERE {{ ?s ?p ?o }} LIMIT {limit}"
+    q = f"SELECT ?s ?p ?o WHERE {{ {{ ?s ?p ?o }} UNION {{ GRAPH ?g {{ ?s ?p ?o }} }} }} LIMIT {limit}"
     try:
-        data = _sparql_query(q)
+        data = await _sparql_query(q)
         out = []
         if isinstance(data, dict) and "results" in data:
             for b in data["results"].get("bindings", []):
@@ -272,10 +573,12 @@ def graph_triples(limit: int = 100):
 
 
 @app.post("/api/graph/clear")
-def graph_clear(_ok: bool = Depends(check_auth)):
-    """Wipe default graph; requires admin creds if Fuseki is secured."""
+async def graph_clear(_ok: bool = Depends(check_auth)):
+    """Wipe the default graph and every per-document graph; requires admin creds if Fuseki is secured."""
     try:
-        _sparql_update("CLEAR DEFAULT")
+        await _sparql_update("CLEAR ALL")
+        await run_in_threadpool(entity_index.clear_persisted)
+        await bump_corpus_version_async()
         return {"ok": True}
     except Exception as e:
         raise HTTPException(502, f"Fuseki error: {e}")
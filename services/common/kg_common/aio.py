@@ -0,0 +1,130 @@
+# services/common/kg_common/aio.py
+"""
+asyncio data-access layer for the API: AsyncQdrantClient, an httpx-based
+SPARQL client and redis.asyncio. Same pooling and latency histograms as
+kg_common.clients, but nothing here blocks the event loop.
+
+Clients are created lazily on first use inside the running loop and should
+be closed with aclose() on shutdown.
+"""
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from .config import (
+    SPARQL_QUERY_URL,
+    SPARQL_UPDATE_URL,
+    SPARQL_DATA_URL,
+    FUSEKI_USER,
+    FUSEKI_PASSWORD,
+    FUSEKI_POOL_SIZE,
+    FUSEKI_CONNECT_TIMEOUT,
+    FUSEKI_READ_TIMEOUT,
+    QDRANT_URL,
+    QDRANT_TIMEOUT,
+    QDRANT_POOL_SIZE,
+    QDRANT_PREFER_GRPC,
+    QDRANT_GRPC_PORT,
+    REDIS_URL,
+)
+from .metrics import BACKEND_LATENCY
+
+_http: Optional[httpx.AsyncClient] = None
+_qdrant = None
+_redis = None
+
+
+@asynccontextmanager
+async def atimed(backend: str, op: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        BACKEND_LATENCY.labels(backend, op).observe(time.perf_counter() - t0)
+
+
+# -------------------- Fuseki --------------------
+def fuseki_http() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            auth=(FUSEKI_USER, FUSEKI_PASSWORD) if FUSEKI_USER and FUSEKI_PASSWORD else None,
+            timeout=httpx.Timeout(FUSEKI_READ_TIMEOUT, connect=FUSEKI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=FUSEKI_POOL_SIZE, max_keepalive_connections=FUSEKI_POOL_SIZE),
+        )
+    return _http
+
+
+async def asparql_select(query: str, timeout: Optional[float] = None):
+    async with atimed("fuseki", "select"):
+        r = await fuseki_http().post(
+            SPARQL_QUERY_URL,
+            data={"query": query},
+            headers={"Accept": "application/sparql-results+json"},
+            timeout=timeout or httpx.USE_CLIENT_DEFAULT,
+        )
+        r.raise_for_status()
+        return r.json()
+
+
+async def asparql_update(update: str, timeout: Optional[float] = None) -> bool:
+    async with atimed("fuseki", "update"):
+        r = await fuseki_http().post(
+            SPARQL_UPDATE_URL, data={"update": update}, timeout=timeout or httpx.USE_CLIENT_DEFAULT
+        )
+        r.raise_for_status()
+        return True
+
+
+async def adrop_graph(graph: str) -> bool:
+    """Graph Store DELETE of a named graph; False if it did not exist."""
+    async with atimed("fuseki", "gsp_delete"):
+        r = await fuseki_http().delete(SPARQL_DATA_URL, params={"graph": graph})
+        if r.status_code == 404:
+            return False
+        r.raise_for_status()
+        return True
+
+
+# -------------------- Qdrant --------------------
+def async_qdrant():
+    global _qdrant
+    if _qdrant is None:
+        from qdrant_client import AsyncQdrantClient
+        _qdrant = AsyncQdrantClient(
+            url=QDRANT_URL,
+            timeout=int(QDRANT_TIMEOUT),
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            grpc_port=QDRANT_GRPC_PORT,
+            limits=httpx.Limits(max_connections=QDRANT_POOL_SIZE, max_keepalive_connections=QDRANT_POOL_SIZE),
+        )
+    return _qdrant
+
+
+async def asearch(collection: str, vector, limit: int, **kwargs):
+    async with atimed("qdrant", "search"):
+        return await async_qdrant().search(
+            collection_name=collection, query_vector=vector, limit=limit, with_payload=True, **kwargs
+        )
+
+
+# -------------------- Redis --------------------
+def async_redis():
+    global _redis
+    if _redis is None:
+        import redis.asyncio as aioredis
+        _redis = aioredis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _redis
+
+
+async def aclose():
+    global _http, _qdrant, _redis
+    if _http is not None:
+        await _http.aclose()
+    if _qdrant is not None:
+        await _qdrant.close()
+    if _redis is not None:
+        await _redis.aclose()
+    _http = _qdrant = _redis = None
@@ -0,0 +1,160 @@
+# services/common/kg_common/answer_cache.py
+"""
+Two-level answer cache used by query.answer().
+
+1) exact: normalized question + top_k + search scope + corpus version -> answer
+2) semantic (optional): a new question whose embedding is within
+   ANSWER_SEMANTIC_THRESHOLD cosine of a cached one (same scope) reuses its answer
+
+The scope is SearchFilter.cache_key(), so filtered and tenant searches never
+share entries with each other or with unfiltered ones.
+
+Entries live in-process (per api replica) with TTL and LRU eviction. The
+corpus version is a Redis counter shared by every replica; ingestion and
+/api/graph/clear bump it, which makes all older entries unreachable.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import REDIS_URL, ANSWER_CACHE_MAX, ANSWER_CACHE_TTL, ANSWER_SEMANTIC_THRESHOLD
+from .metrics import ANSWER_CACHE_LOOKUPS
+
+VERSION_KEY = "corpus:version"
+
+_WS = re.compile(r"\s+")
+_r = None
+
+
+def _redis():
+    global _r
+    if _r is None:
+        import redis
+        _r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _r
+
+
+def corpus_version() -> str:
+    try:
+        return _redis().get(VERSION_KEY) or "0"
+    except Exception:
+        # without a version we cannot tell stale from fresh
+        return ""
+
+
+def bump_corpus_version() -> None:
+    """Called whenever documents or triples change."""
+    try:
+        _redis().incr(VERSION_KEY)
+    except Exception:
+        pass
+    _cache.clear()
+
+
+async def corpus_version_async() -> str:
+    from .aio import async_redis
+    try:
+        return await async_redis().get(VERSION_KEY) or "0"
+    except Exception:
+        return ""
+
+
+async def bump_corpus_version_async() -> None:
+    from .aio import async_redis
+    try:
+        await async_redis().incr(VERSION_KEY)
+    except Exception:
+        pass
+    _cache.clear()
+
+
+def normalize_question(q: str) -> str:
+    return _WS.sub(" ", q).strip().lower().rstrip("?!. ")
+
+
+class AnswerCache:
+    def __init__(self, max_size: int = ANSWER_CACHE_MAX, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_SEMANTIC_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # key -> (expires_at, float32 vector or None, answer)
+        self._items: "OrderedDict[Tuple[str, int, str, str], Tuple[float, Any, Dict]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def get_exact(self, question: str, top_k: int, version: str, scope: str = "") -> Optional[Dict]:
+        if not self.enabled or not version:
+            return None
+        key = (normalize_question(question), int(top_k), version, scope)
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < now:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[2]
+
+    def get_semantic(self, vector: List[float], top_k: int, version: str, scope: str = "") -> Optional[Dict]:
+        if not self.enabled or not version or self.threshold <= 0:
+            return None
+        import numpy as np
+        now = time.time()
+        # only the candidate filter runs under the lock; the scoring is one matmul outside it
+        with self._lock:
+            cands = [(key, vec) for key, (exp, vec, _) in self._items.items()
+                     if vec is not None and key[1] == int(top_k) and key[2] == version and key[3] == scope
+                     and exp >= now]
+        if not cands:
+            return None
+        # vectors are L2-normalized, so the dot product is the cosine
+        sims = np.stack([vec for _, vec in cands]) @ np.asarray(vector, dtype=np.float32)
+        i = int(np.argmax(sims))
+        if sims[i] < self.threshold:
+            return None
+        key = cands[i][0]
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None  # evicted meanwhile
+            self._items.move_to_end(key)
+            return item[2]
+
+    def put(self, question: str, top_k: int, version: str, answer: Dict, vector: Optional[List[float]] = None,
+            scope: str = ""):
+        if not self.enabled or not version:
+            return
+        key = (normalize_question(question), int(top_k), version, scope)
+        if vector is not None and self.threshold > 0:
+            import numpy as np
+            vector = np.asarray(vector, dtype=np.float32)
+        else:
+            vector = None  # only semantic lookups read it
+        with self._lock:
+            self._items[key] = (time.time() + self.ttl, vector, answer)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+_cache = AnswerCache()
+
+
+def get_cache() -> AnswerCache:
+    return _cache
+
+
+def record(result: str) -> None:
+    ANSWER_CACHE_LOOKUPS.labels(result).inc()
@@ -0,0 +1,378 @@
+# services/common/kg_common/bulk.py
+"""
+Bulk loads: many documents from archives (zip, tar[.gz|.bz2|.xz]) or a
+directory tree, tracked as one batch.
+
+Every file is streamed to UPLOAD_DIR while hashing, then resolved like a
+single /api/upload (same content and tags -> unchanged; a known name keeps
+its doc_id) and queued as tasks.process_path at PRIORITY_BULK, in Celery
+groups of BULK_ENQUEUE_CHUNK so workers start on the first files while the
+rest is still being staged. Directory files are hashed in place first, so a
+nightly sync only copies what changed.
+
+Batch state in Redis:
+  batch:{id}        counters (files, queued, unchanged, duplicate, skipped), state
+  batch:{id}:docs   doc_ids queued; status() aggregates their doc:{id} status
+
+    python -m kg_common.bulk /data/docs archive.zip --tags nightly --wait
+"""
+import argparse
+import hashlib
+import json
+import os
+import tarfile
+import time
+import uuid
+import zipfile
+from collections import Counter
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .config import REDIS_URL, BULK_ENQUEUE_CHUNK
+from .documents import DOC_NAME_KEY, doc_key, name_field, resolve_identity
+from .queues import PRIORITY_BULK, Q_INGEST
+
+ALLOWED = (".txt", ".md", ".pdf")
+ARCHIVES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+BATCH_TTL = 7 * 86400
+READ_BLOCK = 1 << 20
+
+_r = None
+
+
+def _redis():
+    global _r
+    if _r is None:
+        import redis
+        _r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _r
+
+
+def batch_key(batch_id: str) -> str:
+    return f"batch:{batch_id}"
+
+
+def is_archive(name: str) -> bool:
+    return name.lower().endswith(ARCHIVES)
+
+
+def _flat(rel: str) -> str:
+    # names are identities (docs:name) and file name suffixes: keep the relative path, flattened
+    return "_".join(p for p in rel.replace("\\", "/").split("/") if p and p not in (".", ".."))
+
+
+def _wanted(rel: str) -> bool:
+    base = rel.replace("\\", "/").rsplit("/", 1)[-1]
+    return bool(base) and not base.startswith(".") and base.lower().endswith(ALLOWED)
+
+
+# -------------------- Sources --------------------
+def iter_archive(path: str) -> Iterator[Tuple[str, BinaryIO]]:
+    """(name, stream) of supported documents in an archive, in archive order."""
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and _wanted(info.filename):
+                    yield _flat(info.filename), zf.open(info)
+        return
+    # streaming mode: members are read in order, without seeking back
+    with tarfile.open(path, mode="r|*") as tf:
+        for member in tf:
+            if member.isfile() and _wanted(member.name):
+                fp = tf.extractfile(member)
+                if fp is not None:
+                    yield _flat(member.name), fp
+
+
+def iter_directory(root: str, recursive: bool = True) -> Iterator[Tuple[str, str]]:
+    """(name, path) of supported documents under root; symlinks are not followed."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".")) if recursive else []
+        for f in sorted(filenames):
+            path = os.path.join(dirpath, f)
+            rel = os.path.relpath(path, root)
+            if _wanted(rel) and os.path.isfile(path) and not os.path.islink(path):
+                yield _flat(rel), path
+
+
+# -------------------- Batch --------------------
+def new_batch(source: str, tags: Optional[List[str]] = None, tenant: Optional[str] = None) -> str:
+    batch_id = uuid.uuid4().hex
+    key = batch_key(batch_id)
+    r = _redis()
+    r.hset(key, mapping={
+        "state": "staging", "source": source, "tags": json.dumps(tags or []), "tenant": tenant or "",
+        "created_at": int(time.time()), "files": 0, "queued": 0, "unchanged": 0, "duplicate": 0, "skipped": 0,
+    })
+    r.expire(key, BATCH_TTL)
+    return batch_id
+
+
+class BulkLoader:
+    """
+    Stages, dedupes and enqueues the documents of one batch. Not thread-safe;
+    one loader per batch. close() must run to flush the last group.
+    """
+
+    def __init__(self, app, batch_id: str, upload_dir: str, max_bytes: int,
+                 tags: Optional[List[str]] = None, tenant: Optional[str] = None, replace: bool = False):
+        self.app = app
+        self.batch_id = batch_id
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.tags = sorted(set(tags or []))
+        self.tenant = tenant or None
+        self.replace = replace
+        self.counts: Counter = Counter()
+        self._hashes: set = set()
+        self._names: set = set()
+        self._pending: List[Tuple[str, str, str, str]] = []  # (path, doc_id, name, content_hash)
+        os.makedirs(upload_dir, exist_ok=True)
+
+    # ---- staging ----
+    def _copy(self, fp: BinaryIO) -> Tuple[str, str, int]:
+        tmp = os.path.join(self.upload_dir, f".{uuid.uuid4().hex}.part")
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp, "wb") as out:
+                while True:
+                    block = fp.read(READ_BLOCK)
+                    if not block:
+                        break
+                    size += len(block)
+                    if size > self.max_bytes:
+                        raise ValueError("file too large")
+                    sha.update(block)
+                    out.write(block)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return tmp, sha.hexdigest(), size
+
+    def add_stream(self, name: str, fp: BinaryIO) -> str:
+        """Stage one document from a stream; returns its outcome."""
+        try:
+            with fp:
+                tmp, content_hash, _ = self._copy(fp)
+        except ValueError:
+            return self._count("skipped")
+        outcome, doc_id = self._resolve(name, content_hash)
+        if outcome != "queued":
+            os.remove(tmp)
+            return self._count(outcome)
+        dest = os.path.join(self.upload_dir, f"{doc_id}__{name}")
+        os.replace(tmp, dest)
+        return self._queue(dest, doc_id, name, content_hash)
+
+    def add_path(self, name: str, path: str) -> str:
+        """Stage one document from disk: hashed in place, copied only when it needs ingesting."""
+        try:
+            size = os.path.getsize(path)
+            if size > self.max_bytes:
+                return self._count("skipped")
+            sha = hashlib.sha256()
+            with open(path, "rb") as fp:
+                for block in iter(lambda: fp.read(READ_BLOCK), b""):
+                    sha.update(block)
+        except OSError:
+            return self._count("skipped")
+        content_hash = sha.hexdigest()
+        outcome, doc_id = self._resolve(name, content_hash)
+        if outcome != "queued":
+            return self._count(outcome)
+        try:
+            with open(path, "rb") as fp:
+                tmp, copied_hash, _ = self._copy(fp)
+        except (OSError, ValueError):
+            return self._count("skipped")
+        dest = os.path.join(self.upload_dir, f"{doc_id}__{name}")
+        os.replace(tmp, dest)
+        # hash of the copy, in case the file changed after it was hashed
+        return self._queue(dest, doc_id, name, copied_hash)
+
+    def _resolve(self, name: str, content_hash: str) -> Tuple[str, Optional[str]]:
+        """Same rules as /api/upload, plus duplicates within the batch."""
+        # with replace, a second file of the same name would re-ingest the same doc_id
+        if content_hash in self._hashes or (self.replace and name in self._names):
+            return "duplicate", None
+        self._hashes.add(content_hash)
+        self._names.add(name)
+        return resolve_identity(_redis(), content_hash, name, self.tags, self.tenant, replace=self.replace)
+
+    def _count(self, outcome: str) -> str:
+        self.counts[outcome] += 1
+        self.counts["files"] += 1
+        if self.counts["files"] % 100 == 0:
+            self._publish_counts()
+        return outcome
+
+    def _queue(self, path: str, doc_id: str, name: str, content_hash: str) -> str:
+        self._pending.append((path, doc_id, name, content_hash))
+        if len(self._pending) >= BULK_ENQUEUE_CHUNK:
+            self.flush()
+        return self._count("queued")
+
+    # ---- enqueue ----
+    def flush(self):
+        if not self._pending:
+            return
+        from celery import group
+
+        jobs, self._pending = self._pending, []
+        r = _redis()
+        key = batch_key(self.batch_id)
+        # before publishing: a worker that starts at once must not have its progress overwritten by "queued"
+        pipe = r.pipeline()
+        for _, doc_id, name, _ in jobs:
+            pipe.hset(DOC_NAME_KEY, name_field(name, self.tenant), doc_id)
+            pipe.hset(doc_key(doc_id), mapping={"status": "queued", "info": f"batch={self.batch_id}",
+                                                 "updated_at": str(int(time.time()))})
+        pipe.rpush(f"{key}:docs", *(doc_id for _, doc_id, _, _ in jobs))
+        pipe.expire(f"{key}:docs", BATCH_TTL)
+        pipe.execute()
+
+        kwargs = {"tags": self.tags, "tenant": self.tenant}
+        try:
+            group(
+                self.app.signature("tasks.process_path", args=(path, doc_id),
+                                   kwargs={**kwargs, "content_hash": content_hash},
+                                   queue=Q_INGEST, priority=PRIORITY_BULK)
+                for path, doc_id, _, content_hash in jobs
+            ).apply_async()
+        except Exception as e:
+            pipe = r.pipeline()
+            for _, doc_id, _, _ in jobs:
+                pipe.hset(doc_key(doc_id), mapping={"status": "failed", "info": f"queue send failed: {e!r}",
+                                                     "updated_at": str(int(time.time()))})
+            pipe.execute()
+            raise
+
+    def _publish_counts(self):
+        _redis().hset(batch_key(self.batch_id), mapping={
+            k: self.counts[k] for k in ("files", "queued", "unchanged", "duplicate", "skipped")
+        })
+
+    def close(self, error: Optional[str] = None, warnings: Iterable[str] = ()) -> Dict[str, int]:
+        """Flush and mark the batch staged (or failed, when staging stopped on `error`)."""
+        try:
+            self.flush()
+        finally:
+            self._publish_counts()
+            fields: Dict[str, Any] = {"state": "failed" if error else "staged", "staged_at": int(time.time())}
+            if error:
+                fields["error"] = error
+            if warnings:
+                fields["warnings"] = json.dumps(list(warnings))
+            _redis().hset(batch_key(self.batch_id), mapping=fields)
+        return dict(self.counts)
+
+
+def load(loader: BulkLoader, sources: Iterable[str], recursive: bool = True,
+         names: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """
+    Feed files, archives and directories to `loader` and close it. `names`
+    maps a source path to its display name (uploads staged under temp names).
+    A broken archive is skipped with a warning; other errors stop the batch.
+    """
+    error = None
+    warnings: List[str] = []
+    try:
+        for src in sources:
+            name = (names or {}).get(src) or os.path.basename(src)
+            if os.path.isdir(src):
+                for rel, path in iter_directory(src, recursive):
+                    loader.add_path(rel, path)
+            elif is_archive(name):
+                try:
+                    for rel, fp in iter_archive(src):
+                        loader.add_stream(rel, fp)
+                except (zipfile.BadZipFile, tarfile.TarError, EOFError, RuntimeError) as e:
+                    warnings.append(f"{name}: {type(e).__name__}: {e}")
+            elif _wanted(name):
+                loader.add_path(_flat(name), src)
+            else:
+                loader._count("skipped")
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        counts = loader.close(error, warnings)
+    return counts
+
+
+def status(batch_id: str) -> Optional[Dict[str, Any]]:
+    """Batch counters plus the current status of every queued document."""
+    r = _redis()
+    key = batch_key(batch_id)
+    st = r.hgetall(key)
+    if not st:
+        return None
+    docs = r.lrange(f"{key}:docs", 0, -1)
+    phases: Counter = Counter()
+    for i in range(0, len(docs), 1000):
+        pipe = r.pipeline()
+        for doc_id in docs[i:i + 1000]:
+            pipe.hget(doc_key(doc_id), "status")
+        phases.update(s or "unknown" for s in pipe.execute())
+    queued = int(st.get("queued", 0))
+    finished = phases["done"] + phases["failed"]
+    state = st["state"]
+    if state == "staged":
+        state = "done" if finished >= queued else "running"
+    return {
+        "batch_id": batch_id,
+        "state": state,
+        "source": st.get("source", ""),
+        "created_at": int(st.get("created_at", 0)),
+        "files": int(st.get("files", 0)),
+        "queued": queued,
+        "unchanged": int(st.get("unchanged", 0)),
+        "duplicate": int(st.get("duplicate", 0)),
+        "skipped": int(st.get("skipped", 0)),
+        "done": phases["done"],
+        "failed": phases["failed"],
+        "in_progress": max(queued - finished, 0),
+        "phases": dict(phases),
+        "error": st.get("error") or None,
+        "warnings": json.loads(st.get("warnings") or "[]"),
+    }
+
+
+# -------------------- CLI --------------------
+def main(argv=None):
+    from celery import Celery
+
+    from .queues import configure
+
+    ap = argparse.ArgumentParser(prog="python -m kg_common.bulk")
+    ap.add_argument("sources", nargs="+", help="files, archives or directories")
+    ap.add_argument("--tags", default="", help="comma-separated tags for every document")
+    ap.add_argument("--tenant")
+    ap.add_argument("--no-recursive", action="store_true")
+    ap.add_argument("--replace", action="store_true",
+                    help="a file named like an earlier document re-ingests it instead of adding a new one")
+    ap.add_argument("--upload-dir", default=os.getenv("UPLOAD_DIR", "/ingest"))
+    ap.add_argument("--max-mb", type=int, default=int(os.getenv("UPLOAD_MAX_MB", "50")))
+    ap.add_argument("--wait", action="store_true", help="poll until every queued document is done")
+    args = ap.parse_args(argv)
+
+    app = Celery("kg_worker", broker=os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"))
+    configure(app)
+    tags = sorted({t.strip() for t in args.tags.split(",") if t.strip()})
+    batch_id = new_batch(",".join(args.sources), tags, args.tenant)
+    loader = BulkLoader(app, batch_id, args.upload_dir, args.max_mb * 1024 * 1024, tags, args.tenant,
+                        replace=args.replace)
+    load(loader, args.sources, recursive=not args.no_recursive)
+    out = status(batch_id)
+    while args.wait and out["state"] == "running":
+        time.sleep(5)
+        out = status(batch_id)
+        print(f"{out['done']}/{out['queued']} done, {out['failed']} failed", flush=True)
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# services/common/kg_common/chunking.py
+"""
+Token-accurate, structure-aware chunking and prompt packing.
+
+Tokens are counted with the chat model's own tokenizer (the GGUF loaded with
+vocab_only=True: no weights, a few MB), so chunk sizes and prompt budgets
+match what the model will actually prefill. Counts are LRU-cached per
+sentence. Without llama_cpp or the model file, a ~4 chars/token estimate is
+used instead.
+
+Chunks are built from whole sentences inside paragraphs; a heading (markdown
+`#` lines, or short unpunctuated single-line blocks as produced by PDF
+layout) closes the current chunk and is repeated at the top of every chunk
+of its section. Consecutive chunks of a section overlap by trailing
+sentences worth up to `overlap` tokens.
+"""
+import logging
+import re
+import threading
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+from .config import TOKENIZER_PATH, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+
+log = logging.getLogger(__name__)
+
+_tok = None
+_tok_lock = threading.Lock()
+
+
+# -------------------- Tokenizer --------------------
+def _tokenizer():
+    """The vocab-only Llama, or False when only the estimate is available."""
+    global _tok
+    if _tok is None:
+        with _tok_lock:
+            if _tok is None:
+                try:
+                    from llama_cpp import Llama
+                    _tok = Llama(model_path=TOKENIZER_PATH, vocab_only=True, verbose=False)
+                except Exception as e:
+                    log.warning("tokenizer unavailable (%s: %s); estimating tokens", type(e).__name__, e)
+                    _tok = False
+    return _tok
+
+
+def tokenize(text: str) -> List[int]:
+    tok = _tokenizer()
+    if not tok:
+        raise RuntimeError("model tokenizer unavailable")
+    return tok.tokenize(text.encode("utf-8"), add_bos=False, special=False)
+
+
+def _count(text: str) -> int:
+    if not text:
+        return 0
+    if not _tokenizer():
+        return max(len(text) // 4, 1)
+    return len(tokenize(text))
+
+
+_count_cached = lru_cache(maxsize=32768)(_count)
+
+
+def count_tokens(text: str) -> int:
+    # sentences and chunks repeat (overlap, re-ingest, retrieval); whole prompts do not
+    return _count_cached(text) if len(text) <= 4096 else _count(text)
+
+
+def truncate_tokens(text: str, n: int) -> str:
+    """Longest prefix of `text` that is at most n tokens."""
+    if n <= 0:
+        return ""
+    if not _tokenizer():
+        return text[: n * 4]
+    ids = tokenize(text)
+    if len(ids) <= n:
+        return text
+    return _tokenizer().detokenize(ids[:n]).decode("utf-8", errors="ignore")
+
+
+def split_tokens(text: str, n: int) -> List[str]:
+    """Consecutive pieces of at most n tokens (for sentences longer than a chunk)."""
+    n = max(int(n), 1)
+    if not _tokenizer():
+        words = text.split()
+        step = max(n * 3 // 4, 1)  # ~0.75 words per token
+        return [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+    ids = tokenize(text)
+    detok = _tokenizer().detokenize
+    pieces = (detok(ids[i:i + n]).decode("utf-8", errors="ignore").strip() for i in range(0, len(ids), n))
+    return [p for p in pieces if p]
+
+
+# -------------------- Structure --------------------
+_PARA = re.compile(r"\n[ \t]*\n+")
+_MD_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+")
+_SENT = re.compile(r"(?<=[.!?])[\"')\]]?\s+(?=[\"'(\[]?[A-Z0-9])")
+_WS = re.compile(r"\s+")
+_MAX_CARRY = 64 * 1024  # characters held while waiting for a paragraph break
+
+
+def _looks_heading(line: str) -> bool:
+    return (
+        len(line) <= 80
+        and not line.endswith((".", "!", "?", ",", ";", ":"))
+        and (line[:1].isupper() or line[:1].isdigit())
+        and len(line.split()) <= 12
+    )
+
+
+def _classify(paragraph: str) -> Iterator[Tuple[str, bool]]:
+    """Paragraph -> (text, is_heading) blocks; markdown heading lines split out."""
+    body: List[str] = []
+    lines = [ln.strip() for ln in paragraph.splitlines() if ln.strip()]
+    for ln in lines:
+        if _MD_HEADING.match(ln):
+            if body:
+                yield " ".join(body), False
+                body = []
+            yield _MD_HEADING.sub("", ln).strip(), True
+        else:
+            body.append(ln)
+    if body:
+        text = _WS.sub(" ", " ".join(body))
+        yield text, len(lines) == 1 and _looks_heading(text)
+
+
+def iter_blocks(segments: Iterable[str]) -> Iterator[Tuple[str, bool]]:
+    """
+    Stream of text segments (pages, file blocks) -> (text, is_heading)
+    paragraphs. A paragraph may continue across segments; one that never
+    ends is flushed at a line or word break after _MAX_CARRY characters.
+    """
+    carry = ""
+    for seg in segments:
+        parts = _PARA.split(carry + seg)
+        carry = parts.pop()
+        if len(carry) > _MAX_CARRY:
+            cut = carry.rfind("\n", _MAX_CARRY // 2)
+            if cut < 0:
+                cut = max(carry.rfind(" "), _MAX_CARRY // 2)
+            parts.append(carry[:cut])
+            carry = carry[cut:]
+        for p in parts:
+            yield from _classify(p)
+    if carry.strip():
+        yield from _classify(carry)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENT.split(text) if s.strip()]
+
+
+# -------------------- Chunking --------------------
+def iter_chunks(blocks: Iterable[Tuple[str, bool]], max_tokens: int = CHUNK_TOKENS,
+                overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """
+    Greedy packing of whole sentences into chunks of at most max_tokens
+    (counting one separator token between units). Only the current chunk is
+    held in memory.
+    """
+    max_tokens = max(int(max_tokens), 8)
+    overlap = min(max(int(overlap), 0), max_tokens // 2)
+
+    heading: Tuple[str, int] | None = None
+    units: List[Tuple[str, int, bool]] = []   # (text, tokens, starts_paragraph)
+    size = 0
+    fresh = False                               # units not yet emitted in a chunk
+
+    def render() -> str:
+        out: List[str] = []
+        if heading:
+            out.append(heading[0] + "\n")
+        for i, (t, _, para) in enumerate(units):
+            if i:
+                out.append("\n\n" if para else " ")
+            out.append(t)
+        return "".join(out).strip()
+
+    def restart(keep: List[Tuple[str, int, bool]], need: int):
+        nonlocal units, size
+        base = heading[1] + 1 if heading else 0
+        while keep and base + sum(n + 1 for _, n, _ in keep) + need > max_tokens:
+            keep = keep[1:]
+        units = keep
+        size = base + sum(n + 1 for _, n, _ in keep)
+
+    for text, is_heading in blocks:
+        if is_heading:
+            if fresh:
+                yield render()
+            heading = (text, count_tokens(text))
+            if heading[1] > max_tokens // 2:
+                heading = (truncate_tokens(text, max_tokens // 2), max_tokens // 2)
+            fresh = False
+            restart([], 0)
+            continue
+
+        first = True
+        for sent in split_sentences(text):
+            n = count_tokens(sent)
+            pieces = [(sent, n)] if n <= max_tokens - (heading[1] + 1 if heading else 0) - 1 else [
+                (p, count_tokens(p)) for p in split_tokens(sent, max_tokens // 2)
+            ]
+            for piece, pn in pieces:
+                if size + pn + 1 > max_tokens and fresh:
+                    yield render()
+                    tail: List[Tuple[str, int, bool]] = []
+                    kept = 0
+                    for u in reversed(units):
+                        if kept + u[1] + 1 > overlap:
+                            break
+                        tail.insert(0, u)
+                        kept += u[1] + 1
+                    fresh = False
+                    restart(tail, pn + 1)
+                units.append((piece, pn, first and bool(units)))
+                size += pn + 1
+                fresh = True
+                first = False
+
+    if fresh:
+        yield render()
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    return list(iter_chunks(iter_blocks([text]), max_tokens, overlap))
+
+
+# -------------------- Prompt packing --------------------
+def pack(texts: Sequence[str], budget: int, sep_tokens: int = 1) -> List[int]:
+    """
+    Indices of `texts` (in order) whose token counts fit `budget`. Items that
+    do not fit are skipped so smaller later ones can still use the space.
+    """
+    picked: List[int] = []
+    spent = 0
+    for i, t in enumerate(texts):
+        n = count_tokens(t) + (sep_tokens if picked else 0)
+        if spent + n > budget:
+            continue
+        picked.append(i)
+        spent += n
+    return picked
@@ -0,0 +1,153 @@
+# services/common/kg_common/clients.py
+"""
+Shared, pooled clients for the backing services.
+
+- fuseki_session(): one keep-alive requests.Session per process (auth, pool, retries);
+  fuseki_session(retry=False) is a second one without retries for latency-bound reads
+- sparql_select()/sparql_update(): SPARQL protocol calls over that session
+- qdrant(): one QdrantClient per process (HTTP keep-alive pool or gRPC)
+
+Every call is timed into kg_backend_request_seconds{backend, op}. Clients are
+rebuilt after a fork so celery prefork children never share sockets.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+from .config import (
+    SPARQL_QUERY_URL,
+    SPARQL_UPDATE_URL,
+    FUSEKI_USER,
+    FUSEKI_PASSWORD,
+    FUSEKI_POOL_SIZE,
+    FUSEKI_CONNECT_TIMEOUT,
+    FUSEKI_READ_TIMEOUT,
+    KG_WRITE_RETRIES,
+    QDRANT_URL,
+    QDRANT_TIMEOUT,
+    QDRANT_POOL_SIZE,
+    QDRANT_PREFER_GRPC,
+    QDRANT_GRPC_PORT,
+)
+from .metrics import BACKEND_LATENCY
+
+_lock = threading.Lock()
+_pid: Optional[int] = None
+_fuseki: Optional[requests.Session] = None
+_fuseki_once: Optional[requests.Session] = None
+_qdrant = None
+
+
+def _reset_after_fork():
+    global _pid, _fuseki, _fuseki_once, _qdrant
+    if _pid != os.getpid():
+        _pid, _fuseki, _fuseki_once, _qdrant = os.getpid(), None, None, None
+
+
+@contextmanager
+def timed(backend: str, op: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        BACKEND_LATENCY.labels(backend, op).observe(time.perf_counter() - t0)
+
+
+# -------------------- Fuseki --------------------
+def fuseki_timeout():
+    return (FUSEKI_CONNECT_TIMEOUT, FUSEKI_READ_TIMEOUT)
+
+
+def _new_fuseki_session(retry) -> requests.Session:
+    sess = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=2, pool_maxsize=FUSEKI_POOL_SIZE)
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    if FUSEKI_USER and FUSEKI_PASSWORD:
+        sess.auth = HTTPBasicAuth(FUSEKI_USER, FUSEKI_PASSWORD)
+    return sess
+
+
+def fuseki_session(retry: bool = True) -> requests.Session:
+    """
+    With retry=False: no retries at all, for reads that have a deadline (a
+    retry with backoff would outlast it; the caller degrades instead).
+    """
+    global _fuseki, _fuseki_once
+    with _lock:
+        _reset_after_fork()
+        if not retry:
+            if _fuseki_once is None:
+                _fuseki_once = _new_fuseki_session(0)
+            return _fuseki_once
+        if _fuseki is None:
+            # SPARQL reads and N-Triples appends are idempotent, so POST is safe to retry
+            _fuseki = _new_fuseki_session(Retry(
+                total=KG_WRITE_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,
+            ))
+        return _fuseki
+
+
+def sparql_select(query: str, timeout=None, retry: bool = True):
+    with timed("fuseki", "select"):
+        r = fuseki_session(retry).post(
+            SPARQL_QUERY_URL,
+            data={"query": query},
+            headers={"Accept": "application/sparql-results+json"},
+            timeout=timeout or fuseki_timeout(),
+        )
+        r.raise_for_status()
+        return r.json()
+
+
+def sparql_update(update: str, timeout=None) -> bool:
+    with timed("fuseki", "update"):
+        r = fuseki_session().post(SPARQL_UPDATE_URL, data={"update": update}, timeout=timeout or fuseki_timeout())
+        r.raise_for_status()
+        return True
+
+
+# -------------------- Qdrant --------------------
+class _TimedQdrant:
+    """Proxy that times every QdrantClient method call per operation name."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        def call(*args, **kwargs):
+            with timed("qdrant", name):
+                return attr(*args, **kwargs)
+        return call
+
+
+def qdrant():
+    global _qdrant
+    with _lock:
+        _reset_after_fork()
+        if _qdrant is None:
+            import httpx
+            from qdrant_client import QdrantClient
+            client = QdrantClient(
+                url=QDRANT_URL,
+                timeout=int(QDRANT_TIMEOUT),
+                prefer_grpc=QDRANT_PREFER_GRPC,
+                grpc_port=QDRANT_GRPC_PORT,
+                limits=httpx.Limits(max_connections=QDRANT_POOL_SIZE, max_keepalive_connections=QDRANT_POOL_SIZE),
+            )
+            _qdrant = _TimedQdrant(client)
+        return _qdrant
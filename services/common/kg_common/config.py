@@ -9,11 +9,115 @@ FUSEKI_URL = os.getenv("FUSEKI_URL", "http://fuseki:3030")
 FUSEKI_DATASET = os.getenv("FUSEKI_DATASET", "kg")
 SPARQL_QUERY_URL = f"{FUSEKI_URL}/{FUSEKI_DATASET}/query"
 SPARQL_UPDATE_URL = f"{FUSEKI_URL}/{FUSEKI_DATASET}/update"
+SPARQL_DATA_URL = f"{FUSEKI_URL}/{FUSEKI_DATASET}/data"   # Graph Store Protocol
+FUSEKI_USER = os.getenv("FUSEKI_USER", "admin")
+FUSEKI_PASSWORD = os.getenv("FUSEKI_PASSWORD", os.getenv("ADMIN_PASSWORD", "admin"))
+
+# KG writes
+KG_WRITE_BATCH = int(os.getenv("KG_WRITE_BATCH", "5000"))        # triples per Graph Store request
+KG_WRITE_RETRIES = int(os.getenv("KG_WRITE_RETRIES", "3"))
+KG_GRAPH_BASE = os.getenv("KG_GRAPH_BASE", "http://example.org/graph/")  # + doc_id -> named graph
 
 QDRANT_URL = os.getenv("QDRANT_URL", "http://qdrant:6333")
+QDRANT_TIMEOUT = float(os.getenv("QDRANT_TIMEOUT", "15"))
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "32"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+
+# Pooled HTTP sessions to Fuseki
+FUSEKI_POOL_SIZE = int(os.getenv("FUSEKI_POOL_SIZE", "16"))
+FUSEKI_CONNECT_TIMEOUT = float(os.getenv("FUSEKI_CONNECT_TIMEOUT", "3"))
+FUSEKI_READ_TIMEOUT = float(os.getenv("FUSEKI_READ_TIMEOUT", "30"))
 
 API_AUTH_TOKEN = os.getenv("API_AUTH_TOKEN", "changeme")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
+
+# Embedding engine (independent of the chat LLM)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "sentence-transformers")  # sentence-transformers | onnx | llama | hash
+EMBED_DIM = int(os.getenv("EMBED_DIM", "384"))                       # declared vector size; drives collection creation
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "4"))
+EMBED_ENCODE_BATCH = int(os.getenv("EMBED_ENCODE_BATCH", "32"))
+EMBED_MODEL_PATH = os.getenv("EMBED_MODEL_PATH", "")                 # onnx dir or embedding-mode GGUF
+EMBED_FALLBACK = os.getenv("EMBED_FALLBACK", "0") == "1"             # allow hash vectors if the engine fails to load
+
+# Embedding cache (content-addressed by model id + normalized chunk text)
+EMBED_CACHE = os.getenv("EMBED_CACHE", "redis")                      # redis | disk | off
+EMBED_CACHE_MAX = int(os.getenv("EMBED_CACHE_MAX", "200000"))        # entries kept before LRU eviction
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "/tmp/kg_embed_cache.sqlite3")
+EMBED_CACHE_REDIS_URL = os.getenv("EMBED_CACHE_REDIS_URL", os.getenv("REDIS_URL", "redis://redis:6379/0"))
+
+# Answer cache for /api/ask and /api/chat
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "1024"))        # 0 disables the cache
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "600"))       # seconds
+ANSWER_SEMANTIC_THRESHOLD = float(os.getenv("ANSWER_SEMANTIC_THRESHOLD", "0"))  # cosine; 0 disables semantic hits
+
+# Inference scheduler in front of the local model
+LLM_SLOTS = int(os.getenv("LLM_SLOTS", "1"))               # concurrent generations (one Llama context each)
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "8"))       # requests allowed to wait for a slot
+LLM_DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "60"))  # default per-request deadline (queue + generation)
+
+# Hybrid KG + vector retrieval
+HYBRID_KG = os.getenv("HYBRID_KG", "1") == "1"
+KG_MAX_FACTS = int(os.getenv("KG_MAX_FACTS", "12"))              # triples rendered into the prompt
+KG_NEIGHBORHOOD_LIMIT = int(os.getenv("KG_NEIGHBORHOOD_LIMIT", "64"))
+KG_LOOKUP_TIMEOUT = float(os.getenv("KG_LOOKUP_TIMEOUT", "2"))   # seconds; KG is best-effort at answer time
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# In-process entity index for question -> KG entity linking
+ENTITY_INDEX = os.getenv("ENTITY_INDEX", "1") == "1"
+ENTITY_INDEX_REFRESH_S = float(os.getenv("ENTITY_INDEX_REFRESH_S", "30"))
+ENTITY_FUZZY_MIN = float(os.getenv("ENTITY_FUZZY_MIN", "0.6"))    # trigram Jaccard for fuzzy matches
+
+# Token-accurate chunking and prompt packing (model tokenizer, vocab only)
+TOKENIZER_PATH = os.getenv("TOKENIZER_PATH", os.getenv("MODEL_PATH", "/models/qwen2.5-1.5b-instruct-q4_k_m.gguf"))
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))                 # tokens per chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))  # trailing sentences carried into the next chunk
+PROMPT_CTX = int(os.getenv("PROMPT_CTX", os.getenv("N_CTX", "2048")))  # context of one generation slot
+ANSWER_MAX_TOKENS = int(os.getenv("ANSWER_MAX_TOKENS", "192"))
+CHAT_TEMPLATE_TOKENS = int(os.getenv("CHAT_TEMPLATE_TOKENS", "32"))  # role markers etc. added by the chat format
+
+# KV-state cache for fixed prompt prefixes (chat template + system prompt), local llama.cpp only
+KV_PREFIX_CACHE = os.getenv("KV_PREFIX_CACHE", "1") == "1"
+KV_CACHE_BYTES = int(os.getenv("KV_CACHE_BYTES", str(512 * 1024 * 1024)))  # LRU bound on saved states
+KV_PREFIX_MIN_TOKENS = int(os.getenv("KV_PREFIX_MIN_TOKENS", "16"))         # shorter prefixes are not worth a restore
+
+# Qdrant collection schema (new collections; `python -m kg_common.vector migrate` rebuilds existing ones)
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100"))
+QDRANT_SEARCH_EF = int(os.getenv("QDRANT_SEARCH_EF", "64"))                # 0 = server default
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "int8")             # int8 | none
+QDRANT_QUANT_RESCORE = os.getenv("QDRANT_QUANT_RESCORE", "1") == "1"       # re-rank with full vectors
+QDRANT_QUANT_OVERSAMPLING = float(os.getenv("QDRANT_QUANT_OVERSAMPLING", "2.0"))
+QDRANT_ON_DISK = os.getenv("QDRANT_ON_DISK", "0") == "1"                   # original vectors on disk (mmap)
+QDRANT_ON_DISK_PAYLOAD = os.getenv("QDRANT_ON_DISK_PAYLOAD", "1") == "1"   # chunk text is only read for hits
+QDRANT_TENANT_COLLECTIONS = os.getenv("QDRANT_TENANT_COLLECTIONS", "0") == "1"  # one collection per tenant
+
+# Optional cross-encoder reranking of retrieved chunks before prompt packing
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "32"))        # hits fetched from Qdrant when reranking
+RERANK_BATCH = int(os.getenv("RERANK_BATCH", "16"))                  # pairs per cross-encoder forward pass
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "320"))       # question + chunk tokens seen by the model
+RERANK_MIN_SCORE = float(os.environ["RERANK_MIN_SCORE"]) if os.getenv("RERANK_MIN_SCORE") else None  # logit cutoff
+
+# OpenTelemetry spans (needs opentelemetry-sdk + opentelemetry-exporter-otlp-proto-http; OTEL_* env configures export)
+TRACING = os.getenv("TRACING", "0") == "1"
+
+# Ingest as separate Celery tasks (parse -> embed batches on any worker -> finalize -> triples)
+INGEST_SPLIT = os.getenv("INGEST_SPLIT", "1") == "1"                 # 0 = whole document in one task
+INGEST_SPLIT_CHUNKS = int(os.getenv("INGEST_SPLIT_CHUNKS", "256"))   # chunks per embed task
+INGEST_SMALL_MB = float(os.getenv("INGEST_SMALL_MB", "2"))           # uploads up to this size jump the queue
+WORKER_HEARTBEAT_S = float(os.getenv("WORKER_HEARTBEAT_S", "10"))    # worker liveness beacon in Redis
+
+# Bulk loads (archive / directory ingest, `python -m kg_common.bulk`)
+BULK_DIR_ROOT = os.getenv("BULK_DIR_ROOT", "")                       # server directories /api/bulk/dir may read; empty disables
+BULK_ENQUEUE_CHUNK = int(os.getenv("BULK_ENQUEUE_CHUNK", "500"))     # tasks published per Celery group
+BULK_MAX_MB = int(os.getenv("BULK_MAX_MB", "2048"))                  # one archive upload
+
+# Startup: load and exercise models before serving (/api/ready turns green after), preload in the worker parent
+WARMUP = os.getenv("WARMUP", "1") == "1"
+WORKER_PRELOAD = os.getenv("WORKER_PRELOAD", "1") == "1"             # load weights before the prefork pool forks
@@ -0,0 +1,159 @@
+# services/common/kg_common/documents.py
+"""
+Document identity and ownership of vectors and triples.
+
+- `docs:hash`  content sha256 -> doc_id: an identical re-upload is a no-op
+- `docs:name`  file name -> doc_id of its latest upload: with replace, an
+  edited file keeps that doc_id and is re-ingested incrementally
+  (both keyed per tenant: "{tenant}:{hash}", "{tenant}/{name}")
+- `doc:{id}:chunks`  hashes of the chunks currently indexed for the document.
+  Point ids are uuid5(doc_id, chunk hash), so unchanged chunks keep their
+  points and are never re-embedded; hashes that disappear are deleted.
+- triples live in the document's named graph (kg.doc_graph)
+
+Everything a document owns can therefore be removed in bulk: Qdrant points by
+a doc_id payload filter, the named graph with one Graph Store DELETE.
+"""
+import hashlib
+import json
+import re
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+DOC_HASH_KEY = "docs:hash"
+DOC_NAME_KEY = "docs:name"
+
+_WS = re.compile(r"\s+")
+_DOC_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def doc_key(doc_id: str) -> str:
+    return f"doc:{doc_id}"
+
+
+def chunks_key(doc_id: str) -> str:
+    return f"doc:{doc_id}:chunks"
+
+
+def valid_doc_id(doc_id: str) -> bool:
+    return bool(_DOC_ID.fullmatch(doc_id or ""))
+
+
+def valid_tenant(tenant: str) -> bool:
+    return bool(_DOC_ID.fullmatch(tenant or ""))
+
+
+def hash_field(content_hash: str, tenant: Optional[str] = None) -> str:
+    return f"{tenant}:{content_hash}" if tenant else content_hash
+
+
+def name_field(name: str, tenant: Optional[str] = None) -> str:
+    return f"{tenant}/{name}" if tenant else name
+
+
+def new_doc_id(content_hash: str, tenant: Optional[str] = None) -> str:
+    if tenant:
+        return hashlib.sha256(f"{tenant}:{content_hash}".encode("utf-8")).hexdigest()[:32]
+    return content_hash[:32]
+
+
+# -------------------- Upload identity --------------------
+def _identity(content_hash: str, tags: List[str], tenant: Optional[str], doc_id: Optional[str],
+              existing: Optional[str], existing_tags: Optional[str], named: Optional[str]) -> Tuple[str, str]:
+    """
+    The rules, given what Redis holds: identical content with the same tags
+    is "unchanged"; identical content with new tags re-ingests that document
+    (every point is reused, only payloads change). Otherwise an explicit
+    doc_id, or with replace the doc_id last uploaded under the same name,
+    is re-ingested; anything else is a new document.
+    """
+    if existing and (doc_id is None or doc_id == existing):
+        if existing_tags is not None and json.loads(existing_tags or "[]") == tags:
+            return "unchanged", existing
+        doc_id = doc_id or existing
+    return "queued", doc_id or named or new_doc_id(content_hash, tenant)
+
+
+def resolve_identity(r, content_hash: str, name: str, tags: List[str], tenant: Optional[str] = None,
+                     doc_id: Optional[str] = None, replace: bool = False) -> Tuple[str, str]:
+    """("unchanged" | "queued", doc_id) for an upload named `name` (sync redis client)."""
+    existing = r.hget(DOC_HASH_KEY, hash_field(content_hash, tenant))
+    existing_tags = r.hget(doc_key(existing), "tags") if existing else None
+    named = r.hget(DOC_NAME_KEY, name_field(name, tenant)) if replace and doc_id is None else None
+    return _identity(content_hash, tags, tenant, doc_id, existing, existing_tags, named)
+
+
+async def aresolve_identity(r, content_hash: str, name: str, tags: List[str], tenant: Optional[str] = None,
+                            doc_id: Optional[str] = None, replace: bool = False) -> Tuple[str, str]:
+    """resolve_identity() for an async redis client."""
+    existing = await r.hget(DOC_HASH_KEY, hash_field(content_hash, tenant))
+    existing_tags = await r.hget(doc_key(existing), "tags") if existing else None
+    named = await r.hget(DOC_NAME_KEY, name_field(name, tenant)) if replace and doc_id is None else None
+    return _identity(content_hash, tags, tenant, doc_id, existing, existing_tags, named)
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(_WS.sub(" ", text).strip().encode("utf-8")).hexdigest()
+
+
+def point_id(doc_id: str, chunk_sha: str) -> str:
+    """Qdrant point id (UUIDv5) owned by the document and stable per chunk content."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{doc_id}:{chunk_sha}"))
+
+
+async def adelete_document(doc_id: str) -> Dict[str, int]:
+    """Remove a document's points, named graph and Redis state (API, event loop)."""
+    from qdrant_client.http import models as qmodels
+
+    from .aio import adrop_graph, async_qdrant, async_redis
+    from .kg import doc_graph
+    from .vector import collection_for
+
+    r = async_redis()
+    meta = await r.hgetall(doc_key(doc_id))
+    collection = collection_for(meta.get("tenant"))
+
+    flt = qmodels.Filter(must=[qmodels.FieldCondition(key="doc_id", match=qmodels.MatchValue(value=doc_id))])
+    q = async_qdrant()
+    points = 0
+    try:
+        points = (await q.count(collection, count_filter=flt, exact=True)).count
+        await q.delete(collection, points_selector=qmodels.FilterSelector(filter=flt), wait=True)
+    except Exception:
+        # collection may not exist yet; nothing to delete then
+        if points:
+            raise
+    await adrop_graph(doc_graph(doc_id))
+
+    await _aforget_identity(r, doc_id, meta)
+    await r.delete(doc_key(doc_id), chunks_key(doc_id), f"doc:{doc_id}:seq")
+    return {"points": int(points)}
+
+
+async def _aforget_identity(r, doc_id: str, meta: Dict[str, str]):
+    """
+    Drop the document's hash and name fields, but only while they still map
+    to it: a newer upload of the same file name (or content) may own them now.
+    """
+    from redis.exceptions import WatchError
+
+    tenant = meta.get("tenant") or None
+    fields = []
+    if meta.get("content_hash"):
+        fields.append((DOC_HASH_KEY, hash_field(meta["content_hash"], tenant)))
+    if meta.get("filename"):
+        fields.append((DOC_NAME_KEY, name_field(meta["filename"], tenant)))
+    if not fields:
+        return
+    async with r.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                await pipe.watch(DOC_HASH_KEY, DOC_NAME_KEY)
+                owned = [(key, field) for key, field in fields if await pipe.hget(key, field) == doc_id]
+                pipe.multi()
+                for key, field in owned:
+                    pipe.hdel(key, field)
+                await pipe.execute()
+                return
+            except WatchError:
+                continue  # an upload changed the mappings meanwhile; check again
@@ -0,0 +1,187 @@
+# services/common/kg_common/embed_cache.py
+"""
+Content-addressed embedding cache.
+
+Key = sha256(engine model id + normalized text), so re-uploaded manuals and
+duplicate chunks are embedded once per model. Vectors are stored as packed
+float32. Two stores, picked by EMBED_CACHE:
+  redis  shared across the worker fleet; LRU kept in a sorted set
+  disk   local sqlite file; LRU kept in a last-used column
+Both evict the least recently used entries beyond EMBED_CACHE_MAX.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from .config import EMBED_CACHE, EMBED_CACHE_MAX, EMBED_CACHE_PATH, EMBED_CACHE_REDIS_URL
+from .embeddings import embed_texts, get_engine
+from .metrics import EMBED_CACHE_HITS, EMBED_CACHE_MISSES
+
+_WS = re.compile(r"\s+")
+
+
+def _pack(vec: List[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(raw: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(raw)
+    return a.tolist()
+
+
+def cache_key(model_id: str, text: str) -> str:
+    norm = _WS.sub(" ", text).strip()
+    return hashlib.sha256(f"{model_id}\0{norm}".encode("utf-8")).hexdigest()
+
+
+class RedisEmbedCache:
+    name = "redis"
+    PREFIX = "emb:"
+    LRU = "emb:lru"
+
+    def __init__(self, url: str = EMBED_CACHE_REDIS_URL, max_entries: int = EMBED_CACHE_MAX):
+        import redis
+        self._r = redis.Redis.from_url(url)  # raw bytes; vectors are binary
+        self.max_entries = max_entries
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        raws = self._r.mget([self.PREFIX + k for k in keys])
+        found = {k: _unpack(v) for k, v in zip(keys, raws) if v}
+        if found:
+            now = time.time()
+            self._r.zadd(self.LRU, {k: now for k in found})
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        pipe = self._r.pipeline(transaction=False)
+        for k, vec in items.items():
+            pipe.set(self.PREFIX + k, _pack(vec))
+        pipe.zadd(self.LRU, {k: now for k in items})
+        pipe.zcard(self.LRU)
+        size = pipe.execute()[-1]
+        overflow = int(size) - self.max_entries
+        if overflow > 0:
+            evicted = [k.decode() if isinstance(k, bytes) else k for k, _ in self._r.zpopmin(self.LRU, overflow)]
+            if evicted:
+                self._r.delete(*[self.PREFIX + k for k in evicted])
+
+
+class DiskEmbedCache:
+    name = "disk"
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+
+    def _db(self) -> sqlite3.Connection:
+        # sqlite connections must not cross a fork (celery prefork children)
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS emb (k TEXT PRIMARY KEY, v BLOB NOT NULL, used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS emb_used ON emb(used)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        with self._lock:
+            db = self._db()
+            found: Dict[str, List[float]] = {}
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                marks = ",".join("?" * len(part))
+                for k, v in db.execute(f"SELECT k, v FROM emb WHERE k IN ({marks})", part):
+                    found[k] = _unpack(v)
+            if found:
+                now = time.time()
+                db.executemany("UPDATE emb SET used=? WHERE k=?", [(now, k) for k in found])
+                db.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "INSERT OR REPLACE INTO emb (k, v, used) VALUES (?, ?, ?)",
+                [(k, _pack(v), now) for k, v in items.items()],
+            )
+            (size,) = db.execute("SELECT COUNT(*) FROM emb").fetchone()
+            overflow = size - self.max_entries
+            if overflow > 0:
+                db.execute("DELETE FROM emb WHERE k IN (SELECT k FROM emb ORDER BY used LIMIT ?)", (overflow,))
+            db.commit()
+
+
+_STORES = {"redis": RedisEmbedCache, "disk": DiskEmbedCache}
+
+_cache_lock = threading.Lock()
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None and EMBED_CACHE in _STORES:
+        with _cache_lock:
+            if _cache is None:
+                _cache = _STORES[EMBED_CACHE]()
+    return _cache
+
+
+def cached_embed_texts(texts: List[str]) -> List[List[float]]:
+    """
+    embed_texts() with the content-addressed cache in front. Cache errors are
+    treated as misses so a flaky store never fails an ingest or a question.
+    """
+    texts = list(texts)
+    cache = get_cache()
+    if cache is None or not texts:
+        return embed_texts(texts)
+
+    model_id = get_engine().model_id
+    keys = [cache_key(model_id, t) for t in texts]
+    try:
+        found = cache.get_many(list(dict.fromkeys(keys)))
+    except Exception:
+        found = {}
+
+    missing = [i for i, k in enumerate(keys) if k not in found]
+    EMBED_CACHE_HITS.labels(cache.name).inc(len(texts) - len(missing))
+    EMBED_CACHE_MISSES.labels(cache.name).inc(len(missing))
+
+    if missing:
+        # embed each distinct missing text once
+        todo: Dict[str, str] = {}
+        for i in missing:
+            todo.setdefault(keys[i], texts[i])
+        fresh = dict(zip(todo.keys(), embed_texts(list(todo.values()))))
+        found.update(fresh)
+        try:
+            cache.put_many(fresh)
+        except Exception:
+            pass
+
+    return [found[k] for k in keys]
+
+
+def cached_embed_text(text: str) -> List[float]:
+    return cached_embed_texts([text])[0]
@@ -1,11 +1,222 @@
-from sentence_transformers import SentenceTransformer
-from functools import lru_cache
-from .config import EMBEDDING_MODEL
+# services/common/kg_common/embeddings.py
+"""
+Embedding engines, independent of the chat LLM.
 
-@lru_cache(maxsize=1)
+EMBED_BACKEND picks one of:
+  sentence-transformers  SentenceTransformer(EMBEDDING_MODEL) on CPU
+  onnx                   onnxruntime session over EMBED_MODEL_PATH/{model.onnx,tokenizer.json}
+  llama                  llama.cpp embedding-mode GGUF at EMBED_MODEL_PATH
+  hash                   deterministic byte-hash vectors (tests / smoke runs only)
+
+Every engine must produce EMBED_DIM-sized, L2-normalized vectors; a mismatch is
+a load error rather than something we discover later as a Qdrant 400.
+
+The first engine any process loads is recorded in Redis (`embed:model`).
+A process whose engine differs (another model, or the hash fallback where
+the others loaded the real one) refuses to embed: its query or document
+vectors would not be comparable with the stored ones. After a deliberate
+model change and full re-ingest, delete the key.
+"""
+import math
+import threading
+from typing import List
+
+from .config import (
+    EMBEDDING_MODEL,
+    EMBED_BACKEND,
+    EMBED_DIM,
+    EMBED_THREADS,
+    EMBED_ENCODE_BATCH,
+    EMBED_MODEL_PATH,
+    EMBED_FALLBACK,
+    REDIS_URL,
+)
+from .metrics import EMBED_FALLBACKS
+
+
+def _l2(vec) -> List[float]:
+    n = math.sqrt(sum(float(x) * float(x) for x in vec)) or 1.0
+    return [float(x) / n for x in vec]
+
+
+class SentenceTransformerEngine:
+    name = "sentence-transformers"
+
+    def __init__(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        torch.set_num_threads(EMBED_THREADS)
+        self.model_id = EMBEDDING_MODEL
+        self._model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+        self.dim = int(self._model.get_sentence_embedding_dimension())
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        out = self._model.encode(
+            texts,
+            batch_size=EMBED_ENCODE_BATCH,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return out.tolist()
+
+
+class OnnxEngine:
+    """Mean-pooled transformer exported to ONNX (e.g. optimum export of MiniLM)."""
+    name = "onnx"
+
+    def __init__(self):
+        import os
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        if not EMBED_MODEL_PATH:
+            raise ValueError("EMBED_MODEL_PATH must point to a directory with model.onnx and tokenizer.json")
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = EMBED_THREADS
+        opts.inter_op_num_threads = 1
+        self.model_id = f"onnx:{EMBED_MODEL_PATH}"
+        self._sess = ort.InferenceSession(
+            os.path.join(EMBED_MODEL_PATH, "model.onnx"), sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self._tok = Tokenizer.from_file(os.path.join(EMBED_MODEL_PATH, "tokenizer.json"))
+        self._tok.enable_truncation(max_length=512)
+        self._tok.enable_padding()
+        self._inputs = {i.name for i in self._sess.get_inputs()}
+        self.dim = int(self._sess.get_outputs()[0].shape[-1])
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
+        out: List[List[float]] = []
+        for i in range(0, len(texts), max(EMBED_ENCODE_BATCH, 1)):
+            enc = self._tok.encode_batch(texts[i:i + EMBED_ENCODE_BATCH])
+            ids = np.array([e.ids for e in enc], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+            feed = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self._inputs:
+                feed["token_type_ids"] = np.zeros_like(ids)
+            hidden = self._sess.run(None, feed)[0]
+            m = mask[..., None].astype(hidden.dtype)
+            pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-9, None)
+            out.extend(pooled.tolist())
+        return out
+
+
+class LlamaEmbeddingEngine:
+    """A dedicated embedding GGUF (e.g. nomic-embed, bge) loaded with embedding=True."""
+    name = "llama"
+
+    def __init__(self):
+        from llama_cpp import Llama
+        if not EMBED_MODEL_PATH:
+            raise ValueError("EMBED_MODEL_PATH must point to an embedding GGUF")
+        self.model_id = f"llama:{EMBED_MODEL_PATH}"
+        self._llm = Llama(
+            model_path=EMBED_MODEL_PATH,
+            embedding=True,
+            n_ctx=512,
+            n_batch=512,
+            n_threads=EMBED_THREADS,
+            use_mmap=True,
+            verbose=False,
+        )
+        self._lock = threading.Lock()
+        self.dim = int(self._llm.n_embd())
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        out: List[List[float]] = []
+        with self._lock:
+            for i in range(0, len(texts), max(EMBED_ENCODE_BATCH, 1)):
+                vecs = self._llm.embed(texts[i:i + EMBED_ENCODE_BATCH], normalize=True, truncate=True)
+                out.extend([float(x) for x in v] for v in vecs)
+        return out
+
+
+class HashEngine:
+    name = "hash"
+
+    def __init__(self, dim: int = EMBED_DIM):
+        self.model_id = f"hash:{dim}"
+        self.dim = dim
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        out = []
+        for text in texts:
+            h = [0.0] * self.dim
+            for i, b in enumerate(text.encode("utf-8", errors="ignore")):
+                h[i % self.dim] += (b / 255.0)
+            out.append(_l2(h))
+        return out
+
+
+_ENGINES = {
+    "sentence-transformers": SentenceTransformerEngine,
+    "onnx": OnnxEngine,
+    "llama": LlamaEmbeddingEngine,
+    "hash": HashEngine,
+}
+
+_engine_lock = threading.Lock()
+_engine = None
+
+MODEL_KEY = "embed:model"
+
+
+def _check_recorded(eng):
+    import redis
+    r = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=3, socket_connect_timeout=3)
+    r.set(MODEL_KEY, eng.model_id, nx=True)
+    recorded = r.get(MODEL_KEY)
+    if recorded and recorded != eng.model_id:
+        raise RuntimeError(
+            f"embedding engine {eng.model_id!r} differs from {recorded!r} recorded for the index; "
+            f"refusing to mix vectors (fix the model, or delete {MODEL_KEY} after a full re-ingest)"
+        )
+
+
+def get_engine():
+    """
+    Load the configured engine once per process. If it cannot be loaded and
+    EMBED_FALLBACK=1 (off by default), the whole process switches to
+    HashEngine so one writer never mixes real and hash vectors; the recorded
+    engine check keeps the api and the workers from disagreeing.
+    """
+    global _engine
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            cls = _ENGINES.get(EMBED_BACKEND)
+            if cls is None:
+                raise ValueError(f"Unknown EMBED_BACKEND={EMBED_BACKEND!r}; expected one of {sorted(_ENGINES)}")
+            try:
+                eng = cls()
+                if eng.dim != EMBED_DIM:
+                    raise ValueError(f"{eng.name} produces dim={eng.dim} but EMBED_DIM={EMBED_DIM}")
+            except Exception as e:
+                if not EMBED_FALLBACK:
+                    raise
+                EMBED_FALLBACKS.labels(EMBED_BACKEND, f"load:{type(e).__name__}").inc()
+                eng = HashEngine(EMBED_DIM)
+            _check_recorded(eng)
+            _engine = eng
+    return _engine
+
+
+# kept for callers that used the encoder directly
 def get_encoder():
-    return SentenceTransformer(EMBEDDING_MODEL)
+    return get_engine()
+
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Encode a batch of texts into EMBED_DIM-sized, normalized vectors."""
+    if not texts:
+        return []
+    eng = get_engine()
+    if isinstance(eng, HashEngine) and EMBED_BACKEND != "hash":
+        EMBED_FALLBACKS.labels(EMBED_BACKEND, "hash").inc(len(texts))
+    return eng.encode(list(texts))
+
 
-def embed_texts(texts):
-    model = get_encoder()
-    return model.encode(texts, normalize_embeddings=True).tolist()
+def embed_text(text: str) -> List[float]:
+    return embed_texts([text])[0]
@@ -0,0 +1,283 @@
+# services/common/kg_common/entity_index.py
+"""
+In-process entity index: normalized label -> entity URIs.
+
+- exact:  dict lookup of question n-grams
+- prefix: bisect over the sorted label list (a flat trie)
+- fuzzy:  character-trigram postings scored by Jaccard similarity
+
+Ingest records every subject it writes in the Redis hash `kg:entities`
+(uri -> label); HSET is idempotent, so concurrent workers never conflict.
+Each write is also appended to the stream `kg:entities:log`. The API loads
+the hash once at startup, then a background thread applies the stream
+entries it has not seen yet, so lookups never touch the network and a
+refresh costs what was added since the last one.
+"""
+import bisect
+import json
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .config import REDIS_URL, ENTITY_INDEX_REFRESH_S, ENTITY_FUZZY_MIN
+from .kg import entity_uri
+
+REDIS_KEY = "kg:entities"
+LOG_KEY = "kg:entities:log"
+LOG_MAXLEN = 100_000  # entries (one per document write); a reader further behind reloads the hash
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(label: str) -> str:
+    return _NON_ALNUM.sub(" ", label.lower()).strip()
+
+
+def _trigrams(s: str) -> Set[str]:
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class EntityIndex:
+    def __init__(self):
+        self._labels: Dict[str, Set[str]] = {}
+        self._sorted: List[str] = []
+        self._grams: Dict[str, Set[str]] = {}
+        self._glen: Dict[str, int] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def _add(self, label: str, uri: str) -> Optional[str]:
+        """Index one pair (caller holds the lock); returns the label if it is new."""
+        norm = normalize(label)
+        if not norm:
+            return None
+        uris = self._labels.get(norm)
+        if uris is None:
+            self._labels[norm] = {uri}
+            grams = _trigrams(norm)
+            self._glen[norm] = len(grams)
+            for g in grams:
+                self._grams.setdefault(g, set()).add(norm)
+            self._count += 1
+            return norm
+        if uri not in uris:
+            uris.add(uri)
+            self._count += 1
+        return None
+
+    def add(self, label: str, uri: str):
+        with self._lock:
+            norm = self._add(label, uri)
+            if norm is not None:
+                bisect.insort(self._sorted, norm)
+
+    def add_many(self, items: Iterable[Tuple[str, str]]):
+        """Bulk add: new labels are sorted into the prefix list once, not one insort each."""
+        with self._lock:
+            fresh = [norm for norm in (self._add(label, uri) for label, uri in items) if norm is not None]
+            if fresh:
+                fresh.sort()
+                # timsort merges the two sorted runs in linear time
+                self._sorted = sorted(self._sorted + fresh)
+
+    def exact(self, text: str) -> List[str]:
+        with self._lock:
+            return sorted(self._labels.get(normalize(text), ()))
+
+    def prefix(self, text: str, limit: int = 10) -> List[str]:
+        p = normalize(text)
+        if not p:
+            return []
+        out: List[str] = []
+        with self._lock:
+            i = bisect.bisect_left(self._sorted, p)
+            while i < len(self._sorted) and self._sorted[i].startswith(p) and len(out) < limit:
+                out.extend(sorted(self._labels[self._sorted[i]]))
+                i += 1
+        return out[:limit]
+
+    def fuzzy(self, text: str, limit: int = 5, min_score: float = ENTITY_FUZZY_MIN) -> List[Tuple[str, float]]:
+        norm = normalize(text)
+        if not norm:
+            return []
+        q = _trigrams(norm)
+        counts: Dict[str, int] = {}
+        # the refresher adds to the posting sets in place; hold the lock while iterating them
+        with self._lock:
+            # trigrams shared by a large share of all labels carry no signal and
+            # dominate the cost; skip them (unless nothing else is left)
+            cap = max(256, len(self._labels) // 200)
+            postings = [self._grams[g] for g in q if g in self._grams]
+            rare = [p for p in postings if len(p) <= cap] or postings
+            for post in rare:
+                for lab in post:
+                    counts[lab] = counts.get(lab, 0) + 1
+        lo, hi = len(q) * min_score, len(q) / max(min_score, 1e-6)
+        cands = sorted((lab for lab in counts if lo <= self._glen[lab] <= hi), key=lambda lab: -counts[lab])
+        scored = []
+        for lab in cands[:200]:
+            shared = len(q & _trigrams(lab))
+            score = shared / (len(q) + self._glen[lab] - shared)
+            if score >= min_score:
+                scored.append((lab, score))
+        scored.sort(key=lambda x: -x[1])
+        out: List[Tuple[str, float]] = []
+        with self._lock:
+            for lab, score in scored[:limit]:
+                out.extend((u, score) for u in sorted(self._labels[lab]))
+        return out[:limit]
+
+    def link(self, grams: Iterable[str], limit: int = 16, max_fuzzy: int = 2) -> List[str]:
+        """
+        URIs for question n-grams (most specific first): exact matches, then
+        fuzzy matches for up to `max_fuzzy` single words that matched nothing.
+        """
+        out: List[str] = []
+        misses: List[str] = []
+        for g in grams:
+            hits = self.exact(g)
+            if hits:
+                out.extend(u for u in hits if u not in out)
+            elif " " not in g.strip():
+                misses.append(g)
+            if len(out) >= limit:
+                return out[:limit]
+        fuzzed = 0
+        for g in misses:
+            if len(normalize(g)) < 4:
+                continue  # short words fuzz onto everything
+            out.extend(u for u, _ in self.fuzzy(g, limit=2) if u not in out)
+            fuzzed += 1
+            if len(out) >= limit or fuzzed >= max_fuzzy:
+                break
+        return out[:limit]
+
+
+# -------------------- Redis persistence --------------------
+_r = None
+
+
+def _redis():
+    global _r
+    if _r is None:
+        import redis
+        _r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _r
+
+
+def record_triples(triples: Iterable[Tuple[str, str, str]]):
+    """Called by ingest after a successful KG write: remember every subject."""
+    mapping = {entity_uri(s)[1:-1]: s for s, _, _ in triples}
+    if mapping:
+        pipe = _redis().pipeline()
+        pipe.hset(REDIS_KEY, mapping=mapping)
+        pipe.xadd(LOG_KEY, {"m": json.dumps(mapping)}, maxlen=LOG_MAXLEN, approximate=True)
+        pipe.execute()
+
+
+def clear_persisted():
+    pipe = _redis().pipeline()
+    pipe.delete(REDIS_KEY, LOG_KEY)
+    # tells the other API processes to drop what they hold
+    pipe.xadd(LOG_KEY, {"clear": "1"}, maxlen=LOG_MAXLEN, approximate=True)
+    pipe.execute()
+    _index_swap(EntityIndex(), _last_id())
+
+
+def _last_id() -> str:
+    last = _redis().xrevrange(LOG_KEY, count=1)
+    return last[0][0] if last else "0-0"
+
+
+def load_from_redis() -> Tuple[EntityIndex, str]:
+    """Full load; returns the index and the log position it covers."""
+    r = _redis()
+    # read the position first: entries added during the scan are replayed (adds are idempotent)
+    last = _last_id()
+    idx = EntityIndex()
+    idx.add_many((label, uri) for uri, label in r.hscan_iter(REDIS_KEY, count=5000))
+    return idx, last
+
+
+def _id(entry_id: str) -> Tuple[int, int]:
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _apply_log(idx: EntityIndex, after: str) -> Optional[str]:
+    """
+    Add the log entries after `after` to idx; returns the new position, or
+    None if the log no longer reaches back to `after` (trimmed or cleared)
+    and a full load is needed.
+    """
+    r = _redis()
+    first = r.xrange(LOG_KEY, count=1)
+    if not first:
+        return after if after == "0-0" else None
+    if after != "0-0" and _id(first[0][0]) > _id(after):
+        return None
+    while True:
+        entries = r.xrange(LOG_KEY, min=f"({after}", count=1000)
+        if not entries:
+            return after
+        for entry_id, fields in entries:
+            if "clear" in fields:
+                return None
+            idx.add_many((label, uri) for uri, label in json.loads(fields["m"]).items())
+            after = entry_id
+
+
+_index = EntityIndex()
+_log_pos: Optional[str] = None  # last applied kg:entities:log id; None until loaded
+_swap_lock = threading.Lock()
+_refresher: Optional[threading.Thread] = None
+
+
+def _index_swap(idx: EntityIndex, pos: Optional[str]):
+    global _index, _log_pos
+    with _swap_lock:
+        _index, _log_pos = idx, pos
+
+
+def get_index() -> EntityIndex:
+    return _index
+
+
+def refresh(force: bool = False) -> bool:
+    """Apply new log entries to the live index; full reload when forced or when the log has a gap."""
+    global _log_pos
+    if not force and _log_pos is not None:
+        pos = _apply_log(_index, _log_pos)
+        if pos is not None:
+            changed, _log_pos = pos != _log_pos, pos
+            return changed
+    idx, pos = load_from_redis()
+    _index_swap(idx, pos)
+    return True
+
+
+def start_refresher(interval: float = ENTITY_INDEX_REFRESH_S):
+    """Load once, then keep the index fresh from a daemon thread (API startup)."""
+    global _refresher
+    if _refresher is not None:
+        return
+
+    def loop():
+        while True:
+            try:
+                refresh()
+            except Exception:
+                pass
+            time.sleep(interval)
+
+    try:
+        refresh(force=True)
+    except Exception:
+        pass
+    _refresher = threading.Thread(target=loop, name="entity-index", daemon=True)
+    _refresher.start()
@@ -0,0 +1,172 @@
+# services/common/kg_common/hybrid.py
+"""
+KG side of hybrid retrieval for query.answer*().
+
+1) link: question n-grams -> entity URIs via the in-process entity index,
+   or slug guesses (same slugging as ingest) while the index is empty
+2) lookup: one bounded SPARQL query for the 1-hop neighborhood of those URIs
+   (only the documents' named graphs when a search is filtered by doc_ids)
+3) fuse: reciprocal rank fusion of the vector ranking with an entity-mention
+   ranking of the same chunks, facts kept in link order
+4) render: facts grouped by subject, one compact line each, to save prompt tokens
+
+Both a sync (threads) and an async (event loop) lookup are provided; query.py
+runs them concurrently with the Qdrant search.
+"""
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .config import KG_MAX_FACTS, KG_NEIGHBORHOOD_LIMIT, KG_LOOKUP_TIMEOUT, RRF_K, ENTITY_INDEX
+from .kg import EX, entity_uri
+
+Fact = Tuple[str, str, str]
+
+_TOKEN = re.compile(r"[A-Za-z0-9][\w'-]*")
+_STOP = frozenset(
+    "a an the of in on at to for from by with and or is are was were be been what which who whom "
+    "whose when where why how does do did can could should would will about tell me list give show "
+    "there their this that these those it its as than into over under".split()
+)
+
+
+def _ngrams(question: str, max_n: int = 3) -> List[List[str]]:
+    toks = _TOKEN.findall(question)
+    grams: List[List[str]] = []
+    for n in range(max_n, 0, -1):  # longer phrases first: they link more precisely
+        for i in range(len(toks) - n + 1):
+            g = toks[i:i + n]
+            if g[0].lower() in _STOP or g[-1].lower() in _STOP:
+                continue
+            grams.append(g)
+    return grams
+
+
+def link_candidates(question: str, limit: int = 96) -> List[str]:
+    """
+    Candidate entity URIs for the question, most specific first. With a loaded
+    entity index these are known entities; otherwise ingest's slugging is
+    applied to a few casings of each n-gram and the SPARQL query filters them.
+    """
+    grams = _ngrams(question)
+    if ENTITY_INDEX:
+        from .entity_index import get_index
+        idx = get_index()
+        if len(idx):
+            return [f"<{u}>" for u in idx.link((" ".join(g) for g in grams), limit=16)]
+
+    out: List[str] = []
+    seen = set()
+    for g in grams:
+        for variant in (g, [w.capitalize() for w in g], [w.lower() for w in g]):
+            uri = entity_uri(" ".join(variant))
+            if uri not in seen:
+                seen.add(uri)
+                out.append(uri)
+            if len(out) >= limit:
+                return out
+    return out
+
+
+def neighborhood_query(uris: Sequence[str], limit: int = KG_NEIGHBORHOOD_LIMIT,
+                       graphs: Optional[Sequence[str]] = None) -> str:
+    """1-hop neighborhood; with `graphs`, only those named graphs (filtered search)."""
+    values = " ".join(uris)
+    if graphs is not None:
+        gvalues = " ".join(f"<{g}>" for g in graphs)
+        return (
+            "SELECT DISTINCT ?e ?s ?p ?o WHERE { "
+            f"VALUES ?e {{ {values} }} VALUES ?g {{ {gvalues} }} "
+            "{ GRAPH ?g { ?e ?p ?o } BIND(?e AS ?s) } UNION { GRAPH ?g { ?s ?p ?e } BIND(?e AS ?o) } "
+            f"}} LIMIT {int(limit)}"
+        )
+    return (
+        "SELECT DISTINCT ?e ?s ?p ?o WHERE { "
+        f"VALUES ?e {{ {values} }} "
+        "{ ?e ?p ?o . BIND(?e AS ?s) } UNION { GRAPH ?g { ?e ?p ?o } BIND(?e AS ?s) } "
+        "UNION { ?s ?p ?e . BIND(?e AS ?o) } UNION { GRAPH ?g2 { ?s ?p ?e } BIND(?e AS ?o) } "
+        f"}} LIMIT {int(limit)}"
+    )
+
+
+def label(term: str) -> str:
+    """Compact display form of a URI or literal."""
+    if term.startswith(EX):
+        term = term[len(EX):]
+    elif "://" in term:
+        term = re.split(r"[/#]", term.rstrip("/#"))[-1]
+    return term.replace("_", " ").strip()
+
+
+def parse_facts(data, candidates: Sequence[str]) -> Tuple[List[Fact], List[str]]:
+    """SPARQL JSON -> (facts ordered by link priority, labels of linked entities)."""
+    rank = {u.strip("<>"): i for i, u in enumerate(candidates)}
+    rows = []
+    for b in (data or {}).get("results", {}).get("bindings", []):
+        e = b.get("e", {}).get("value")
+        s = b.get("s", {}).get("value")
+        p = b.get("p", {}).get("value")
+        o = b.get("o", {}).get("value")
+        if e and s and p and o:
+            rows.append((rank.get(e, len(rank)), e, (label(s), label(p), label(o))))
+    rows.sort(key=lambda r: r[0])
+    facts: List[Fact] = []
+    seen = set()
+    linked: List[str] = []
+    for _, e, f in rows:
+        if f not in seen:
+            seen.add(f)
+            facts.append(f)
+        if e not in linked:
+            linked.append(e)
+    return facts, [label(e) for e in linked]
+
+
+def kg_lookup(question: str, graphs: Optional[Sequence[str]] = None) -> Tuple[List[Fact], List[str]]:
+    from .clients import sparql_select
+    cands = link_candidates(question)
+    if not cands or graphs == []:
+        return [], []
+    # no retries: a retried lookup would outlast KG_LOOKUP_TIMEOUT, and the answer does without facts
+    data = sparql_select(neighborhood_query(cands, graphs=graphs), timeout=(1, KG_LOOKUP_TIMEOUT), retry=False)
+    return parse_facts(data, cands)
+
+
+async def kg_lookup_async(question: str, graphs: Optional[Sequence[str]] = None) -> Tuple[List[Fact], List[str]]:
+    from .aio import asparql_select
+    cands = link_candidates(question)
+    if not cands or graphs == []:
+        return [], []
+    data = await asparql_select(neighborhood_query(cands, graphs=graphs), timeout=KG_LOOKUP_TIMEOUT)
+    return parse_facts(data, cands)
+
+
+def rrf(rankings: Iterable[Sequence[int]], k: int = RRF_K) -> Dict[int, float]:
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for r, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + r + 1)
+    return scores
+
+
+def fuse(contexts: List[str], facts: List[Fact], labels: List[str],
+         max_facts: int = KG_MAX_FACTS) -> Tuple[List[str], List[Fact]]:
+    """
+    Re-rank vector contexts with RRF over (vector order, entity-mention order)
+    so chunks that mention linked entities move up; keep the top facts.
+    """
+    if labels and contexts:
+        low = [c.lower() for c in contexts]
+        labs = [lb.lower() for lb in labels if lb]
+        mentions = [sum(1 for lb in labs if lb in c) for c in low]
+        by_mention = sorted((i for i in range(len(contexts)) if mentions[i]), key=lambda i: -mentions[i])
+        scores = rrf([list(range(len(contexts))), by_mention])
+        contexts = [contexts[i] for i in sorted(range(len(contexts)), key=lambda i: -scores[i])]
+    return contexts, facts[:max_facts]
+
+
+def render_facts(facts: Sequence[Fact]) -> str:
+    """Group by subject: 'Acme Corp: founded by 1999; based in Berlin'."""
+    grouped: Dict[str, List[str]] = {}
+    for s, p, o in facts:
+        grouped.setdefault(s, []).append(f"{p} {o}")
+    return "\n".join(f"- {s}: " + "; ".join(po) for s, po in grouped.items())
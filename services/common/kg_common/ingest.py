@@ -1,83 +1,90 @@
 # services/common/kg_common/ingest.py
+import hashlib
 import io
+import json
 import os
 import re
 import time
-import uuid
+import heapq
 import itertools
-from typing import List, Tuple, Iterable, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set, Tuple, Iterable, Iterator, Dict, Any, BinaryIO
 
 import redis
-import requests
-from pdfminer.high_level import extract_text
 
-from qdrant_client import QdrantClient
 from qdrant_client.http import models as qmodels
 
-from .llm import complete, embed
-from requests.auth import HTTPBasicAuth
-
-FUSEKI_USER = os.getenv("FUSEKI_USER") or None
-FUSEKI_PASSWORD = os.getenv("FUSEKI_PASSWORD") or None
+from .llm import complete
+from .embed_cache import cached_embed_texts
+from .chunking import chunk_text, count_tokens, iter_blocks, iter_chunks
+from .config import EMBED_DIM
+from .answer_cache import bump_corpus_version
+from .kg import write_triples
+from .clients import qdrant
+from .vector import collection_for, ensure_collection
+from .entity_index import record_triples
+from .documents import DOC_HASH_KEY, chunk_hash, chunks_key, doc_key, hash_field, point_id
+from .metrics import INGEST_STAGE_SECONDS
+from .tracing import bind, stage
 
 # -------------------- Config --------------------
 REDIS_URL   = os.getenv("REDIS_URL", "redis://redis:6379/0")
-#FUSEKI_BASE = os.getenv("FUSEKI_URL", "http://fuseki:3030/kg")
-QDRANT_URL  = os.getenv("QDRANT_URL", "http://qdrant:6333")
 QCOLLECTION = os.getenv("QDRANT_COLLECTION", "docs")
 
-_r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
-
-# replace the FUSEKI_BASE line + insert helpers
-RAW_FUSEKI = os.getenv("FUSEKI_URL", "http://fuseki:3030/kg").rstrip("/")
+# batched ingest knobs
+EMBED_BATCH   = int(os.getenv("EMBED_BATCH", "32"))           # chunks per embed call
+UPSERT_BATCH  = int(os.getenv("QDRANT_UPSERT_BATCH", "256"))  # points per Qdrant request
+UPSERT_WAIT   = os.getenv("QDRANT_UPSERT_WAIT", "0") == "1"   # wait on every batch (slow)
 
-def _fuseki_auth():
-    if FUSEKI_USER and FUSEKI_PASSWORD:
-        return HTTPBasicAuth(FUSEKI_USER, FUSEKI_PASSWORD)
-    return None
-
-
-def _fuseki_base():
-    if re.search(r"/[^/]+$", RAW_FUSEKI):
-        return RAW_FUSEKI
-    return RAW_FUSEKI + "/kg"
+# full-document triple extraction knobs
+TRIPLE_WORKERS      = int(os.getenv("TRIPLE_WORKERS", "4"))          # concurrent LLM extraction calls
+TRIPLE_MAX_TOKENS   = int(os.getenv("TRIPLE_MAX_TOKENS", "128"))     # output tokens per chunk
+TRIPLE_TOKEN_BUDGET = int(os.getenv("TRIPLE_TOKEN_BUDGET", "12000"))  # prompt+output tokens per document
+TRIPLE_CACHE_TTL    = int(os.getenv("TRIPLE_CACHE_TTL", str(30 * 86400)))  # seconds; per-chunk LLM triples
 
+_r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
 
-# lazy client so env overrides (if any) are respected at runtime
-_Q: QdrantClient | None = None
-def _q() -> QdrantClient:
-    global _Q
-    if _Q is None:
-        _Q = QdrantClient(url=QDRANT_URL, timeout=15)  # prefer HTTP; stable for Compose
-    return _Q
+# shared pooled client (kg_common.clients)
+_q = qdrant
 
 # -------------------- Small helpers --------------------
 def _doc_set(doc_id: str, **fields):
-    key = f"doc:{doc_id}"
+    key = doc_key(doc_id)
     fields.setdefault("updated_at", str(int(time.time())))
     _r.hset(key, mapping=fields)
 
 def _progress(doc_id: str, phase: str, info: str = ""):
     _doc_set(doc_id, status=phase, info=info)
 
-def _read_text(filename: str, data: bytes) -> str:
+TEXT_BLOCK = 1 << 20  # characters per read for plain-text sources
+
+def _iter_pages(filename: str, fp: BinaryIO) -> Iterator[str]:
+    """
+    Yield the document a page at a time (PDF) or in TEXT_BLOCK sized pieces
+    (plain text), so the whole text is never held in memory.
+    """
     name = (filename or "").lower()
     if name.endswith(".pdf"):
-        return (extract_text(io.BytesIO(data)) or "").strip()
-    return data.decode("utf-8", errors="ignore")
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
 
-def _chunk_text(text: str, max_tokens: int = 450, overlap: int = 50) -> List[str]:
-    # simple whitespace chunker approximating tokens by words
-    words = re.findall(r"\S+", text)
-    if not words:
-        return []
-    chunks: List[str] = []
-    step = max(max_tokens - overlap, 1)
-    for i in range(0, len(words), step):
-        piece = " ".join(words[i:i + max_tokens]).strip()
-        if piece:
-            chunks.append(piece)
-    return chunks
+        for page in extract_pages(fp):
+            # one text box per paragraph: blank lines keep the layout for the chunker
+            yield "\n".join(el.get_text() for el in page if isinstance(el, LTTextContainer)) + "\n\n"
+        return
+    reader = io.TextIOWrapper(fp, encoding="utf-8", errors="ignore")
+    while True:
+        block = reader.read(TEXT_BLOCK)
+        if not block:
+            return
+        yield block
+
+def _read_text(filename: str, data: bytes) -> str:
+    return "".join(_iter_pages(filename, io.BytesIO(data))).strip()
+
+def _chunk_text(text: str) -> List[str]:
+    # token-accurate, sentence/paragraph aware (kg_common.chunking)
+    return chunk_text(text)
 
 # -------------------- Triple extraction --------------------
 TRIPLE_SYS = (
@@ -92,13 +99,14 @@ TRIPLE_SYS = (
 _PAT_EQ = re.compile(r'\b([A-Z][A-Za-z0-9 _-]{2,})\s+is\s+(an?|the)?\s*([A-Za-z0-9 _-]{2,})', re.I)
 _PAT_OF = re.compile(r'\b([A-Z][A-Za-z0-9 _-]{2,})\s+of\s+([A-Z][A-Za-z0-9 _-]{2,})', re.I)
 
-def extract_triples_llm(text: str) -> List[str]:
+def extract_triples_llm(text: str, max_tokens: int = 64) -> List[str]:
     """
     Ask the local LLM for triples. Keep it conservative to reduce model stress.
     """
     try:
         # shorter prompt slice + small max_tokens keeps within tiny models' ctx
-        raw = complete(TRIPLE_SYS, text[:3000], max_tokens=64, temperature=0.1)
+        with stage("triple_llm"):
+            raw = complete(TRIPLE_SYS, text[:3000], max_tokens=max_tokens, temperature=0.1)
         lines = [ln.strip() for ln in (raw or "").splitlines() if ln.strip()]
         return [ln for ln in lines if "|" in ln]
     except Exception:
@@ -115,97 +123,210 @@ def extract_triples_rule(text: str) -> List[str]:
         triples.append(f"{a.strip()} | of | {b.strip()}")
     return triples
 
-def _sparql_insert_triples(triples: Iterable[Tuple[str, str, str]]):
-    """
-    Insert triples into Fuseki (simple INSERT DATA).
-    """
-    triples = list(triples)
-    if not triples:
-        return
-
-    #update_url = f"{FUSEKI_BASE}/update"
-    update_url = _fuseki_base() + "/update"
+def _parse_triples(lines: Iterable[str]) -> List[Tuple[str, str, str]]:
+    out: List[Tuple[str, str, str]] = []
+    for ln in lines:
+        parts = [p.strip(" ()") for p in ln.split("|")]
+        if len(parts) == 3 and all(parts):
+            out.append((parts[0], parts[1], parts[2]))
+    return out
 
-    def ex_uri(x: str) -> str:
-        slug = re.sub(r"[^a-zA-Z0-9]+", "_", x).strip("_") or "x"
-        return f"<http://example.org/{slug}>"
+def _approx_tokens(text: str) -> int:
+    # model tokenizer when available, ~4 chars/token otherwise; only used for budgeting
+    return max(count_tokens(text), 1)
 
-    def obj_form(x: str) -> str:
-        if re.fullmatch(r"-?\d+(\.\d+)?", x):
-            return x
-        if x.startswith("http://") or x.startswith("https://"):
-            return f"<{x}>"
-        return '"' + x.replace('"', '\\"') + '"'
+_CAP_OR_NUM = re.compile(r"\b(?:[A-Z][\w-]+|\d[\d.,:/-]*)\b")
 
-    triples_nt = [f"{ex_uri(s)} {ex_uri(p)} {obj_form(o)} ." for s, p, o in triples]
-    sparql = "INSERT DATA { " + " ".join(triples_nt) + " }"
+def _density(chunk: str) -> float:
+    """
+    Cheap information-density score: distinct capitalized terms and numbers
+    (entity/fact candidates) per word, weighted by lexical diversity.
+    """
+    words = chunk.split()
+    if not words:
+        return 0.0
+    facts = len(set(_CAP_OR_NUM.findall(chunk)))
+    diversity = len(set(w.lower() for w in words)) / len(words)
+    return facts / len(words) * diversity
 
-    # application/x-www-form-urlencoded with 'update' is fine for Fuseki
-    #resp = requests.post(update_url, data={"update": sparql}, timeout=30)
-    #resp.raise_for_status()
-    resp = requests.post(update_url, data={"update": sparql}, timeout=30, auth=_fuseki_auth())
-    resp.raise_for_status()
+def _select_for_triples(chunks: List[str], budget: int = TRIPLE_TOKEN_BUDGET) -> List[int]:
+    """
+    Indices of the densest chunks whose prompt+output tokens fit the per-document
+    budget, returned in document order. The first chunk always gets a slot.
+    """
+    ranked = sorted(range(len(chunks)), key=lambda i: _density(chunks[i]), reverse=True)
+    if 0 in ranked:
+        ranked.remove(0)
+        ranked.insert(0, 0)
+    picked: List[int] = []
+    spent = 0
+    for i in ranked:
+        cost = _approx_tokens(chunks[i][:3000]) + TRIPLE_MAX_TOKENS
+        if spent + cost > budget and picked:
+            continue
+        picked.append(i)
+        spent += cost
+    return sorted(picked)
+
+class TripleCandidates:
+    """
+    Bounded pool of triple-extraction candidates fed one chunk at a time: the
+    first chunk plus the densest others, capped at how many chunks could fit
+    the token budget at all (each costs at least TRIPLE_MAX_TOKENS + 1).
+    """
 
-# -------------------- Qdrant helpers --------------------
-def _ensure_qdrant_collection(dim: int):
+    def __init__(self, budget: int = TRIPLE_TOKEN_BUDGET):
+        self.budget = budget
+        self.cap = max(2 * budget // (TRIPLE_MAX_TOKENS + 1), 1)
+        self.first: str | None = None
+        self._heap: List[Tuple[float, int, str]] = []  # (density, -index, chunk)
+        self._n = 0
+
+    def add(self, chunk: str):
+        i = self._n
+        self._n += 1
+        if i == 0:
+            self.first = chunk
+            return
+        # ties evict the later chunk, matching the stable sort in _select_for_triples
+        item = (_density(chunk), -i, chunk)
+        if len(self._heap) < self.cap:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def chunks(self) -> List[str]:
+        """Candidates in document order (first chunk first)."""
+        rest = [c for _, _, c in sorted(self._heap, key=lambda x: -x[1])]
+        return ([self.first] if self.first is not None else []) + rest
+
+def _triple_key(t: Tuple[str, str, str]) -> Tuple[str, str, str]:
+    return tuple(re.sub(r"\s+", " ", x).strip().lower() for x in t)
+
+def dedupe_triples(triples: Iterable[Tuple[str, str, str]]) -> List[Tuple[str, str, str]]:
+    """Drop case/whitespace duplicates, keeping the first surface form."""
+    seen = set()
+    out: List[Tuple[str, str, str]] = []
+    for t in triples:
+        k = _triple_key(t)
+        if k not in seen:
+            seen.add(k)
+            out.append(t)
+    return out
+
+def _triple_cache_key(chunk: str) -> str:
+    h = hashlib.sha256(f"{TRIPLE_SYS}\0{TRIPLE_MAX_TOKENS}\0".encode("utf-8"))
+    h.update(chunk_hash(chunk).encode("ascii"))
+    return "tri:" + h.hexdigest()
+
+def _extract_chunk(chunk: str) -> List[Tuple[str, str, str]]:
     """
-    Ensure collection exists with the given dimension; recreate if missing.
+    LLM triples for a chunk, cached by content in Redis so re-ingesting an
+    edited document only pays for chunks that changed. Rule-based fallbacks
+    are not cached (the model may just have been unavailable).
     """
-    q = _q()
+    key = _triple_cache_key(chunk)
     try:
-        info = q.get_collection(QCOLLECTION)
-        # If size mismatches, recreate (avoid subtle 400s later).
-        current_dim = None
-        try:
-            # qdrant_client>=1.7 exposes vectors config in info if needed;
-            # otherwise just recreate to be safe when dimensions differ.
-            # We keep the simple path: recreate unconditionally if needed.
-            pass
-        except Exception:
-            pass
-        # Already exists; assume correct unless you *know* it changed.
-        return
+        hit = _r.get(key)
+        if hit is not None:
+            return [tuple(t) for t in json.loads(hit)]
+    except Exception:
+        pass
+    lines = extract_triples_llm(chunk, max_tokens=TRIPLE_MAX_TOKENS)
+    if not lines:
+        return _parse_triples(extract_triples_rule(chunk))
+    triples = _parse_triples(lines)
+    try:
+        _r.setex(key, TRIPLE_CACHE_TTL, json.dumps(triples))
     except Exception:
-        # (not found or cannot fetch) -> recreate
         pass
+    return triples
 
-    q.recreate_collection(
-        collection_name=QCOLLECTION,
-        vectors_config=qmodels.VectorParams(size=dim, distance=qmodels.Distance.COSINE),
-    )
+def extract_document_triples(chunks: List[str]) -> List[Tuple[str, str, str]]:
+    """
+    Fan the budgeted chunks out over TRIPLE_WORKERS threads. Calls are I/O
+    bound against the inference server (or queue on the local scheduler), so
+    threads are enough to keep every model slot busy.
+    """
+    picked = _select_for_triples(chunks)
+    if not picked:
+        return []
+    workers = max(min(TRIPLE_WORKERS, len(picked)), 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="triples") as pool:
+        results = list(pool.map(bind(lambda i: _extract_chunk(chunks[i])), picked))
+    return dedupe_triples(t for res in results for t in res)
 
-def _next_point_uuid(doc_id: str) -> str:
+def _sparql_insert_triples(triples: Iterable[Tuple[str, str, str]], doc_id: str | None = None):
     """
-    Qdrant requires id as unsigned int or UUID.
-    We use a stable UUIDv5: namespace=NAMESPACE_URL, name=f"{doc_id}-{seq}".
+    Write triples to Fuseki through the shared KG writer (Graph Store Protocol,
+    batched N-Triples), replacing the document's named graph.
     """
-    seq = _r.incr(f"doc:{doc_id}:seq")
-    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{doc_id}-{seq}"))
+    return write_triples(triples, doc_id=doc_id, replace=bool(doc_id))
 
-def upsert_vector(doc_id: str, vector: List[float], payload: Dict[str, Any]):
+# -------------------- Qdrant helpers --------------------
+def _ensure_qdrant_collection(dim: int, collection: str = QCOLLECTION):
     """
-    Upsert a single embedding to Qdrant with a UUIDv5 point id.
-    Ensures the embedding is a flat list[float].
+    Ensure the collection exists with the managed schema (kg_common.vector)
+    and the given dimension; a size mismatch raises.
     """
-    # Normalize vector -> flat list[float]
+    ensure_collection(_q(), collection, dim)
+
+def _payload_point_id(doc_id: str, payload: Dict[str, Any]) -> str:
+    """UUIDv5 of (doc_id, chunk hash): re-ingesting an unchanged chunk hits the same point."""
+    sha = payload.get("chunk_hash") or chunk_hash(payload.get("text") or "")
+    return point_id(doc_id, sha)
+
+def _doc_filter(doc_id: str) -> qmodels.Filter:
+    return qmodels.Filter(must=[qmodels.FieldCondition(key="doc_id", match=qmodels.MatchValue(value=doc_id))])
+
+def _delete_doc_points(doc_id: str, collection: str = QCOLLECTION):
+    _q().delete(collection_name=collection, points_selector=qmodels.FilterSelector(filter=_doc_filter(doc_id)), wait=True)
+
+def _delete_points(ids: List[str], collection: str = QCOLLECTION):
+    for batch in _batches(ids, UPSERT_BATCH):
+        _q().delete(collection_name=collection, points_selector=qmodels.PointIdsList(points=batch), wait=True)
+
+def _flat_vector(vector) -> List[float]:
     if isinstance(vector, list) and vector and isinstance(vector[0], list):
         vector = vector[0]
     try:
         vector = [float(x) for x in vector]
     except Exception as e:
         raise TypeError(f"Embedding must be convertible to list[float]: {e}")
-
     if not vector:
         raise ValueError("Empty embedding vector")
+    return vector
+
+def upsert_vectors(doc_id: str, vectors: List[List[float]], payloads: List[Dict[str, Any]], wait: bool = False,
+                   collection: str = QCOLLECTION):
+    """
+    Bulk upsert: one Qdrant request per call, ids derived from the chunk hash.
+    The caller is expected to have ensured the collection already.
+    """
+    if len(vectors) != len(payloads):
+        raise ValueError("vectors and payloads must have the same length")
+    if not vectors:
+        return
+    ids = [_payload_point_id(doc_id, pl or {}) for pl in payloads]
+    points = [
+        qmodels.PointStruct(id=pid, vector=_flat_vector(vec), payload={"doc_id": doc_id, **(pl or {})})
+        for pid, vec, pl in zip(ids, vectors, payloads)
+    ]
+    _q().upsert(collection_name=collection, points=points, wait=wait)
 
+def upsert_vector(doc_id: str, vector: List[float], payload: Dict[str, Any]):
+    """
+    Upsert a single embedding to Qdrant with a UUIDv5 point id.
+    Ensures the embedding is a flat list[float].
+    """
+    vector = _flat_vector(vector)
     _ensure_qdrant_collection(len(vector))
-    point_id = _next_point_uuid(doc_id)
 
     _q().upsert(
         collection_name=QCOLLECTION,
         points=[
             qmodels.PointStruct(
-                id=point_id,                 # UUID string (valid point id)
+                id=_payload_point_id(doc_id, payload or {}),   # UUID string (valid point id)
                 vector=vector,
                 payload={"doc_id": doc_id, **(payload or {})},
             )
@@ -214,61 +335,292 @@ def upsert_vector(doc_id: str, vector: List[float], payload: Dict[str, Any]):
     )
 
 # -------------------- Main pipeline --------------------
-def process_document(filename: str, data: bytes, doc_id: str):
-    """
-    Ingest pipeline:
-      1) parse -> chunks
-      2) extract a few triples (LLM, fallback to rules) -> Fuseki
-      3) embed each chunk -> Qdrant
-    Writes progress to Redis at key 'doc:{doc_id}'.
+def _batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    size = max(int(size), 1)
+    it = iter(items)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def _timed_iter(items: Iterable[Any], timings: Dict[str, float], key: str) -> Iterator[Any]:
+    """Charge the time spent producing each item to timings[key]."""
+    it = iter(items)
+    while True:
+        t0 = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        finally:
+            timings[key] = timings.get(key, 0.0) + time.perf_counter() - t0
+        yield item
+
+def _stream_chunks(doc_id: str, filename: str, fp: BinaryIO, timings: Dict[str, float],
+                   counts: Dict[str, int]) -> Iterator[str]:
+    """Pages -> words -> chunks, reporting pages/chunks to Redis as they are produced."""
+    def pages():
+        for page in _timed_iter(_iter_pages(filename, fp), timings, "parse"):
+            counts["pages"] += 1
+            _doc_set(doc_id, pages=counts["pages"], chunks=counts["chunks"])
+            yield page
+
+    for chunk in _timed_iter(iter_chunks(iter_blocks(pages())), timings, "chunk"):
+        counts["chunks"] += 1
+        yield chunk
+    # the chunk timer also ran while pages were being parsed
+    timings["chunk"] = max(timings.get("chunk", 0.0) - timings.get("parse", 0.0), 0.0)
+    _doc_set(doc_id, pages=counts["pages"], chunks=counts["chunks"])
+
+def _embed_and_upsert(doc_id: str, chunks: Iterable[str], timings: Dict[str, float],
+                      counts: Dict[str, int] | None = None, known: Set[str] = frozenset(),
+                      indexed: Set[str] | None = None, collection: str = QCOLLECTION,
+                      meta: Dict[str, Any] | None = None) -> int:
     """
-    _progress(doc_id, "received", filename)
-
-    text = _read_text(filename, data)
-    if not text.strip():
-        _progress(doc_id, "failed", "Empty or unreadable text")
-        raise ValueError("Empty or unreadable text")
+    Embed chunks EMBED_BATCH at a time as they arrive and push them to Qdrant
+    in UPSERT_BATCH sized requests. Only the last request waits, which also
+    covers the earlier ones since Qdrant applies updates to a collection in order.
 
-    chunks = _chunk_text(text)
-    _progress(doc_id, "parsed", f"chunks={len(chunks)}")
-
-    # --- triples (sample from the first chunk; fast, avoids long contexts) ---
-    triples_parsed: List[Tuple[str, str, str]] = []
-    sample_text = chunks[0] if chunks else ""
-    if sample_text:
-        triples_text = extract_triples_llm(sample_text)
-        if not triples_text:
-            triples_text = extract_triples_rule(sample_text)
-        for ln in triples_text:
-            parts = [p.strip(" ()") for p in ln.split("|")]
-            if len(parts) == 3 and all(parts):
-                triples_parsed.append((parts[0], parts[1], parts[2]))
+    Chunks whose hash is in `known` already have their point and are skipped.
+    Every hash that ends up indexed is added to `indexed`; returns the number
+    of chunks embedded. `meta` (tags, tenant, uploaded_at) goes into every payload.
+    """
+    total = 0
+    indexed = indexed if indexed is not None else set()
+    pending_vecs: List[List[float]] = []
+    pending_payloads: List[Dict[str, Any]] = []
+
+    meta = meta or {}
+    # once per document, sized by the declared engine dimension
+    _ensure_qdrant_collection(EMBED_DIM, collection)
+
+    def flush(wait: bool):
+        nonlocal total
+        if not pending_vecs:
+            return
+        t0 = time.perf_counter()
+        try:
+            with stage("upsert", points=len(pending_vecs)):
+                upsert_vectors(doc_id, pending_vecs, pending_payloads, wait=wait, collection=collection)
+            total += len(pending_vecs)
+            indexed.update(pl["chunk_hash"] for pl in pending_payloads)
+        except Exception as e:
+            _progress(doc_id, "embed_warning", f"{type(e).__name__}: {len(pending_vecs)} chunks skipped")
+        finally:
+            pending_vecs.clear()
+            pending_payloads.clear()
+            timings["upsert"] = timings.get("upsert", 0.0) + time.perf_counter() - t0
+
+    def changed():
+        queued = set()
+        for ch in chunks:
+            h = chunk_hash(ch)
+            if h in known:
+                indexed.add(h)
+            elif h not in indexed and h not in queued:
+                queued.add(h)
+                yield ch, h
+
+    for batch in _batches(changed(), EMBED_BATCH):
+        t0 = time.perf_counter()
+        try:
+            with stage("embed", chunks=len(batch)):
+                vecs = cached_embed_texts([ch for ch, _ in batch])
+        except Exception as e:
+            # keep going on individual batch failures
+            _progress(doc_id, "embed_warning", f"{type(e).__name__}: {len(batch)} chunks skipped")
+            continue
+        finally:
+            timings["embed"] = timings.get("embed", 0.0) + time.perf_counter() - t0
+        pending_vecs.extend(vecs)
+        pending_payloads.extend({"text": ch, "chunk_hash": h, **meta} for ch, h in batch)
+        if len(pending_vecs) >= UPSERT_BATCH:
+            flush(UPSERT_WAIT)
+            seen = f"pages={counts['pages']} chunks={counts['chunks']} " if counts else ""
+            _progress(doc_id, "embedding", f"{seen}chunks_indexed={total}")
+
+    flush(True)
+    return total
+
+def _replace_chunk_set(doc_id: str, hashes: Set[str]):
+    key = chunks_key(doc_id)
+    if not hashes:
+        _r.delete(key)
+        return
+    tmp = f"{key}:next"
+    pipe = _r.pipeline()
+    pipe.delete(tmp)
+    for batch in _batches(sorted(hashes), 1000):
+        pipe.sadd(tmp, *batch)
+    pipe.rename(tmp, key)
+    pipe.execute()
+
+def _record_identity(doc_id: str, filename: str, content_hash: str | None, meta: Dict[str, Any]):
+    """
+    Point docs:hash at this document's current content (dropping the old
+    version) and remember its scope (tags, tenant) on doc:{id}.
+    """
+    tenant = meta.get("tenant")
+    fields = {"filename": filename, "tags": json.dumps(meta.get("tags", [])), "tenant": tenant or "",
+              "uploaded_at": str(meta["uploaded_at"])}
+    if not content_hash:
+        _doc_set(doc_id, **fields)
+        return
+    old = _r.hget(doc_key(doc_id), "content_hash")
+    pipe = _r.pipeline()
+    if old and old != content_hash:
+        pipe.hdel(DOC_HASH_KEY, hash_field(old, tenant))
+    pipe.hset(DOC_HASH_KEY, hash_field(content_hash, tenant), doc_id)
+    pipe.hset(doc_key(doc_id), mapping={**fields, "content_hash": content_hash})
+    pipe.execute()
+
+# -------------------- Pipeline steps --------------------
+# shared by process_stream() and the split Celery pipeline (kg_common.pipeline)
+def begin_document(doc_id: str, filename: str, tags: List[str] | None = None,
+                   tenant: str | None = None) -> Tuple[Dict[str, Any], str, Set[str]]:
+    """(payload scope, target collection, chunk hashes already indexed) for a new run."""
+    meta: Dict[str, Any] = {"tags": sorted(set(tags or [])), "uploaded_at": int(time.time())}
+    if tenant:
+        meta["tenant"] = tenant
+    collection = collection_for(tenant)
+    known = set(_r.smembers(chunks_key(doc_id)))
+    if not known and _r.exists(f"doc:{doc_id}:seq"):
+        # ingested under the old counter-based ids: start this document over
+        try:
+            _delete_doc_points(doc_id, collection)
+        except Exception:
+            pass
+        _r.delete(f"doc:{doc_id}:seq")
+    _progress(doc_id, "parsing", filename)
+    return meta, collection, known
 
+def finish_vectors(doc_id: str, known: Set[str], indexed: Set[str], meta: Dict[str, Any], collection: str,
+                   timings: Dict[str, float]) -> Tuple[int, int]:
+    """
+    Delete points of chunks that disappeared, bring reused points' scope up
+    to date and publish the new chunk set. Returns (reused, removed).
+    """
+    t0 = time.perf_counter()
+    stale = known - indexed
+    if stale:
+        _delete_points([point_id(doc_id, h) for h in stale], collection)
+    if known & indexed:
+        # reused points keep their vectors; bring their scope up to date
+        _q().set_payload(collection_name=collection, payload=meta, points=_doc_filter(doc_id), wait=True)
+    _replace_chunk_set(doc_id, indexed)
+    timings["upsert"] = timings.get("upsert", 0.0) + time.perf_counter() - t0
+    return len(known & indexed), len(stale)
+
+def write_document_triples(doc_id: str, candidates: List[str], timings: Dict[str, float]) -> List[Tuple[str, str, str]]:
+    """Extract triples from the candidate chunks and replace the document's named graph."""
+    t0 = time.perf_counter()
+    triples_parsed = extract_document_triples(candidates)
+    timings["triples"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
     try:
+        with stage("kg_insert", triples=len(triples_parsed)):
+            _sparql_insert_triples(triples_parsed, doc_id)
         if triples_parsed:
-            _sparql_insert_triples(triples_parsed)
+            record_triples(triples_parsed)
             _progress(doc_id, "kg_updated", f"triples={len(triples_parsed)}")
         else:
             _progress(doc_id, "kg_skipped", "no triples extracted")
     except Exception as e:
         _progress(doc_id, "kg_skipped", f"error={type(e).__name__}")
+    timings["kg_insert"] = time.perf_counter() - t0
+    return triples_parsed
+
+def finish_document(doc_id: str, filename: str, content_hash: str | None, meta: Dict[str, Any],
+                    timings: Dict[str, float], bump: bool) -> Dict[str, float]:
+    """Record timings and identity, invalidate cached answers; returns the rounded timings."""
+    for k, v in timings.items():
+        INGEST_STAGE_SECONDS.labels(k).observe(v)
+    rounded = {k: round(v, 4) for k, v in timings.items()}
+    _doc_set(doc_id, timings=json.dumps(rounded))
+    _record_identity(doc_id, filename, content_hash, meta)
+    if bump:
+        bump_corpus_version()
+    _progress(doc_id, "done", "ok")
+    return rounded
 
-    # --- embeddings ---
-    total = 0
-    for ch in chunks:
-        try:
-            vec = embed(ch)
-            # embed() must return flat list[float] or [[...]]
-            if isinstance(vec, list) and vec and isinstance(vec[0], list):
-                vec = vec[0]
-            if not isinstance(vec, list) or (vec and not isinstance(vec[0], (float, int))):
-                raise TypeError("Embedding must be a flat list[float]")
-            upsert_vector(doc_id, vec, payload={"text": ch})
-            total += 1
-        except Exception as e:
-            # keep going on individual chunk failures
-            _progress(doc_id, "embed_warning", f"{type(e).__name__}: chunk_skipped")
+def process_stream(filename: str, fp: BinaryIO, doc_id: str, content_hash: str | None = None,
+                   tags: List[str] | None = None, tenant: str | None = None):
+    """
+    Ingest pipeline over a binary stream, in this process:
+      1) parse page by page -> sliding-window chunks (generator)
+      2) embed chunks not indexed for this doc_id yet, in batches as they
+         arrive -> bulk upserts to Qdrant; points of chunks that disappeared
+         are deleted afterwards
+      3) if anything changed, extract triples from the densest chunks seen,
+         in parallel (LLM, cached per chunk; fallback to rules) -> the
+         document's named graph, replaced as a whole
+    Only one page, one chunk window, the pending embed/upsert batches, chunk
+    hashes and the bounded triple candidate pool are held in memory. Writes
+    progress (pages, chunks) and per-phase timings (seconds) to Redis at
+    'doc:{doc_id}'. Points carry tags, tenant and uploaded_at for filtered
+    search and go to the tenant's collection when those are enabled.
+    The worker runs the same steps as separate Celery tasks (kg_common.pipeline).
+    """
+    timings: Dict[str, float] = {}
+    counts = {"pages": 0, "chunks": 0}
+    candidates = TripleCandidates()
+    meta, collection, known = begin_document(doc_id, filename, tags, tenant)
+    indexed: Set[str] = set()
+
+    def tapped():
+        for chunk in _stream_chunks(doc_id, filename, fp, timings, counts):
+            candidates.add(chunk)
+            yield chunk
+
+    # --- embeddings (start on the first page) ---
+    total = _embed_and_upsert(doc_id, tapped(), timings, counts, known=known, indexed=indexed,
+                              collection=collection, meta=meta)
+    if not counts["chunks"]:
+        _progress(doc_id, "failed", "Empty or unreadable text")
+        raise ValueError("Empty or unreadable text")
 
-    _progress(doc_id, "vectordb_updated", f"chunks_indexed={total}")
-    _progress(doc_id, "done", "ok")
-    return {"doc_id": doc_id, "triples": len(triples_parsed), "chunks": total}
+    reused, removed = finish_vectors(doc_id, known, indexed, meta, collection, timings)
+    _progress(
+        doc_id, "vectordb_updated",
+        f"pages={counts['pages']} chunks={counts['chunks']} chunks_indexed={total} reused={reused} removed={removed}",
+    )
+
+    # --- triples (densest chunks within the per-document token budget) ---
+    triples_parsed: List[Tuple[str, str, str]] = []
+    changed = bool(total or removed)
+    if changed:
+        triples_parsed = write_document_triples(doc_id, candidates.chunks(), timings)
+    else:
+        _progress(doc_id, "kg_skipped", "unchanged")
+
+    # reused points may have new tags/uploaded_at: filtered answers can change
+    timings = finish_document(doc_id, filename, content_hash, meta, timings, bump=changed or bool(reused))
+    return {
+        "doc_id": doc_id,
+        "pages": counts["pages"],
+        "triples": len(triples_parsed),
+        "chunks": total,
+        "reused": reused,
+        "removed": removed,
+        "timings": timings,
+    }
+
+def source_filename(path: str, doc_id: str) -> str:
+    # uploads are stored as "{doc_id}__{original name}"
+    filename = os.path.basename(path)
+    prefix = f"{doc_id}__"
+    return filename[len(prefix):] if filename.startswith(prefix) else filename
+
+def process_file(path: str, doc_id: str, filename: str | None = None, content_hash: str | None = None,
+                 tags: List[str] | None = None, tenant: str | None = None):
+    """Stream a file from disk through the pipeline in this process."""
+    filename = filename or source_filename(path, doc_id)
+    with open(path, "rb") as fp:
+        return process_stream(filename, fp, doc_id, content_hash=content_hash, tags=tags, tenant=tenant)
+
+def process_document(filename: str, data: bytes, doc_id: str, content_hash: str | None = None,
+                     tags: List[str] | None = None, tenant: str | None = None):
+    """In-memory variant of process_stream for callers that already hold the bytes."""
+    return process_stream(filename, io.BytesIO(data), doc_id, content_hash=content_hash, tags=tags, tenant=tenant)
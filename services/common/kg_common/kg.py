@@ -1,11 +1,26 @@
-from rdflib import Graph, Namespace, URIRef, Literal
-from rdflib.namespace import RDF
-from .sparql import run_update
+import re
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
 
-SCHEMA = Namespace("http://kg.local/schema#")
-DATA = Namespace("http://kg.local/data/")
+from .config import SPARQL_DATA_URL, KG_WRITE_BATCH, KG_GRAPH_BASE
+from .clients import fuseki_session, timed
+from .metrics import KG_TRIPLES_WRITTEN, KG_WRITE_SECONDS, KG_WRITE_TPS
+
+if TYPE_CHECKING:
+    from rdflib import Graph
+
+SCHEMA = "http://kg.local/schema#"
+DATA = "http://kg.local/data/"
+EX = "http://example.org/"
+
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+XSD_DECIMAL = "http://www.w3.org/2001/XMLSchema#decimal"
+
+def triples_to_graph(triples, doc_id: str) -> "Graph":
+    # rdflib is only needed for this Turtle export; ingest and queries write N-Triples text
+    from rdflib import Graph, Literal, URIRef
+    from rdflib.namespace import RDF
 
-def triples_to_turtle(triples, doc_id: str):
     g = Graph()
     g.bind("schema", SCHEMA)
     g.bind("data", DATA)
@@ -21,8 +36,11 @@ def triples_to_turtle(triples, doc_id: str):
             g.add((s, p, Literal(o_val)))
     for t in triples:
         s = URIRef(DATA + slugify(t["s"]))
-        g.add((s, RDF.type, SCHEMA.Entity))
-    return g.serialize(format="turtle").decode("utf-8")
+        g.add((s, RDF.type, URIRef(SCHEMA + "Entity")))
+    return g
+
+def triples_to_turtle(triples, doc_id: str):
+    return triples_to_graph(triples, doc_id).serialize(format="turtle")
 
 def looks_entity(x: str) -> bool:
     return any(c.isspace() for c in x) or (len(x)>0 and x[0].isupper())
@@ -30,11 +48,107 @@ def looks_entity(x: str) -> bool:
 def slugify(x: str) -> str:
     return "".join(ch.lower() if ch.isalnum() else "_" for ch in x).strip("_")
 
-def upsert_triples(triples, doc_id: str):
-    ttl = triples_to_turtle(triples, doc_id)
-    update = f"""
-    INSERT DATA {{
-{ttl}
-    }}
+# -------------------- N-Triples terms (ingest scheme) --------------------
+def entity_uri(x: str) -> str:
+    slug = re.sub(r"[^a-zA-Z0-9]+", "_", x).strip("_") or "x"
+    return f"<{EX}{slug}>"
+
+def _nt_escape(x: str) -> str:
+    return (
+        x.replace("\\", "\\\\").replace('"', '\\"')
+        .replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+    )
+
+def object_term(x: str) -> str:
+    if re.fullmatch(r"-?\d+", x):
+        return f'"{x}"^^<{XSD_INTEGER}>'
+    if re.fullmatch(r"-?\d+\.\d+", x):
+        return f'"{x}"^^<{XSD_DECIMAL}>'
+    if re.fullmatch(r"https?://[^\s<>\"{}|\\^`]+", x):
+        return f"<{x}>"
+    return f'"{_nt_escape(x)}"'
+
+def ntriple(s: str, p: str, o: str) -> str:
+    return f"{entity_uri(s)} {entity_uri(p)} {object_term(o)} ."
+
+def doc_graph(doc_id: str) -> str:
+    return f"{KG_GRAPH_BASE}{doc_id}"
+
+# -------------------- Writer --------------------
+def _batched(lines: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for ln in lines:
+        batch.append(ln)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class KGWriter:
+    """
+    The one path for writing triples to Fuseki: N-Triples posted to the Graph
+    Store Protocol endpoint in bounded batches over a pooled session.
+    `graph=None` targets the default graph.
     """
-    return run_update(update)
+
+    def __init__(self, data_url: str = SPARQL_DATA_URL, batch_size: int = KG_WRITE_BATCH, timeout: float = 60):
+        self.data_url = data_url
+        self.batch_size = max(int(batch_size), 1)
+        self.timeout = timeout
+
+    def _params(self, graph: Optional[str]):
+        return {"graph": graph} if graph else {"default": ""}
+
+    def write(self, lines: Iterable[str], graph: Optional[str] = None, replace: bool = False) -> int:
+        """
+        Append N-Triples lines; returns the number written. With replace=True
+        the first batch is a PUT, so the graph ends up holding exactly `lines`.
+        """
+        total = 0
+        t_start = time.perf_counter()
+        for batch in _batched(lines, self.batch_size):
+            t0 = time.perf_counter()
+            method = "put" if replace and not total else "post"
+            with timed("fuseki", f"gsp_{method}"):
+                r = fuseki_session().request(
+                    method.upper(),
+                    self.data_url,
+                    params=self._params(graph),
+                    data=("\n".join(batch) + "\n").encode("utf-8"),
+                    headers={"Content-Type": "application/n-triples; charset=utf-8"},
+                    timeout=self.timeout,
+                )
+            r.raise_for_status()
+            KG_WRITE_SECONDS.observe(time.perf_counter() - t0)
+            KG_TRIPLES_WRITTEN.inc(len(batch))
+            total += len(batch)
+        if replace and not total and graph:
+            self.drop(graph)
+        elapsed = time.perf_counter() - t_start
+        if total and elapsed > 0:
+            KG_WRITE_TPS.set(total / elapsed)
+        return total
+
+    def drop(self, graph: str):
+        """Remove a named graph entirely (404 = already gone)."""
+        with timed("fuseki", "gsp_delete"):
+            r = fuseki_session().delete(self.data_url, params={"graph": graph}, timeout=self.timeout)
+        if r.status_code != 404:
+            r.raise_for_status()
+
+_writer = KGWriter()
+
+def get_writer() -> KGWriter:
+    return _writer
+
+def write_triples(triples: Iterable[Tuple[str, str, str]], doc_id: Optional[str] = None,
+                  replace: bool = False) -> int:
+    """(subject, predicate, object) strings -> the document's named graph."""
+    lines = (ntriple(s, p, o) for s, p, o in triples)
+    return _writer.write(lines, graph=doc_graph(doc_id) if doc_id else None, replace=replace)
+
+def upsert_triples(triples, doc_id: str):
+    g = triples_to_graph(triples, doc_id)
+    lines = (ln for ln in g.serialize(format="nt").splitlines() if ln.strip())
+    return _writer.write(lines, graph=doc_graph(doc_id) if doc_id else None)
@@ -1,28 +1,51 @@
 # services/common/kg_common/llm.py
+from __future__ import annotations
+
 import os
-from typing import Any, Dict, List
-from llama_cpp import Llama, LlamaGrammar  # noqa: F401  (grammar not used, but kept for future)
+import json
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
 import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .embeddings import embed_text, embed_texts
+from .config import LLM_SLOTS, KV_PREFIX_CACHE, KV_CACHE_BYTES, KV_PREFIX_MIN_TOKENS
+from .metrics import KV_PREFIX_LOOKUPS, PREFILL_TOKENS_SAVED, KV_CACHE_BYTES_USED
+from .tracing import observe_llm
+from .scheduler import DeadlineExceeded, get_scheduler, deadline_in
+
+if TYPE_CHECKING:  # llama_cpp is imported on first local use; server mode never loads it
+    from llama_cpp import Llama, StoppingCriteriaList
+    from llama_cpp.llama import LlamaState
 
 # Env-tunable, with conservative CPU defaults
 MODEL_PATH = os.getenv("MODEL_PATH", "/models/qwen2.5-1.5b-instruct-q4_k_m.gguf")
 N_CTX      = int(os.getenv("N_CTX", "2048"))
 N_THREADS  = int(os.getenv("N_THREADS", "4"))
 N_BATCH    = int(os.getenv("N_BATCH", "24"))   # keep small on CPU
-CHAT_FMT   = os.getenv("CHAT_FORMAT", "qwen")  # llama_cpp chat handler name
+CHAT_FMT   = os.getenv("CHAT_FORMAT", "chatml")  # llama_cpp chat format name (Qwen2.x uses ChatML)
+
+# Inference server mode: when set, complete()/complete_stream() are thin clients of a
+# llama.cpp server (`llama-server -np N -cb`) that owns the only model copy on the
+# host and batches concurrent sequences into shared decode steps.
+LLM_SERVER_URL = os.getenv("LLM_SERVER_URL", "").rstrip("/")
 
 _llm_lock = threading.Lock()
-_llm: Llama | None = None
+_llms: Dict[int, Llama] = {}   # one context per scheduler slot; weights are shared via mmap
 
-def _get_llm() -> Llama:
-    global _llm
-    if _llm is not None:
-        return _llm
+def _get_llm(slot: int = 0) -> Llama:
+    llm = _llms.get(slot)
+    if llm is not None:
+        return llm
     if not os.path.isfile(MODEL_PATH):
         raise ValueError(f"Model not found: {MODEL_PATH}")
     with _llm_lock:
-        if _llm is None:
-            _llm = Llama(
+        if slot not in _llms:
+            from llama_cpp import Llama
+            _llms[slot] = Llama(
                 model_path=MODEL_PATH,
                 n_ctx=N_CTX,
                 n_threads=N_THREADS,
@@ -33,50 +56,325 @@ def _get_llm() -> Llama:
                 chat_format=CHAT_FMT,
                 verbose=False,
             )
-    return _llm
+    return _llms[slot]
 
-def complete(system: str, user: str, max_tokens: int = 128, temperature: float = 0.2) -> str:
-    """
-    Chat-style completion using llama.cpp chat handlers.
-    """
-    llm = _get_llm()
-    messages = [
+def _messages(system: str, user: str) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": system},
         {"role": "user",   "content": user},
     ]
-    # Create a single, non-streaming chat completion
-    res: Dict[str, Any] = llm.create_chat_completion(
-        messages=messages,
+
+def _deadline_stop(deadline: float) -> StoppingCriteriaList:
+    # lets llama.cpp end generation early instead of overrunning the request deadline
+    from llama_cpp import StoppingCriteriaList
+    return StoppingCriteriaList([lambda _ids, _logits: time.monotonic() >= deadline])
+
+# -------------------- Prompt-prefix KV cache --------------------
+class PrefixKVCache:
+    """
+    Evaluated llama.cpp state of fixed prompt prefixes (chat template + system
+    prompt), keyed by their tokens and LRU-evicted by size. Every slot has its
+    own context, but a state saved from one can be loaded into any other.
+    """
+
+    def __init__(self, capacity_bytes: int = KV_CACHE_BYTES):
+        self.capacity = capacity_bytes
+        self._items: "OrderedDict[tuple, LlamaState]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(state: LlamaState) -> int:
+        return int(state.llama_state_size) + state.scores.nbytes + state.input_ids.nbytes
+
+    def get(self, key: tuple) -> Optional[LlamaState]:
+        with self._lock:
+            state = self._items.get(key)
+            if state is not None:
+                self._items.move_to_end(key)
+            return state
+
+    def put(self, key: tuple, state: LlamaState):
+        size = self._size(state)
+        if size > self.capacity:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._items[key] = state
+            self._bytes += size
+            while self._bytes > self.capacity and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= self._size(evicted)
+            KV_CACHE_BYTES_USED.set(self._bytes)
+
+_kv_cache = PrefixKVCache()
+_prefix_ids: Dict[str, List[int]] = {}
+_SENTINEL = "\x00kg-user\x00"
+
+def _formatter():
+    # register_chat_format() returns the plain formatter as format_<name>
+    from llama_cpp import llama_chat_format
+    return getattr(llama_chat_format, "format_" + CHAT_FMT.replace("-", "_"), None)
+
+def _prompt_tokens(llm: Llama, system: str, user: str):
+    """(prompt tokens, stop, prefix tokens) for the chat format, or None if it is unknown."""
+    fmt = _formatter()
+    if fmt is None:
+        return None
+    res = fmt(messages=_messages(system, user))
+    add_bos = not getattr(res, "added_special", False)
+    tokens = llm.tokenize(res.prompt.encode("utf-8"), add_bos=add_bos, special=True)
+    prefix = _prefix_ids.get(system)
+    if prefix is None:
+        head = fmt(messages=_messages(system, _SENTINEL)).prompt.split(_SENTINEL, 1)[0]
+        prefix = _prefix_ids[system] = llm.tokenize(head.encode("utf-8"), add_bos=add_bos, special=True)
+    return tokens, res.stop, prefix
+
+def _restore_prefix(llm: Llama, tokens: List[int], prefix: List[int]):
+    """
+    Make the context hold the evaluated prefix before generate() runs; its own
+    prefix match then only evaluates the tokens after it.
+    """
+    from llama_cpp import Llama
+    from llama_cpp.llama import LlamaState
+
+    n = Llama.longest_token_prefix(prefix, tokens[:-1])
+    if n < KV_PREFIX_MIN_TOKENS:
+        return
+    key = tuple(tokens[:n])
+    if Llama.longest_token_prefix(llm._input_ids.tolist(), key) >= n:
+        KV_PREFIX_LOOKUPS.labels("resident").inc()
+        PREFILL_TOKENS_SAVED.labels("local").inc(n)
+        return
+    state = _kv_cache.get(key)
+    if state is not None:
+        llm.load_state(state)
+        KV_PREFIX_LOOKUPS.labels("restored").inc()
+        PREFILL_TOKENS_SAVED.labels("local").inc(n)
+        return
+    KV_PREFIX_LOOKUPS.labels("miss").inc()
+    llm.reset()
+    llm.eval(list(key))
+    full = llm.save_state()
+    # generation evaluates at least one more token, so only the last logits row is kept
+    # (load_state broadcasts it over the prefix rows)
+    _kv_cache.put(key, LlamaState(
+        input_ids=full.input_ids,
+        scores=full.scores[-1:].copy(),
+        n_tokens=full.n_tokens,
+        llama_state=full.llama_state,
+        llama_state_size=full.llama_state_size,
+    ))
+
+def _perf_reset(llm: Llama):
+    try:
+        import llama_cpp
+        llama_cpp.llama_reset_timings(llm._ctx.ctx)
+    except Exception:
+        pass
+
+def _perf_observe(llm: Llama):
+    """Prefill/decode tokens/s from llama.cpp's own counters (prefix restore included)."""
+    try:
+        import llama_cpp
+        t = llama_cpp.llama_get_timings(llm._ctx.ctx)
+        observe_llm(t.n_p_eval, t.t_p_eval_ms / 1000.0, t.n_eval, t.t_eval_ms / 1000.0)
+    except Exception:
+        pass
+
+def _local_generate(llm: Llama, system: str, user: str, max_tokens: int, temperature: float,
+                    deadline: float, stream: bool):
+    """
+    create_completion() over pre-tokenized chat prompts with the system prefix
+    restored from the KV cache; falls back to create_chat_completion() when
+    the chat format has no plain formatter. Returns (result, is_chat).
+    """
+    prepared = _prompt_tokens(llm, system, user) if KV_PREFIX_CACHE else None
+    kwargs = dict(
         temperature=float(temperature),
         max_tokens=int(max_tokens),
         top_p=0.95,
         repeat_penalty=1.05,
+        stopping_criteria=_deadline_stop(deadline),
+        stream=stream,
     )
+    if prepared is None:
+        return llm.create_chat_completion(messages=_messages(system, user), **kwargs), True
+    tokens, stop, prefix = prepared
+    _restore_prefix(llm, tokens, prefix)
+    return llm.create_completion(prompt=tokens, stop=stop, **kwargs), False
+
+# -------------------- Server mode --------------------
+_session: requests.Session | None = None
+
+def _server() -> requests.Session:
+    global _session
+    if _session is None:
+        sess = requests.Session()
+        sess.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max(LLM_SLOTS * 2, 4)))
+        _session = sess
+    return _session
+
+def _server_body(system: str, user: str, max_tokens: int, temperature: float, stream: bool) -> Dict[str, Any]:
+    return {
+        "messages": _messages(system, user),
+        "temperature": float(temperature),
+        "max_tokens": int(max_tokens),
+        "top_p": 0.95,
+        "repeat_penalty": 1.05,
+        "stream": stream,
+        "cache_prompt": True,   # reuse the server slot's KV for a shared prefix
+    }
+
+def _server_saved(res: Dict[str, Any]):
+    # recent llama.cpp servers report prompt tokens served from the slot's KV as timings.cache_n,
+    # and prefill/decode counts and durations next to it
+    timings = res.get("timings") or {}
+    cached = timings.get("cache_n")
+    if cached:
+        PREFILL_TOKENS_SAVED.labels("server").inc(int(cached))
+    if "predicted_ms" in timings:
+        observe_llm(int(timings.get("prompt_n") or 0), float(timings.get("prompt_ms") or 0) / 1000.0,
+                    int(timings.get("predicted_n") or 0), float(timings["predicted_ms"] or 0) / 1000.0)
+
+def _deadline_exceeded() -> DeadlineExceeded:
+    # same error (and so the same 503 + Retry-After) as a deadline hit while queued for a slot
+    return DeadlineExceeded("deadline exceeded before the inference server answered", get_scheduler().retry_after())
+
+def _remaining(deadline: float) -> float:
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise _deadline_exceeded()
+    return left
+
+def _server_complete(system: str, user: str, max_tokens: int, temperature: float, deadline: float) -> str:
+    try:
+        r = _server().post(
+            f"{LLM_SERVER_URL}/v1/chat/completions",
+            json=_server_body(system, user, max_tokens, temperature, stream=False),
+            timeout=(3, _remaining(deadline)),
+        )
+    except requests.Timeout:
+        raise _deadline_exceeded() from None
+    r.raise_for_status()
+    res = r.json()
+    _server_saved(res)
     try:
         return res["choices"][0]["message"]["content"].strip()
     except Exception:
         return str(res)
 
-def embed(text: str) -> List[float]:
+def _server_stream(system: str, user: str, max_tokens: int, temperature: float, deadline: float,
+                   status: Dict[str, Any]) -> Iterator[str]:
+    try:
+        r = _server().post(
+            f"{LLM_SERVER_URL}/v1/chat/completions",
+            json=_server_body(system, user, max_tokens, temperature, stream=True),
+            timeout=(3, _remaining(deadline)),
+            stream=True,
+        )
+    except requests.Timeout:
+        raise _deadline_exceeded() from None
+    with r:
+        r.raise_for_status()
+        yielded = False
+        lines = r.iter_lines(decode_unicode=True)
+        while True:
+            try:
+                line = next(lines, None)
+            except (requests.Timeout, requests.ConnectionError):
+                # requests reports a read timeout mid-body as ConnectionError
+                if time.monotonic() < deadline:
+                    raise
+                if not yielded:
+                    raise _deadline_exceeded() from None
+                # keep what was streamed, like the deadline check below
+                status["partial"] = True
+                break
+            if line is None:
+                break
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                obj = json.loads(data)
+                _server_saved(obj)
+                piece = obj["choices"][0]["delta"].get("content")
+            except Exception:
+                piece = None
+            if piece:
+                yielded = True
+                yield piece
+            if time.monotonic() >= deadline:
+                # closing the response makes the server drop the sequence
+                status["partial"] = True
+                break
+
+# -------------------- Public API --------------------
+def complete(system: str, user: str, max_tokens: int = 128, temperature: float = 0.2,
+             deadline: Optional[float] = None, status: Optional[Dict[str, Any]] = None) -> str:
     """
-    Cheap embedding: reuse the LLM logits over a short prompt to produce a vector.
-    For production, swap in a real text-embedding model and return list[float].
+    Chat-style completion (chat format applied locally, system prefix restored
+    from the KV cache). Runs inside a scheduler slot; `deadline` is a
+    time.monotonic() value. If `status` is given, status["partial"] is set to
+    whether the deadline cut the generation short.
     """
-    # Minimal, fast, CPU-friendly trick embedding:
-    # feed a short prefix and use final_state embedding if available
-    # Fallback to a deterministic vector based on bytes.
+    status = status if status is not None else {}
+    status["partial"] = False
+    deadline = deadline if deadline is not None else deadline_in()
+    with get_scheduler().slot(deadline) as slot:
+        if LLM_SERVER_URL:
+            return _server_complete(system, user, max_tokens, temperature, deadline)
+        llm = _get_llm(slot)
+        _perf_reset(llm)
+        # Create a single, non-streaming completion
+        res, is_chat = _local_generate(llm, system, user, max_tokens, temperature, deadline, stream=False)
+        _perf_observe(llm)
+        status["partial"] = time.monotonic() >= deadline
     try:
-        llm = _get_llm()
-        out = llm.embed(text[:1000])  # llama.cpp provides .embed() in newer versions
-        if isinstance(out, list) and out and isinstance(out[0], (float, int)):
-            return [float(x) for x in out]
+        choice = res["choices"][0]
+        return (choice["message"]["content"] if is_chat else choice["text"]).strip()
     except Exception:
-        pass
-    # Fallback dummy embedding (still works with Qdrant end-to-end)
-    import math
-    h = [0.0] * 256
-    for i, b in enumerate(text.encode("utf-8", errors="ignore")):
-        h[i % 256] += (b / 255.0)
-    # l2 normalize
-    n = math.sqrt(sum(x * x for x in h)) or 1.0
-    return [x / n for x in h]
+        return str(res)
+
+def complete_stream(system: str, user: str, max_tokens: int = 128, temperature: float = 0.2,
+                    deadline: Optional[float] = None, status: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """
+    Streaming variant of complete(): yields content pieces as llama.cpp decodes them.
+    The scheduler slot is held until the generator is exhausted or closed;
+    `status` is filled in as in complete() once the generator is exhausted.
+    """
+    status = status if status is not None else {}
+    status["partial"] = False
+    deadline = deadline if deadline is not None else deadline_in()
+    with get_scheduler().slot(deadline) as slot:
+        if LLM_SERVER_URL:
+            yield from _server_stream(system, user, max_tokens, temperature, deadline, status)
+            return
+        llm = _get_llm(slot)
+        _perf_reset(llm)
+        chunks, is_chat = _local_generate(llm, system, user, max_tokens, temperature, deadline, stream=True)
+        for chunk in chunks:
+            try:
+                choice = chunk["choices"][0]
+                piece = choice["delta"].get("content") if is_chat else choice["text"]
+            except Exception:
+                piece = None
+            if piece:
+                yield piece
+        _perf_observe(llm)
+        status["partial"] = time.monotonic() >= deadline
+
+def embed(text: str) -> List[float]:
+    """
+    Embeddings no longer come from the chat model; see kg_common.embeddings.
+    Kept so older callers keep working.
+    """
+    return embed_text(text)
+
+def embed_batch(texts: List[str]) -> List[List[float]]:
+    return embed_texts(texts)
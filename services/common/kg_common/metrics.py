@@ -0,0 +1,98 @@
+# services/common/kg_common/metrics.py
+"""
+Prometheus metrics shared by api and worker.
+
+Everything registers on the default registry, so the api's /api/metrics and
+the worker's :9808 server pick these up without extra wiring.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+EMBED_FALLBACKS = Counter(
+    "kg_embed_fallback_total",
+    "Embedding requests served by the hash fallback instead of the configured engine",
+    ["backend", "reason"],
+)
+
+EMBED_CACHE_HITS = Counter("kg_embed_cache_hits_total", "Embedding cache hits", ["backend"])
+EMBED_CACHE_MISSES = Counter("kg_embed_cache_misses_total", "Embedding cache misses", ["backend"])
+
+ANSWER_CACHE_LOOKUPS = Counter(
+    "kg_answer_cache_lookups_total",
+    "Answer cache lookups by outcome",
+    ["result"],  # exact_hit | semantic_hit | miss
+)
+
+ASK_TTFT = Histogram(
+    "kg_ask_time_to_first_token_seconds",
+    "Time from receiving a question to the first answer token",
+    ["mode"],  # stream | blocking
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+
+LLM_QUEUE_DEPTH = Gauge("kg_llm_queue_depth", "Requests waiting for a model slot")
+LLM_SLOTS_BUSY = Gauge("kg_llm_slots_busy", "Model slots currently generating")
+LLM_QUEUE_WAIT = Histogram(
+    "kg_llm_queue_wait_seconds",
+    "Time spent waiting for a model slot",
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+LLM_REJECTED = Counter("kg_llm_rejected_total", "Requests turned away by the scheduler", ["reason"])  # queue_full | deadline
+
+KG_TRIPLES_WRITTEN = Counter("kg_triples_written_total", "Triples written to Fuseki")
+KG_WRITE_SECONDS = Histogram(
+    "kg_write_batch_seconds",
+    "Duration of one Graph Store write batch",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+KG_WRITE_TPS = Gauge("kg_write_triples_per_second", "Throughput of the most recent KG write")
+
+BACKEND_LATENCY = Histogram(
+    "kg_backend_request_seconds",
+    "Latency of calls to backing services",
+    ["backend", "op"],  # backend: fuseki | qdrant
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+KV_PREFIX_LOOKUPS = Counter(
+    "kg_llm_prefix_cache_total",
+    "Prompt-prefix KV lookups before generation",
+    ["result"],  # resident | restored | miss
+)
+PREFILL_TOKENS_SAVED = Counter(
+    "kg_llm_prefill_tokens_saved_total",
+    "Prompt tokens not re-evaluated thanks to a cached KV prefix",
+    ["mode"],  # local | server
+)
+KV_CACHE_BYTES_USED = Gauge("kg_llm_prefix_cache_bytes", "Memory held by saved prompt-prefix KV states")
+
+RERANK_KEPT = Histogram(
+    "kg_rerank_kept_contexts",
+    "Chunks kept after reranking (before prompt packing)",
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+
+STAGE_SECONDS = Histogram(
+    "kg_stage_seconds",
+    "Duration of one pipeline operation",
+    # ingest: embed | upsert (per batch), triple_llm (per chunk), kg_insert (per document)
+    # ask:    query_embed | search | kg_lookup | rerank | prompt_build | generate
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "kg_ingest_stage_seconds",
+    "Time one document spent in each ingest stage",
+    ["stage"],  # parse | chunk | embed | upsert | triples | kg_insert
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "kg_llm_tokens_per_second",
+    "Model throughput per generation",
+    ["phase"],  # prefill | decode
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000),
+)
+WARMUP_SECONDS = Gauge(
+    "kg_warmup_seconds",
+    "Time this process took to load and warm each model at startup",
+    ["component"],  # tokenizer | embedder | llm | reranker
+)
@@ -0,0 +1,240 @@
+# services/common/kg_common/pipeline.py
+"""
+Ingest split into short Celery tasks, so a large document is spread over the
+worker fleet instead of pinning one worker for its whole run:
+
+  parse     stream pages -> chunks; chunks not indexed yet are stored in
+            Redis batches of INGEST_SPLIT_CHUNKS and handed to `on_batch`
+            as soon as each is full
+  embed     one batch: embed + upsert (any worker, in parallel)
+  finalize  after the last batch: drop stale points, publish the chunk set
+            (the document is searchable from here on)
+  triples   LLM extraction over the parse stage's candidate chunks -> KG
+
+The steps are the ones process_stream() runs in-process (kg_common.ingest).
+Run state lives under ingest:{run}* with a TTL, so an abandoned run expires.
+Each step returns whether the next one is due; queuing it is up to the
+caller (the worker), which keeps Celery out of kg_common.
+"""
+import json
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .answer_cache import bump_corpus_version
+from .config import REDIS_URL, INGEST_SPLIT_CHUNKS
+from .documents import chunk_hash, chunks_key
+from .ingest import (
+    TripleCandidates, _embed_and_upsert, _progress, _stream_chunks, begin_document, finish_document,
+    finish_vectors, source_filename, write_document_triples,
+)
+
+RUN_TTL = 24 * 3600
+
+_r = None
+
+
+def _redis():
+    global _r
+    if _r is None:
+        import redis
+        _r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _r
+
+
+def _key(run: str, part: str = "") -> str:
+    return f"ingest:{run}:{part}" if part else f"ingest:{run}"
+
+
+def _state(run: str) -> Dict[str, str]:
+    st = _redis().hgetall(_key(run))
+    if not st:
+        raise KeyError(f"ingest run {run} expired or unknown")
+    return st
+
+
+def _timings(st: Dict[str, str]) -> Dict[str, float]:
+    return {k[2:]: float(v) for k, v in st.items() if k.startswith("t_")}
+
+
+def _add_timings(run: str, timings: Dict[str, float]):
+    pipe = _redis().pipeline()
+    for k, v in timings.items():
+        pipe.hincrbyfloat(_key(run), f"t_{k}", v)
+    pipe.execute()
+
+
+def _cleanup(run: str):
+    r = _redis()
+    keys = [_key(run), _key(run, "indexed"), _key(run, "done"), _key(run, "cand"), _key(run, "final")]
+    keys += list(r.scan_iter(_key(run, "b:*"), count=1000))
+    r.delete(*keys)
+
+
+def fail(run: str, error: str):
+    """A task of the run gave up: mark the document failed and drop the run."""
+    doc_id = _redis().hget(_key(run), "doc_id")
+    if doc_id:
+        _progress(doc_id, "failed", error)
+    _cleanup(run)
+
+
+def fail_document(doc_id: str, error: str):
+    _progress(doc_id, "failed", error)
+
+
+def priority(run: str, default: int = 0) -> int:
+    return int(_redis().hget(_key(run), "priority") or default)
+
+
+def _ready(run: str) -> bool:
+    """True exactly once: when parsing is over and every batch is done."""
+    r = _redis()
+    st = r.hmget(_key(run), "parsed", "batches")
+    if st[0] != "1" or r.scard(_key(run, "done")) < int(st[1] or 0):
+        return False
+    return bool(r.set(_key(run, "final"), "1", nx=True, ex=RUN_TTL))
+
+
+# -------------------- Stages --------------------
+def parse(path: str, doc_id: str, content_hash: Optional[str] = None, tags: Optional[List[str]] = None,
+          tenant: Optional[str] = None, on_batch: Callable[[str, int], None] = lambda run, n: None,
+          prio: int = 0) -> Tuple[str, bool]:
+    """Chunk the file into embed batches; returns (run id, finalize due now)."""
+    r = _redis()
+    run = uuid.uuid4().hex
+    filename = source_filename(path, doc_id)
+    meta, collection, known = begin_document(doc_id, filename, tags, tenant)
+    r.hset(_key(run), mapping={
+        "doc_id": doc_id, "filename": filename, "content_hash": content_hash or "",
+        "meta": json.dumps(meta), "collection": collection, "priority": prio,
+    })
+    r.expire(_key(run), RUN_TTL)
+
+    timings: Dict[str, float] = {}
+    counts = {"pages": 0, "chunks": 0}
+    candidates = TripleCandidates()
+    reused: Set[str] = set()
+    queued: Set[str] = set()
+    batch: List[str] = []
+    n = 0
+
+    def flush():
+        nonlocal n
+        key = _key(run, f"b:{n}")
+        pipe = r.pipeline()
+        pipe.rpush(key, *batch)
+        pipe.expire(key, RUN_TTL)
+        pipe.execute()
+        on_batch(run, n)
+        n += 1
+        batch.clear()
+
+    with open(path, "rb") as fp:
+        for chunk in _stream_chunks(doc_id, filename, fp, timings, counts):
+            candidates.add(chunk)
+            h = chunk_hash(chunk)
+            if h in known:
+                reused.add(h)
+            elif h not in queued:
+                queued.add(h)
+                batch.append(chunk)
+                if len(batch) >= INGEST_SPLIT_CHUNKS:
+                    flush()
+    if batch:
+        flush()
+
+    if not counts["chunks"]:
+        _progress(doc_id, "failed", "Empty or unreadable text")
+        _cleanup(run)
+        raise ValueError("Empty or unreadable text")
+
+    # the run id is fresh, so these keys only hold what embed tasks already added
+    pipe = r.pipeline()
+    if reused:
+        pipe.sadd(_key(run, "indexed"), *reused)
+    cands = candidates.chunks()
+    if cands:
+        pipe.rpush(_key(run, "cand"), *cands)
+    for part in ("indexed", "cand"):
+        pipe.expire(_key(run, part), RUN_TTL)
+    pipe.hset(_key(run), mapping={"pages": counts["pages"], "chunks": counts["chunks"], "batches": n})
+    pipe.execute()
+    _add_timings(run, timings)
+    _progress(doc_id, "embedding", f"pages={counts['pages']} chunks={counts['chunks']} batches={n}")
+    # flag last: embed tasks may already be finishing
+    r.hset(_key(run), "parsed", "1")
+    return run, _ready(run)
+
+
+def embed(run: str, n: int) -> bool:
+    """Embed and upsert batch n; returns True if this finished the run's last batch."""
+    r = _redis()
+    st = _state(run)
+    chunks = r.lrange(_key(run, f"b:{n}"), 0, -1)
+    timings: Dict[str, float] = {}
+    indexed: Set[str] = set()
+    total = _embed_and_upsert(st["doc_id"], chunks, timings, indexed=indexed,
+                              collection=st["collection"], meta=json.loads(st["meta"]))
+    pipe = r.pipeline()
+    if indexed:
+        pipe.sadd(_key(run, "indexed"), *indexed)
+    pipe.hincrby(_key(run), "embedded", total)
+    pipe.delete(_key(run, f"b:{n}"))
+    pipe.sadd(_key(run, "done"), n)
+    pipe.expire(_key(run, "done"), RUN_TTL)
+    pipe.execute()
+    _add_timings(run, timings)
+    return _ready(run)
+
+
+def finalize(run: str) -> bool:
+    """Publish the vectors; returns True if triples need to be extracted."""
+    r = _redis()
+    st = _state(run)
+    doc_id = st["doc_id"]
+    meta = json.loads(st["meta"])
+    timings = _timings(st)
+    known = set(r.smembers(chunks_key(doc_id)))
+    indexed = set(r.smembers(_key(run, "indexed")))
+    reused, removed = finish_vectors(doc_id, known, indexed, meta, st["collection"], timings)
+    embedded = int(st.get("embedded") or 0)
+    _progress(
+        doc_id, "vectordb_updated",
+        f"pages={st.get('pages')} chunks={st.get('chunks')} chunks_indexed={embedded} "
+        f"reused={reused} removed={removed}",
+    )
+    r.hset(_key(run), mapping={"reused": reused, "removed": removed, "t_upsert": timings.get("upsert", 0.0)})
+    changed = bool(embedded or removed)
+    if not changed:
+        _progress(doc_id, "kg_skipped", "unchanged")
+        finish_document(doc_id, st["filename"], st["content_hash"] or None, meta, timings, bump=bool(reused))
+        _cleanup(run)
+        return False
+    # vectors are searchable now; cached answers must not outlive them
+    bump_corpus_version()
+    _progress(doc_id, "triples_queued", f"candidates={r.llen(_key(run, 'cand'))}")
+    return True
+
+
+def triples(run: str) -> Dict[str, Any]:
+    """Triples for the run's candidate chunks, then identity and timings; ends the run."""
+    r = _redis()
+    st = _state(run)
+    doc_id = st["doc_id"]
+    timings = _timings(st)
+    t0 = time.perf_counter()
+    found = write_document_triples(doc_id, r.lrange(_key(run, "cand"), 0, -1), timings)
+    timings = finish_document(doc_id, st["filename"], st["content_hash"] or None, json.loads(st["meta"]),
+                              timings, bump=True)
+    _cleanup(run)
+    return {
+        "doc_id": doc_id,
+        "pages": int(st.get("pages") or 0),
+        "triples": len(found),
+        "chunks": int(st.get("embedded") or 0),
+        "reused": int(st.get("reused") or 0),
+        "removed": int(st.get("removed") or 0),
+        "timings": timings,
+        "triples_seconds": round(time.perf_counter() - t0, 4),
+    }
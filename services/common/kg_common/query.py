@@ -1,26 +1,42 @@
 # services/common/kg_common/query.py
+import asyncio
 import os
-from typing import List, Dict
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, Iterator, List, Optional, Sequence
 
-from qdrant_client import QdrantClient
 from qdrant_client.http import models as qmodels
 
-from .llm import embed, complete
+from .llm import complete, complete_stream
+from .embed_cache import cached_embed_text
+from . import answer_cache
+from .metrics import ASK_TTFT, STAGE_SECONDS
+from .tracing import bind, stage
+from .scheduler import get_scheduler
+from .clients import qdrant
+from .vector import SearchFilter, search_params
+from .aio import asearch
+from .config import HYBRID_KG, KG_LOOKUP_TIMEOUT, PROMPT_CTX, ANSWER_MAX_TOKENS, CHAT_TEMPLATE_TOKENS, RERANK, RERANK_CANDIDATES
+from .chunking import count_tokens, pack
+from .hybrid import Fact, kg_lookup, kg_lookup_async, fuse, render_facts
+from .kg import doc_graph
+from .rerank import rerank
 
-QDRANT_URL   = os.getenv("QDRANT_URL", "http://qdrant:6333")
 QCOLLECTION  = os.getenv("QDRANT_COLLECTION", "docs")
 TOP_K        = int(os.getenv("TOP_K", "8"))
 
-_q = QdrantClient(url=QDRANT_URL)
+# KG lookups run here while the calling thread embeds and searches Qdrant
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_THREADS", "8")), thread_name_prefix="retrieval")
 
 QA_SYS = (
-    "You answer using ONLY the provided CONTEXT. "
+    "You answer using ONLY the provided FACTS and CONTEXT. "
     "If the answer is not in the context, say: \"I don't know based on the provided documents.\" "
     "Be concise."
 )
 
 def _embed_one(text: str) -> List[float]:
-    vec = embed(text)
+    with stage("query_embed"):
+        vec = cached_embed_text(text)
     # normalize nested [[...]] → [...]
     if isinstance(vec, list) and vec and isinstance(vec[0], list):
         vec = vec[0]
@@ -28,32 +44,251 @@ def _embed_one(text: str) -> List[float]:
         raise ValueError("Embedding must be a flat list[float]")
     return [float(x) for x in vec]
 
-def search(query: str, top_k: int = TOP_K):
-    v = _embed_one(query)
+def search(query: str, top_k: int = TOP_K, vector: Optional[List[float]] = None,
+           filters: Optional[SearchFilter] = None):
+    v = vector if vector is not None else _embed_one(query)
     # Qdrant HTTP client expects plain list[float]
-    hits = _q.search(
-        collection_name=QCOLLECTION,
-        query_vector=v,
-        limit=top_k,
-        with_payload=True
-    )
+    with stage("search"):
+        hits = qdrant().search(
+            collection_name=filters.collection if filters else QCOLLECTION,
+            query_vector=v,
+            query_filter=filters.to_qdrant() if filters else None,
+            limit=top_k,
+            with_payload=True,
+            search_params=search_params(),
+        )
     return hits
 
-def answer(question: str, top_k: int = TOP_K) -> Dict:
-    hits = search(question, top_k=top_k)
+def _contexts(hits, top_k: int) -> List[str]:
     contexts: List[str] = []
     for h in hits:
         p = getattr(h, "payload", {}) or {}
         t = p.get("text")
         if isinstance(t, str) and t.strip():
             contexts.append(t.strip())
-    ctx_joined = "\n\n".join(f"[{i+1}] {c}" for i, c in enumerate(contexts[:top_k]))
+    return contexts[:top_k]
 
-    user = f"CONTEXT:\n{ctx_joined}\n\nQUESTION: {question}\nANSWER:"
-    out = complete(QA_SYS, user, max_tokens=192, temperature=0.1).strip()
+def _fetch_k(top_k: int) -> int:
+    """Hits to fetch from Qdrant: over-fetch when a reranker picks the top_k."""
+    return max(top_k, RERANK_CANDIDATES) if RERANK else top_k
 
+def _rank(question: str, hits, top_k: int) -> List[str]:
+    """
+    Up to top_k contexts, best first: cross-encoder order (and score cutoff)
+    with RERANK=1, vector order otherwise.
+    """
+    if not RERANK:
+        return _contexts(hits, top_k)
+    with stage("rerank"):
+        return [t for t, _ in rerank(question, _contexts(hits, len(hits)), top_k)]
+
+def _qa_prompt(question: str, contexts: List[str], facts: Sequence[Fact] = ()) -> str:
+    ctx_joined = "\n\n".join(f"[{i+1}] {c}" for i, c in enumerate(contexts))
+    facts_block = f"FACTS:\n{render_facts(facts)}\n\n" if facts else ""
+    return f"{facts_block}CONTEXT:\n{ctx_joined}\n\nQUESTION: {question}\nANSWER:"
+
+def _fit_contexts(question: str, contexts: List[str], facts: Sequence[Fact]) -> List[str]:
+    """
+    Contexts, in rank order, that fit one generation slot exactly: PROMPT_CTX
+    minus the answer, the chat template, QA_SYS, facts and the question.
+    """
+    with stage("prompt_build"):
+        budget = PROMPT_CTX - ANSWER_MAX_TOKENS - CHAT_TEMPLATE_TOKENS - count_tokens(QA_SYS)
+        room = budget - count_tokens(_qa_prompt(question, [], facts))
+        keep = [contexts[i] for i in pack([f"[{i+1}] {c}" for i, c in enumerate(contexts)], room, sep_tokens=2)]
+        # the per-item sum is an estimate of the joined prompt; check the real thing
+        while keep and count_tokens(_qa_prompt(question, keep, facts)) > budget:
+            keep.pop()
+    return keep
+
+def _kg_graphs(filters: Optional[SearchFilter]) -> Optional[List[str]]:
+    """
+    Named graphs the KG leg may read: all (None) for an unfiltered question,
+    the documents' graphs for a filter on doc_ids alone, none ([]) otherwise.
+    Tags, tenants and dates are only known to the vector payloads, so a
+    doc_id outside them (another tenant's, say) must not reach the KG leg.
+    """
+    if not filters:
+        return None
+    if filters.tags or filters.tenant or filters.date_from is not None or filters.date_to is not None:
+        return []
+    return [doc_graph(d) for d in filters.doc_ids]
+
+def _kg_safe(question: str, graphs: Optional[List[str]] = None):
+    if not HYBRID_KG or graphs == []:
+        return [], []
+    try:
+        with stage("kg_lookup"):
+            return kg_lookup(question, graphs=graphs)
+    except Exception:
+        # KG is best-effort at answer time; vector contexts still answer
+        return [], []
+
+async def _akg_safe(question: str, graphs: Optional[List[str]] = None):
+    if not HYBRID_KG or graphs == []:
+        return [], []
+    try:
+        with stage("kg_lookup"):
+            return await kg_lookup_async(question, graphs=graphs)
+    except Exception:
+        return [], []
+
+def _retrieve(question: str, top_k: int, filters: Optional[SearchFilter] = None):
+    """
+    Cache check, then KG lookup concurrently with embed + Qdrant search, both
+    restricted by `filters`.
+    Returns (cached_answer_or_None, question_vector, corpus_version, contexts, facts).
+    """
+    cache = answer_cache.get_cache()
+    version = answer_cache.corpus_version() if cache.enabled else ""
+    scope = filters.cache_key() if filters else ""
+
+    out = cache.get_exact(question, top_k, version, scope)
+    if out is not None:
+        answer_cache.record("exact_hit")
+        return out, None, version, [], []
+
+    kg_future = _pool.submit(bind(_kg_safe), question, _kg_graphs(filters))
+    v = _embed_one(question)
+    out = cache.get_semantic(v, top_k, version, scope)
+    if out is not None:
+        answer_cache.record("semantic_hit")
+        kg_future.cancel()
+        return out, v, version, [], []
+    answer_cache.record("miss")
+
+    hits = search(question, top_k=_fetch_k(top_k), vector=v, filters=filters)
+    ranked = _rank(question, hits, top_k)
+    try:
+        # started before embed + search, so this only waits if the lookup is slower than they were
+        facts, labels = kg_future.result(timeout=KG_LOOKUP_TIMEOUT)
+    except FutureTimeout:
+        facts, labels = [], []
+    contexts, facts = fuse(ranked, facts, labels)
+    return None, v, version, _fit_contexts(question, contexts, facts), facts
+
+async def _aretrieve(question: str, top_k: int, filters: Optional[SearchFilter] = None):
+    """Event-loop version of _retrieve(): KG and vector legs are gathered."""
+    cache = answer_cache.get_cache()
+    version = await answer_cache.corpus_version_async() if cache.enabled else ""
+    scope = filters.cache_key() if filters else ""
+
+    out = cache.get_exact(question, top_k, version, scope)
+    if out is not None:
+        answer_cache.record("exact_hit")
+        return out, None, version, [], []
+
+    kg_task = asyncio.create_task(_akg_safe(question, _kg_graphs(filters)))
+    v = await asyncio.to_thread(_embed_one, question)
+    out = cache.get_semantic(v, top_k, version, scope)
+    if out is not None:
+        answer_cache.record("semantic_hit")
+        kg_task.cancel()
+        return out, v, version, [], []
+    answer_cache.record("miss")
+
+    with stage("search"):
+        hits = await asearch(filters.collection if filters else QCOLLECTION, v, _fetch_k(top_k),
+                             query_filter=filters.to_qdrant() if filters else None, search_params=search_params())
+    ranked = await asyncio.to_thread(_rank, question, hits, top_k) if RERANK else _contexts(hits, top_k)
+    try:
+        facts, labels = await asyncio.wait_for(kg_task, KG_LOOKUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        facts, labels = [], []
+    contexts, facts = fuse(ranked, facts, labels)
+    contexts = await asyncio.to_thread(_fit_contexts, question, contexts, facts)
+    return None, v, version, contexts, facts
+
+def _result(question: str, out: str, contexts: List[str], facts: Sequence[Fact], partial: bool = False) -> Dict:
     return {
         "question": question,
         "answer": out,
-        "contexts": contexts[:top_k]
+        "contexts": contexts,
+        "facts": [list(f) for f in facts],
+        "partial": partial,
     }
+
+def _cache_put(question: str, top_k: int, version: str, result: Dict, v: Optional[List[float]],
+               filters: Optional[SearchFilter]):
+    # an answer cut short by the deadline is not the answer; the next ask may have time to finish it
+    if result["partial"]:
+        return
+    answer_cache.get_cache().put(question, top_k, version, result, vector=v,
+                                 scope=filters.cache_key() if filters else "")
+
+async def answer_async(question: str, top_k: int = TOP_K, deadline: Optional[float] = None,
+                       filters: Optional[SearchFilter] = None) -> Dict:
+    """
+    answer() for the event loop: Redis, Qdrant and Fuseki are awaited, only the
+    CPU-bound embedding and generation run in worker threads.
+    """
+    t0 = time.perf_counter()
+    out, v, version, contexts, facts = await _aretrieve(question, top_k, filters)
+    if out is not None:
+        return {**out, "question": question}
+
+    user = _qa_prompt(question, contexts, facts)
+    status: Dict[str, Any] = {}
+    with stage("generate"):
+        out = await asyncio.to_thread(complete, QA_SYS, user, ANSWER_MAX_TOKENS, 0.1, deadline, status)
+    ASK_TTFT.labels("blocking").observe(time.perf_counter() - t0)
+
+    result = _result(question, out.strip(), contexts, facts, status["partial"])
+    _cache_put(question, top_k, version, result, v, filters)
+    return result
+
+def answer(question: str, top_k: int = TOP_K, deadline: Optional[float] = None,
+           filters: Optional[SearchFilter] = None) -> Dict:
+    t0 = time.perf_counter()
+    out, v, version, contexts, facts = _retrieve(question, top_k, filters)
+    if out is not None:
+        return {**out, "question": question}
+
+    user = _qa_prompt(question, contexts, facts)
+    status: Dict[str, Any] = {}
+    with stage("generate"):
+        out = complete(QA_SYS, user, max_tokens=ANSWER_MAX_TOKENS, temperature=0.1, deadline=deadline,
+                       status=status).strip()
+    ASK_TTFT.labels("blocking").observe(time.perf_counter() - t0)
+
+    result = _result(question, out, contexts, facts, status["partial"])
+    _cache_put(question, top_k, version, result, v, filters)
+    return result
+
+def answer_stream(question: str, top_k: int = TOP_K, deadline: Optional[float] = None,
+                  filters: Optional[SearchFilter] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming answer(): yields
+      {"event": "contexts", "contexts": [...], "facts": [...]}   as soon as retrieval is done
+      {"event": "token", "text": "..."}                          per decoded piece
+      {"event": "done", "answer": "...", "partial": false}       with the full answer
+                                                                 (partial: cut short by the deadline)
+    Raises SchedulerBusy before the first event when the model queue is full.
+    """
+    t0 = time.perf_counter()
+    out, v, version, contexts, facts = _retrieve(question, top_k, filters)
+    if out is not None:
+        yield {"event": "contexts", "contexts": out.get("contexts", []), "facts": out.get("facts", [])}
+        yield {"event": "token", "text": out.get("answer", "")}
+        ASK_TTFT.labels("stream").observe(time.perf_counter() - t0)
+        yield {"event": "done", "answer": out.get("answer", ""), "partial": False}
+        return
+
+    get_scheduler().check_admission()
+    yield {"event": "contexts", "contexts": contexts, "facts": [list(f) for f in facts]}
+
+    # no span here: a generator is resumed from other contexts between tokens
+    t_gen = time.perf_counter()
+    pieces: List[str] = []
+    status: Dict[str, Any] = {}
+    for piece in complete_stream(QA_SYS, _qa_prompt(question, contexts, facts), max_tokens=ANSWER_MAX_TOKENS, temperature=0.1,
+                                 deadline=deadline, status=status):
+        if not pieces:
+            ASK_TTFT.labels("stream").observe(time.perf_counter() - t0)
+        pieces.append(piece)
+        yield {"event": "token", "text": piece}
+
+    STAGE_SECONDS.labels("generate").observe(time.perf_counter() - t_gen)
+    full = "".join(pieces).strip()
+    _cache_put(question, top_k, version, _result(question, full, contexts, facts, status["partial"]), v, filters)
+    yield {"event": "done", "answer": full, "partial": status["partial"]}
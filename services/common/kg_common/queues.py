@@ -0,0 +1,68 @@
+# services/common/kg_common/queues.py
+"""
+Celery routing shared by the API (producer) and the worker (consumer).
+
+Three queues so one long document cannot starve the rest:
+  ingest   parse + finalize (cheap, keeps documents moving)
+  embed    one batch of chunks each, spread over all workers
+  triples  LLM extraction, the slowest step
+Within a queue, the redis transport orders by priority (lower runs first):
+small interactive uploads go ahead of big files and bulk loads. Queues are
+polled round-robin, and the follow-up tasks of a document (embed, finalize,
+triples) are published one step above its parse, so documents already in
+flight finish before new ones are parsed.
+
+Workers consume all three by default (`-Q ingest,embed,triples`); a host can
+be dedicated to one of them by passing only that queue.
+"""
+from typing import Any, Dict
+
+from .config import INGEST_SMALL_MB
+
+Q_INGEST = "ingest"
+Q_EMBED = "embed"
+Q_TRIPLES = "triples"
+QUEUES = (Q_INGEST, Q_EMBED, Q_TRIPLES)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 3
+PRIORITY_BULK = 6
+
+ROUTES = {
+    "tasks.process_path": {"queue": Q_INGEST},
+    "tasks.finalize_run": {"queue": Q_INGEST},
+    "tasks.embed_batch": {"queue": Q_EMBED},
+    "tasks.triples_run": {"queue": Q_TRIPLES},
+}
+
+# worker liveness: sorted set of "host:pid" scored by last beat (unix seconds)
+WORKERS_KEY = "workers:alive"
+
+
+def upload_priority(size_bytes: int) -> int:
+    return PRIORITY_INTERACTIVE if size_bytes <= INGEST_SMALL_MB * 1024 * 1024 else PRIORITY_DEFAULT
+
+
+def follow_up(priority: int) -> int:
+    """Priority of a document's embed/finalize/triples tasks, given its parse priority."""
+    return max(priority - 1, PRIORITY_INTERACTIVE)
+
+
+def configure(app) -> None:
+    """Routes, queues and priority/ack settings on a Celery app (keeps its transport retry options)."""
+    transport: Dict[str, Any] = dict(app.conf.broker_transport_options or {})
+    transport.update({
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        # an embed or triples task must not be redelivered while it still runs
+        "visibility_timeout": 4 * 3600,
+    })
+    app.conf.broker_transport_options = transport
+    app.conf.task_default_queue = Q_INGEST
+    app.conf.task_routes = ROUTES
+    app.conf.task_default_priority = PRIORITY_DEFAULT
+    # short tasks: take one at a time so a priority-0 upload is not stuck
+    # behind a prefetched backlog, and requeue work lost with a dead worker
+    app.conf.worker_prefetch_multiplier = 1
+    app.conf.task_acks_late = True
+    app.conf.task_reject_on_worker_lost = True
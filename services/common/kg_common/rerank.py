@@ -0,0 +1,76 @@
+# services/common/kg_common/rerank.py
+"""
+Optional cross-encoder reranking of retrieved chunks (RERANK=1).
+
+query.py over-fetches RERANK_CANDIDATES hits from Qdrant; a small CPU
+cross-encoder (RERANK_MODEL, MiniLM-sized by default) scores every
+(question, chunk) pair in batches of RERANK_BATCH, and only chunks scoring
+at least RERANK_MIN_SCORE are kept, best first. The prompt packer then
+takes as many of those as fit the token budget, so the number of contexts
+adapts to the question instead of always being top_k.
+
+If the model cannot be loaded the ranking is left as it came from Qdrant.
+"""
+import logging
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+from .config import RERANK_MODEL, RERANK_BATCH, RERANK_MAX_LENGTH, RERANK_MIN_SCORE, EMBED_THREADS
+from .metrics import RERANK_KEPT
+
+log = logging.getLogger(__name__)
+
+_model = None
+_model_lock = threading.Lock()
+# CrossEncoder.predict is not meant to be entered from several threads at once
+_predict_lock = threading.Lock()
+
+
+def _cross_encoder():
+    """The loaded CrossEncoder, or False when reranking is unavailable."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                try:
+                    import torch
+                    from sentence_transformers import CrossEncoder
+                    torch.set_num_threads(EMBED_THREADS)
+                    _model = CrossEncoder(RERANK_MODEL, device="cpu", max_length=RERANK_MAX_LENGTH)
+                except Exception as e:
+                    log.warning("reranker unavailable (%s: %s); keeping vector order", type(e).__name__, e)
+                    _model = False
+    return _model
+
+
+def score(question: str, texts: Sequence[str]) -> Optional[List[float]]:
+    """Cross-encoder relevance of each text to the question (None without a model)."""
+    model = _cross_encoder()
+    if not model or not texts:
+        return None
+    with _predict_lock:
+        out = model.predict(
+            [(question, t) for t in texts],
+            batch_size=RERANK_BATCH,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+    return [float(s) for s in out]
+
+
+def rerank(question: str, texts: List[str], limit: int,
+           min_score: Optional[float] = RERANK_MIN_SCORE) -> List[Tuple[str, Optional[float]]]:
+    """
+    Up to `limit` texts ordered by cross-encoder score, dropping those below
+    `min_score` (the best one is always kept). Without a model: the first
+    `limit` texts in their original order, with no scores.
+    """
+    # timed by the caller's "rerank" stage (kg_stage_seconds)
+    scores = score(question, texts)
+    if scores is None:
+        return [(t, None) for t in texts[:limit]]
+    ranked = sorted(zip(texts, scores), key=lambda x: -x[1])
+    kept = [x for x in ranked if min_score is None or x[1] >= min_score] or ranked[:1]
+    kept = kept[:limit]
+    RERANK_KEPT.observe(len(kept))
+    return kept
@@ -0,0 +1,97 @@
+# services/common/kg_common/scheduler.py
+"""
+Bounded admission in front of the local model.
+
+LLM_SLOTS generations run at once (each on its own Llama context), at most
+LLM_QUEUE_MAX more wait for a slot, and anything beyond that is rejected
+immediately with SchedulerBusy so the API can answer 429 + Retry-After
+instead of piling threads onto llama.cpp. Every request carries a deadline
+(monotonic seconds); waiting past it raises DeadlineExceeded.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from .config import LLM_SLOTS, LLM_QUEUE_MAX, LLM_DEADLINE_S
+from .metrics import LLM_QUEUE_DEPTH, LLM_SLOTS_BUSY, LLM_QUEUE_WAIT, LLM_REJECTED
+
+
+class SchedulerBusy(RuntimeError):
+    def __init__(self, msg: str, retry_after: float):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, msg: str, retry_after: float):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+def deadline_in(seconds: Optional[float] = None) -> float:
+    return time.monotonic() + (LLM_DEADLINE_S if seconds is None else seconds)
+
+
+class InferenceScheduler:
+    def __init__(self, slots: int = LLM_SLOTS, queue_max: int = LLM_QUEUE_MAX):
+        self.slots = max(int(slots), 1)
+        self.queue_max = max(int(queue_max), 0)
+        self._cond = threading.Condition()
+        self._free = list(range(self.slots))
+        self._waiting = 0
+        self._avg_hold = 5.0  # EWMA of seconds a slot is held; seeds Retry-After
+
+    def retry_after(self) -> float:
+        # rough time until a newcomer would get a slot
+        return max(1.0, self._avg_hold * (self._waiting + 1) / self.slots)
+
+    def check_admission(self):
+        """Cheap pre-check for callers that must decide before streaming starts."""
+        with self._cond:
+            if not self._free and self._waiting >= self.queue_max:
+                LLM_REJECTED.labels("queue_full").inc()
+                raise SchedulerBusy("inference queue full", self.retry_after())
+
+    @contextmanager
+    def slot(self, deadline: Optional[float] = None) -> Iterator[int]:
+        """Hold one model slot; yields its index."""
+        deadline = deadline if deadline is not None else deadline_in()
+        t0 = time.monotonic()
+        with self._cond:
+            if not self._free and self._waiting >= self.queue_max:
+                LLM_REJECTED.labels("queue_full").inc()
+                raise SchedulerBusy("inference queue full", self.retry_after())
+            self._waiting += 1
+            LLM_QUEUE_DEPTH.set(self._waiting)
+            try:
+                while not self._free:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        LLM_REJECTED.labels("deadline").inc()
+                        raise DeadlineExceeded("deadline exceeded waiting for a model slot", self.retry_after())
+                    self._cond.wait(remaining)
+                idx = self._free.pop()
+            finally:
+                self._waiting -= 1
+                LLM_QUEUE_DEPTH.set(self._waiting)
+            LLM_SLOTS_BUSY.set(self.slots - len(self._free))
+
+        started = time.monotonic()
+        LLM_QUEUE_WAIT.observe(started - t0)
+        try:
+            yield idx
+        finally:
+            held = time.monotonic() - started
+            with self._cond:
+                self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+                self._free.append(idx)
+                LLM_SLOTS_BUSY.set(self.slots - len(self._free))
+                self._cond.notify()
+
+
+_scheduler = InferenceScheduler()
+
+
+def get_scheduler() -> InferenceScheduler:
+    return _scheduler
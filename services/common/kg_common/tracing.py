@@ -0,0 +1,116 @@
+# services/common/kg_common/tracing.py
+"""
+Stage timing and optional OpenTelemetry tracing.
+
+- stage(name): times a block into kg_stage_seconds{stage} and, with tracing
+  on, records it as a child span of the current one
+- span(name): span only (request and task roots)
+- inject()/extracted(): carry the trace context across the Celery hop, so
+  an /api/upload and the ingest task it queues share one trace
+- bind(fn): run fn in a pool thread under the caller's trace context
+
+Tracing is on when TRACING=1 and the opentelemetry SDK and OTLP exporter are
+installed; the exporter reads the standard OTEL_EXPORTER_OTLP_* variables.
+Without it every helper is a cheap no-op apart from the histogram.
+"""
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from .config import TRACING
+from .metrics import STAGE_SECONDS, LLM_TOKENS_PER_SECOND
+
+log = logging.getLogger(__name__)
+
+_tracer = None
+
+
+def setup(service: str) -> bool:
+    """Install the OTLP tracer provider (api startup, each worker process)."""
+    global _tracer
+    if not TRACING or _tracer is not None:
+        return bool(_tracer)
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        log.warning("TRACING=1 but OpenTelemetry is not installed (%s); spans disabled", e)
+        return False
+    provider = TracerProvider(resource=Resource.create({"service.name": service}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("kg_common")
+    return True
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[None]:
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(name, attributes=attrs or None):
+        yield
+
+
+@contextmanager
+def stage(name: str, **attrs) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        with span(name, **attrs):
+            yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - t0)
+
+
+def inject() -> Dict[str, str]:
+    """W3C trace headers for the current span ({} without tracing)."""
+    carrier: Dict[str, str] = {}
+    if _tracer is not None:
+        from opentelemetry import propagate
+        propagate.inject(carrier)
+    return carrier
+
+
+@contextmanager
+def extracted(carrier: Optional[Dict[str, str]], name: str, **attrs) -> Iterator[None]:
+    """Open span `name` as a child of the context in `carrier`."""
+    if _tracer is None:
+        yield
+        return
+    from opentelemetry import context, propagate
+    token = context.attach(propagate.extract(carrier or {}))
+    try:
+        with span(name, **attrs):
+            yield
+    finally:
+        context.detach(token)
+
+
+def bind(fn: Callable) -> Callable:
+    """fn wrapped to run under the current trace context (for executor threads)."""
+    if _tracer is None:
+        return fn
+    from opentelemetry import context
+    ctx = context.get_current()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = context.attach(ctx)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            context.detach(token)
+    return run
+
+
+def observe_llm(prompt_tokens: int, prefill_s: float, output_tokens: int, decode_s: float):
+    """Prefill and decode throughput of one generation."""
+    if prompt_tokens > 0 and prefill_s > 0:
+        LLM_TOKENS_PER_SECOND.labels("prefill").observe(prompt_tokens / prefill_s)
+    if output_tokens > 0 and decode_s > 0:
+        LLM_TOKENS_PER_SECOND.labels("decode").observe(output_tokens / decode_s)
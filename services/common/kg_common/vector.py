@@ -1,21 +1,317 @@
+# services/common/kg_common/vector.py
+"""
+Managed Qdrant collection schema.
+
+New collections get HNSW m/ef_construct, int8 scalar quantization (kept in
+RAM, searched with rescoring), optional on-disk vectors and payload, and
+indexes on the payload fields we filter on. Search-time HNSW ef and
+quantization options come from search_params(); SearchFilter turns a
+question's scope (doc_ids, tags, tenant, upload dates) into a Qdrant filter
+and picks the tenant's collection when QDRANT_TENANT_COLLECTIONS is set.
+
+CLI:
+    python -m kg_common.vector status
+    python -m kg_common.vector ensure
+    python -m kg_common.vector migrate [--batch 256]
+    python -m kg_common.vector bench [--queries 200] [--top-k 8] [--ef 16,32,64,128]
+
+`migrate` copies every point into a fresh collection built with the current
+settings and points the QDRANT_COLLECTION alias at it. A plain (non-alias)
+collection of that name is deleted right before the alias is created, so
+searches fail for that moment; run it between ingests.
+"""
+import argparse
+import json
 import os
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 
-QDRANT_URL = os.getenv("QDRANT_URL", "http://qdrant:6333")
+from .config import (
+    EMBED_DIM,
+    QDRANT_HNSW_M,
+    QDRANT_HNSW_EF_CONSTRUCT,
+    QDRANT_SEARCH_EF,
+    QDRANT_QUANTIZATION,
+    QDRANT_QUANT_RESCORE,
+    QDRANT_QUANT_OVERSAMPLING,
+    QDRANT_ON_DISK,
+    QDRANT_ON_DISK_PAYLOAD,
+    QDRANT_TENANT_COLLECTIONS,
+)
+from .clients import qdrant
+
 QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "docs")
-VECTOR_SIZE = int(os.getenv("QDRANT_VECTOR_SIZE", "1024"))  # adjust to your embedding size
+VECTOR_SIZE = int(os.getenv("QDRANT_VECTOR_SIZE", str(EMBED_DIM)))  # follows the embedding engine
 DISTANCE = os.getenv("QDRANT_DISTANCE", "Cosine")
 
+# payload fields used in filters -> index type
+PAYLOAD_INDEXES: Dict[str, qm.PayloadSchemaType] = {
+    "doc_id": qm.PayloadSchemaType.KEYWORD,
+    "tags": qm.PayloadSchemaType.KEYWORD,
+    "tenant": qm.PayloadSchemaType.KEYWORD,
+    "uploaded_at": qm.PayloadSchemaType.INTEGER,   # epoch seconds
+}
+
+
 def get_client() -> QdrantClient:
-    return QdrantClient(url=QDRANT_URL)
+    return qdrant()
 
-def ensure_collection(client: QdrantClient, name: str = QDRANT_COLLECTION, dim: int = VECTOR_SIZE):
-    dist = getattr(qm.Distance, DISTANCE, qm.Distance.COSINE)
-    existing = [c.name for c in client.get_collections().collections]
-    if name in existing:
-        return
-    client.recreate_collection(
-        collection_name=name,
-        vectors_config=qm.VectorParams(size=dim, distance=dist),
+
+def collection_for(tenant: Optional[str] = None, base: str = QDRANT_COLLECTION) -> str:
+    """Per-tenant collection when QDRANT_TENANT_COLLECTIONS=1, the shared one otherwise."""
+    if tenant and QDRANT_TENANT_COLLECTIONS:
+        return f"{base}__t_{tenant}"
+    return base
+
+
+# -------------------- Filters --------------------
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Scope of a question, pushed down to Qdrant as a payload filter over the
+    indexed fields. Lists match any of their values; dates are epoch seconds
+    of the upload, inclusive.
+    """
+    doc_ids: Tuple[str, ...] = ()
+    tags: Tuple[str, ...] = ()
+    tenant: Optional[str] = None
+    date_from: Optional[int] = None
+    date_to: Optional[int] = None
+
+    @classmethod
+    def of(cls, doc_ids: Optional[Sequence[str]] = None, tags: Optional[Sequence[str]] = None,
+           tenant: Optional[str] = None, date_from: Optional[int] = None,
+           date_to: Optional[int] = None) -> "SearchFilter":
+        return cls(tuple(sorted(set(doc_ids or ()))), tuple(sorted(set(tags or ()))),
+                   tenant or None, date_from, date_to)
+
+    def __bool__(self):
+        return bool(self.doc_ids or self.tags or self.tenant or self.date_from is not None
+                    or self.date_to is not None)
+
+    @property
+    def collection(self) -> str:
+        return collection_for(self.tenant)
+
+    def cache_key(self) -> str:
+        if not self:
+            return ""
+        return json.dumps([self.doc_ids, self.tags, self.tenant, self.date_from, self.date_to])
+
+    def to_qdrant(self) -> Optional[qm.Filter]:
+        must: List = []
+        if self.tenant:
+            must.append(qm.FieldCondition(key="tenant", match=qm.MatchValue(value=self.tenant)))
+        if self.doc_ids:
+            must.append(qm.FieldCondition(key="doc_id", match=qm.MatchAny(any=list(self.doc_ids))))
+        if self.tags:
+            must.append(qm.FieldCondition(key="tags", match=qm.MatchAny(any=list(self.tags))))
+        if self.date_from is not None or self.date_to is not None:
+            must.append(qm.FieldCondition(key="uploaded_at", range=qm.Range(gte=self.date_from, lte=self.date_to)))
+        return qm.Filter(must=must) if must else None
+
+
+# -------------------- Schema --------------------
+def _quantization() -> Optional[qm.ScalarQuantization]:
+    if QDRANT_QUANTIZATION.lower() != "int8":
+        return None
+    return qm.ScalarQuantization(
+        scalar=qm.ScalarQuantizationConfig(type=qm.ScalarType.INT8, quantile=0.99, always_ram=True)
+    )
+
+
+def collection_config(dim: int = VECTOR_SIZE) -> dict:
+    """create_collection() kwargs for the current settings."""
+    return dict(
+        vectors_config=qm.VectorParams(
+            size=dim,
+            distance=getattr(qm.Distance, DISTANCE.upper(), qm.Distance.COSINE),
+            on_disk=QDRANT_ON_DISK,
+        ),
+        hnsw_config=qm.HnswConfigDiff(m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT),
+        quantization_config=_quantization(),
+        on_disk_payload=QDRANT_ON_DISK_PAYLOAD,
+    )
+
+
+def search_params(ef: Optional[int] = None, exact: bool = False,
+                  quantization: Optional[bool] = None) -> Optional[qm.SearchParams]:
+    """HNSW ef and quantization options for searches (None = server defaults)."""
+    ef = QDRANT_SEARCH_EF if ef is None else ef
+    quantization = _quantization() is not None if quantization is None else quantization
+    if not ef and not exact and not quantization:
+        return None
+    quant = qm.QuantizationSearchParams(
+        ignore=not quantization,
+        rescore=QDRANT_QUANT_RESCORE,
+        oversampling=QDRANT_QUANT_OVERSAMPLING,
     )
+    return qm.SearchParams(hnsw_ef=ef or None, exact=exact, quantization=quant)
+
+
+def ensure_payload_indexes(client: QdrantClient, name: str = QDRANT_COLLECTION, info=None):
+    info = info or client.get_collection(name)
+    present = set((info.payload_schema or {}).keys())
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field not in present:
+            client.create_payload_index(collection_name=name, field_name=field, field_schema=schema, wait=True)
+
+
+def ensure_collection(client: Optional[QdrantClient] = None, name: str = QDRANT_COLLECTION,
+                      dim: int = VECTOR_SIZE):
+    """
+    Create the collection with the managed schema if missing. An existing
+    collection with a different size is an error: the embedding engine
+    changed and the collection must be rebuilt deliberately. Missing payload
+    indexes are added in place.
+    """
+    client = client or qdrant()
+    try:
+        info = client.get_collection(name)
+    except Exception:
+        # (not found or cannot fetch) -> create
+        info = None
+
+    if info is None:
+        client.create_collection(collection_name=name, **collection_config(dim))
+        ensure_payload_indexes(client, name)
+        return
+
+    current_dim = getattr(info.config.params.vectors, "size", None)
+    if current_dim is not None and int(current_dim) != int(dim):
+        raise ValueError(f"Qdrant collection {name!r} has dim={current_dim}, embedding engine declares {dim}")
+    ensure_payload_indexes(client, name, info)
+
+
+# -------------------- Migration --------------------
+def _alias_target(client: QdrantClient, alias: str) -> Optional[str]:
+    for a in client.get_aliases().aliases:
+        if a.alias_name == alias:
+            return a.collection_name
+    return None
+
+
+def migrate(client: Optional[QdrantClient] = None, name: str = QDRANT_COLLECTION, batch: int = 256) -> dict:
+    """Rebuild `name` with the current schema: copy points, then switch the alias."""
+    client = client or qdrant()
+    source = _alias_target(client, name) or name
+    info = client.get_collection(source)
+    dim = int(info.config.params.vectors.size)
+    target = f"{name}__{time.strftime('%Y%m%d%H%M%S')}"
+
+    client.create_collection(collection_name=target, **collection_config(dim))
+    ensure_payload_indexes(client, target)
+
+    copied, offset = 0, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source, limit=batch, offset=offset, with_payload=True, with_vectors=True
+        )
+        if points:
+            client.upsert(
+                collection_name=target,
+                points=[qm.PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points],
+                wait=offset is None,  # the last batch waits, covering the earlier ones
+            )
+            copied += len(points)
+            print(f"copied {copied}", file=sys.stderr)
+        if offset is None:
+            break
+
+    ops: List = []
+    if source != name:
+        ops.append(qm.DeleteAliasOperation(delete_alias=qm.DeleteAlias(alias_name=name)))
+    else:
+        client.delete_collection(name)  # a collection and an alias cannot share a name
+    ops.append(qm.CreateAliasOperation(create_alias=qm.CreateAlias(collection_name=target, alias_name=name)))
+    client.update_collection_aliases(change_aliases_operations=ops)
+    if source != name:
+        client.delete_collection(source)
+    return {"alias": name, "from": source, "to": target, "points": copied}
+
+
+# -------------------- Benchmark --------------------
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+def bench(client: Optional[QdrantClient] = None, name: str = QDRANT_COLLECTION, queries: int = 200,
+          top_k: int = 8, efs: List[int] = (16, 32, 64, 128)) -> List[dict]:
+    """
+    Recall@k (against exact search) and latency for each search setting, using
+    stored vectors as queries. Compare build settings by running it before
+    and after `migrate`.
+    """
+    client = client or qdrant()
+    sample, _ = client.scroll(collection_name=name, limit=queries, with_vectors=True, with_payload=False)
+    vectors = [p.vector for p in sample]
+    if not vectors:
+        return []
+
+    def run(params):
+        ids, lat = [], []
+        for v in vectors:
+            t0 = time.perf_counter()
+            hits = client.search(collection_name=name, query_vector=v, limit=top_k, search_params=params)
+            lat.append(time.perf_counter() - t0)
+            ids.append({h.id for h in hits})
+        return ids, lat
+
+    def row(setting, got, lat):
+        recall = statistics.mean(len(g & t) / max(len(t), 1) for g, t in zip(got, truth))
+        return {
+            "setting": setting,
+            "recall": round(recall, 4),
+            "p50_ms": round(_percentile(lat, 50) * 1e3, 2),
+            "p95_ms": round(_percentile(lat, 95) * 1e3, 2),
+        }
+
+    truth, exact_lat = run(search_params(exact=True, quantization=False))
+    rows = [row("exact", truth, exact_lat)]
+    quant_modes = [False, True] if _quantization() is not None else [False]
+    for ef in efs:
+        for quant in quant_modes:
+            got, lat = run(search_params(ef=ef, quantization=quant))
+            rows.append(row(f"ef={ef}" + (" int8+rescore" if quant else ""), got, lat))
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m kg_common.vector")
+    ap.add_argument("command", choices=["status", "ensure", "migrate", "bench"])
+    ap.add_argument("--collection", default=QDRANT_COLLECTION)
+    ap.add_argument("--batch", type=int, default=256)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=8)
+    ap.add_argument("--ef", default="16,32,64,128")
+    args = ap.parse_args(argv)
+
+    client = qdrant()
+    if args.command == "status":
+        info = client.get_collection(args.collection)
+        out = {
+            "collection": _alias_target(client, args.collection) or args.collection,
+            "points": info.points_count,
+            "config": info.config.dict(),
+            "payload_schema": {k: v.dict() for k, v in (info.payload_schema or {}).items()},
+        }
+    elif args.command == "ensure":
+        ensure_collection(client, args.collection)
+        out = {"ok": True}
+    elif args.command == "migrate":
+        out = migrate(client, args.collection, batch=args.batch)
+    else:
+        efs = [int(x) for x in args.ef.split(",") if x.strip()]
+        out = bench(client, args.collection, queries=args.queries, top_k=args.top_k, efs=efs)
+    print(json.dumps(out, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
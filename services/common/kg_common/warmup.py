@@ -0,0 +1,136 @@
+# services/common/kg_common/warmup.py
+"""
+Model loading at startup instead of on the first request.
+
+- preload(): load weights without running inference. The Celery parent calls
+  it before forking the pool, so children share the embedding model's pages
+  copy-on-write and find the GGUF files already in the page cache (llama.cpp
+  mmaps them, so every process maps the same physical pages). No inference
+  runs before the fork: thread pools (OpenMP, ggml) do not survive it.
+- warm(): load what is missing and run one tiny call per model in the
+  serving process, so the first request does not pay for lazy init.
+- ready()/status(): for /api/ready (the api) and the worker heartbeat.
+
+Components: tokenizer (chunking/prompt packing vocab), embedder, llm (local
+model only; with LLM_SERVER_URL the server owns it) and reranker (RERANK=1).
+A tokenizer or reranker that fails to load degrades answers (estimated token
+counts, vector order) but does not block readiness; embedder and llm do.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from .config import RERANK, TOKENIZER_PATH, WARMUP
+from .metrics import WARMUP_SECONDS
+
+log = logging.getLogger(__name__)
+
+COMPONENTS = ("tokenizer", "embedder", "llm", "reranker")
+REQUIRED = ("embedder", "llm")
+
+_lock = threading.Lock()
+_state: Dict[str, str] = {}   # component -> loading | ready | skipped | degraded | failed: ...
+_warm: Optional[bool] = None  # None until warm() ran; then whether every required component is ready
+
+
+def _page_in(path: str):
+    """Ask the kernel to read a model file into the page cache (async readahead)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except (OSError, AttributeError):
+        pass
+
+
+def _local_llm() -> bool:
+    from .llm import LLM_SERVER_URL
+    return not LLM_SERVER_URL
+
+
+def _load(name: str, run: bool) -> str:
+    """Load one component (and exercise it when `run`); returns its state."""
+    if name == "tokenizer":
+        from .chunking import _tokenizer, count_tokens
+        _page_in(TOKENIZER_PATH)
+        if not _tokenizer():
+            return "degraded"
+        if run:
+            count_tokens("warm up")
+        return "ready"
+    if name == "embedder":
+        from .embeddings import embed_texts, get_engine
+        get_engine()
+        if run:
+            embed_texts(["warm up"])
+        return "ready"
+    if name == "llm":
+        if not _local_llm():
+            return "skipped"
+        from .llm import MODEL_PATH, complete
+        _page_in(MODEL_PATH)
+        if run:
+            complete("You are a helpful assistant.", "ping", max_tokens=1)
+        return "ready"
+    if name == "reranker":
+        if not RERANK:
+            return "skipped"
+        from .rerank import _cross_encoder, score
+        if not _cross_encoder():
+            return "degraded"
+        if run:
+            score("warm up", ["warm up"])
+        return "ready"
+    raise ValueError(f"unknown component {name!r}")
+
+
+def _each(components: Iterable[str], run: bool):
+    for name in components:
+        if _state.get(name) in ("ready", "skipped"):
+            continue
+        _state[name] = "loading"
+        t0 = time.perf_counter()
+        try:
+            _state[name] = _load(name, run)
+        except Exception as e:
+            log.warning("warm-up of %s failed (%s: %s)", name, type(e).__name__, e)
+            _state[name] = f"failed: {type(e).__name__}"
+        WARMUP_SECONDS.labels(name).set(time.perf_counter() - t0)
+        if _state[name] == "ready" and not run:
+            _state[name] = "loaded"
+
+
+def preload(components: Iterable[str] = COMPONENTS):
+    """Load weights only (safe before fork)."""
+    if not WARMUP:
+        return
+    with _lock:
+        _each(components, run=False)
+    log.info("preloaded: %s", _state)
+
+
+def warm(components: Iterable[str] = COMPONENTS) -> bool:
+    """Load and exercise every component in this process; returns ready()."""
+    global _warm
+    components = tuple(components)
+    if WARMUP:
+        with _lock:
+            for name in components:
+                if _state.get(name) == "loaded":
+                    _state[name] = "loading"  # loaded before fork: still needs its first call here
+            _each(components, run=True)
+        log.info("warm: %s", _state)
+    _warm = all(_state.get(n, "ready") in ("ready", "skipped") for n in REQUIRED if n in components)
+    return _warm
+
+
+def ready() -> bool:
+    return bool(_warm)
+
+
+def status() -> Dict[str, Any]:
+    return {"ready": ready(), "warmup": WARMUP, "components": dict(_state)}
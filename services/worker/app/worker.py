@@ -1,10 +1,28 @@
 # services/worker/app/worker.py
+import logging
 import os
 import time
 import threading
+
+# prefork children record the metrics; with a multiprocess dir the parent's
+# :9808 server aggregates them (must be set before prometheus_client loads)
+PROM_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+if PROM_DIR:
+    os.makedirs(PROM_DIR, exist_ok=True)
+    for f in os.listdir(PROM_DIR):  # series of a previous run
+        os.remove(os.path.join(PROM_DIR, f))
+
+import socket
+
 from celery import Celery
-from kg_common.ingest import process_document
-from prometheus_client import start_http_server
+from celery.signals import task_failure, worker_init, worker_process_init, worker_process_shutdown
+from kg_common import pipeline, tracing, warmup
+from kg_common.config import INGEST_SPLIT, REDIS_URL, WORKER_HEARTBEAT_S, WORKER_PRELOAD
+from kg_common.ingest import process_file
+from kg_common.queues import Q_EMBED, Q_INGEST, Q_TRIPLES, WORKERS_KEY, configure, follow_up
+from prometheus_client import CollectorRegistry, start_http_server
+
+log = logging.getLogger(__name__)
 
 # ---- Celery config ----
 BROKER_URL  = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
@@ -24,21 +42,128 @@ celery.conf.broker_transport_options = {
     "interval_max": 3,
 }
 celery.conf.result_expires = 3600
+configure(celery)
+celery_app = celery  # name used by the Dockerfile CMD
 
-# ---- Task ----
-@celery.task(name="tasks.process_path")
-def process_path(path: str, doc_id: str):
+# ---- Tasks ----
+# With INGEST_SPLIT=1 an upload becomes parse -> embed_batch x N -> finalize_run
+# -> triples_run (see kg_common.pipeline); every follow-up task inherits the
+# upload's priority and trace context.
+@celery.task(name="tasks.process_path", bind=True)
+def process_path(self, path: str, doc_id: str, content_hash: str | None = None,
+                 tags: list | None = None, tenant: str | None = None, trace: dict | None = None):
     """
-    API sends (path, doc_id). We read the file here and pass bytes to the common ingest.
+    API sends (path, doc_id, content_hash, tags, tenant, trace). The file is
+    streamed page by page through the common ingest; it is never read into
+    memory whole. `trace` carries the upload's span context.
     """
-    with open(path, "rb") as f:
-        data = f.read()
-    filename = os.path.basename(path)
-    return process_document(filename, data, doc_id)
+    with tracing.extracted(trace, "ingest", doc_id=doc_id):
+        if not INGEST_SPLIT:
+            return process_file(path, doc_id, content_hash=content_hash, tags=tags, tenant=tenant)
+        prio = self.request.delivery_info.get("priority") if self.request.delivery_info else None
+        prio = prio if prio is not None else celery.conf.task_default_priority
+        # follow-ups run ahead of new parses at the same level
+        next_prio = follow_up(prio)
+        carrier = tracing.inject()
+
+        def on_batch(run: str, n: int):
+            embed_batch.apply_async((run, n), {"trace": carrier}, queue=Q_EMBED, priority=next_prio)
+
+        run, ready = pipeline.parse(path, doc_id, content_hash=content_hash, tags=tags, tenant=tenant,
+                                    on_batch=on_batch, prio=next_prio)
+        if ready:
+            _queue_finalize(run, carrier)
+        return {"doc_id": doc_id, "run": run}
+
+def _queue_finalize(run: str, trace: dict | None):
+    finalize_run.apply_async((run,), {"trace": trace}, queue=Q_INGEST, priority=pipeline.priority(run))
+
+@celery.task(name="tasks.embed_batch", autoretry_for=(Exception,),
+             retry_backoff=True, max_retries=3)
+def embed_batch(run: str, n: int, trace: dict | None = None):
+    with tracing.extracted(trace, "ingest.embed", batch=n):
+        if pipeline.embed(run, n):
+            _queue_finalize(run, trace)
+
+@celery.task(name="tasks.finalize_run")
+def finalize_run(run: str, trace: dict | None = None):
+    with tracing.extracted(trace, "ingest.finalize"):
+        if pipeline.finalize(run):
+            triples_run.apply_async((run,), {"trace": trace}, queue=Q_TRIPLES, priority=pipeline.priority(run))
+
+@celery.task(name="tasks.triples_run")
+def triples_run(run: str, trace: dict | None = None):
+    with tracing.extracted(trace, "ingest.triples"):
+        return pipeline.triples(run)
+
+@task_failure.connect
+def _task_failed(sender=None, args=None, exception=None, **_):
+    # final failure only (not retries): make it visible on doc:{id} and batch progress
+    error = f"{type(exception).__name__}: {exception}"[:500]
+    try:
+        if sender.name == "tasks.process_path" and args and len(args) > 1:
+            pipeline.fail_document(args[1], error)
+        elif sender.name in ("tasks.embed_batch", "tasks.finalize_run", "tasks.triples_run") and args:
+            pipeline.fail(args[0], error)
+    except Exception:
+        pass
+
+# ingest needs no reranker
+WARM = ("tokenizer", "embedder", "llm")
+
+@worker_init.connect
+def _preload(**_):
+    # parent, before the pool forks: children inherit the loaded weights
+    if WORKER_PRELOAD:
+        warmup.preload(WARM)
+
+@worker_process_init.connect
+def _init_process(**_):
+    # exporters start threads, so set up tracing after the fork
+    tracing.setup("kg-worker")
+    # off the init hook (the pool gives it a few seconds); beats start once warm-up succeeds
+    threading.Thread(target=_heartbeat, daemon=True).start()
+
+# ---- Liveness beacon (the API checks it instead of a broadcast ping) ----
+def _heartbeat():
+    import redis
+    # a child that cannot embed must not count as a live worker: no beats until warm-up succeeds
+    while not warmup.warm(WARM):
+        log.error("worker warm-up incomplete (%s); retrying before advertising", warmup.status()["components"])
+        time.sleep(6 * WORKER_HEARTBEAT_S)
+    r = redis.Redis.from_url(REDIS_URL, socket_timeout=3, socket_connect_timeout=3)
+    me = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        try:
+            now = time.time()
+            pipe = r.pipeline()
+            pipe.zadd(WORKERS_KEY, {me: now})
+            pipe.zremrangebyscore(WORKERS_KEY, 0, now - 6 * WORKER_HEARTBEAT_S)
+            pipe.execute()
+        except Exception:
+            pass
+        time.sleep(WORKER_HEARTBEAT_S)
+
+@worker_process_shutdown.connect
+def _process_gone(pid=None, **_):
+    if PROM_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
+    try:
+        import redis
+        redis.Redis.from_url(REDIS_URL, socket_timeout=1).zrem(WORKERS_KEY, f"{socket.gethostname()}:{pid or os.getpid()}")
+    except Exception:
+        pass
 
 # ---- Optional: metrics on :9808 ----
 def _metrics_server():
-    start_http_server(9808)
+    if PROM_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(9808, registry=registry)
+    else:
+        start_http_server(9808)
     while True:
         time.sleep(5)
 
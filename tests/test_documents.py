@@ -0,0 +1,65 @@
+# tests/test_documents.py
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from kg_common.documents import (
+    DOC_HASH_KEY, DOC_NAME_KEY, _aforget_identity, doc_key, hash_field, name_field, new_doc_id, resolve_identity,
+)
+
+
+def test_delete_keeps_name_taken_over_by_newer_upload():
+    r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+    async def run():
+        # report.pdf uploaded as A, then changed content uploaded as B (no replace)
+        await r.hset(DOC_HASH_KEY, mapping={hash_field("h-a", "t"): "A", hash_field("h-b", "t"): "B"})
+        await r.hset(DOC_NAME_KEY, name_field("report.pdf", "t"), "B")
+        await _aforget_identity(r, "A", {"tenant": "t", "content_hash": "h-a", "filename": "report.pdf"})
+        return await r.hgetall(DOC_NAME_KEY), await r.hgetall(DOC_HASH_KEY)
+
+    names, hashes = asyncio.run(run())
+    assert names == {name_field("report.pdf", "t"): "B"}
+    assert hashes == {hash_field("h-b", "t"): "B"}
+
+
+def test_delete_drops_fields_it_still_owns():
+    r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+    async def run():
+        await r.hset(DOC_HASH_KEY, "h-a", "A")
+        await r.hset(DOC_NAME_KEY, "report.pdf", "A")
+        await _aforget_identity(r, "A", {"content_hash": "h-a", "filename": "report.pdf"})
+        return await r.hgetall(DOC_NAME_KEY), await r.hgetall(DOC_HASH_KEY)
+
+    assert asyncio.run(run()) == ({}, {})
+
+
+def _seeded():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    r.hset(DOC_HASH_KEY, hash_field("h-a", "t"), "A")
+    r.hset(doc_key("A"), "tags", '["x"]')
+    r.hset(DOC_NAME_KEY, name_field("report.pdf", "t"), "A")
+    return r
+
+
+def test_identical_upload_is_unchanged():
+    assert resolve_identity(_seeded(), "h-a", "other.pdf", ["x"], "t") == ("unchanged", "A")
+
+
+def test_identical_content_with_new_tags_reuses_doc():
+    assert resolve_identity(_seeded(), "h-a", "other.pdf", ["y"], "t") == ("queued", "A")
+
+
+def test_same_name_is_a_new_document_without_replace():
+    assert resolve_identity(_seeded(), "h-b", "report.pdf", [], "t") == ("queued", new_doc_id("h-b", "t"))
+
+
+def test_same_name_with_replace_reuses_doc():
+    assert resolve_identity(_seeded(), "h-b", "report.pdf", [], "t", replace=True) == ("queued", "A")
+
+
+def test_explicit_doc_id_wins():
+    assert resolve_identity(_seeded(), "h-b", "report.pdf", [], "t", doc_id="C", replace=True) == ("queued", "C")
@@ -0,0 +1,26 @@
+# tests/test_query_filters.py
+import pytest
+
+pytest.importorskip("qdrant_client")
+
+from kg_common.kg import doc_graph
+from kg_common.query import _kg_graphs
+from kg_common.vector import SearchFilter
+
+
+def test_unfiltered_reads_every_graph():
+    assert _kg_graphs(None) is None
+
+
+def test_doc_ids_alone_read_their_graphs():
+    assert _kg_graphs(SearchFilter.of(doc_ids=["a", "b"])) == [doc_graph("a"), doc_graph("b")]
+
+
+def test_tenant_with_foreign_doc_id_skips_kg():
+    # tenant A asking for B's document gets no vector hits and must get no facts either
+    assert _kg_graphs(SearchFilter.of(doc_ids=["doc-of-b"], tenant="A")) == []
+
+
+@pytest.mark.parametrize("extra", [{"tags": ["x"]}, {"date_from": 0}, {"date_to": 1}])
+def test_other_filters_next_to_doc_ids_skip_kg(extra):
+    assert _kg_graphs(SearchFilter.of(doc_ids=["a"], **extra)) == []